@@ -0,0 +1,88 @@
+import os
+import threading
+
+# Adaptive probe intervals - can be overridden by environment variables.
+# A server that keeps failing is probed `BACKOFF_FACTOR` times less often
+# after every failure, up to BACKOFF_MAX_INTERVAL seconds (1 disables it).
+BACKOFF_FACTOR = float(os.getenv("AGENT_BACKOFF_FACTOR", "2"))
+BACKOFF_MAX_INTERVAL = float(os.getenv("AGENT_BACKOFF_MAX_INTERVAL", "600"))
+# When a stable server flips between up and down, this many extra probes
+# follow CONFIRM_DELAY seconds apart (0 disables the burst). The default
+# lets the down threshold of 3 be reached within a few seconds.
+CONFIRM_PROBES = int(os.getenv("AGENT_CONFIRM_PROBES", "2"))
+CONFIRM_DELAY = float(os.getenv("AGENT_CONFIRM_DELAY", "1"))
+
+
+class _IntervalState:
+    __slots__ = ("success", "streak", "confirmations")
+
+    def __init__(self, confirm_probes, success=True):
+        self.success = success
+        # A stable streak, so the first change of state is confirmed
+        self.streak = confirm_probes + 1
+        self.confirmations = 0
+
+
+class AdaptiveIntervals:
+    """
+    Picks when each server is probed next from its recent results.
+
+    - A server that changes state after a stable streak gets a burst of
+      `confirm_probes` quick follow-up probes, so an outage or a recovery
+      is confirmed in seconds instead of several intervals.
+    - A server that stays down after that is backed off exponentially, so
+      a dead rack does not spend the probe budget of the healthy servers.
+    - A server that alternates on every probe is not treated as stable,
+      so flapping never keeps it in permanent bursts.
+
+    Servers start out as up, like in the alert tracker, unless seeded with
+    the state the tracker loaded.
+    """
+
+    def __init__(self, backoff_factor=None, backoff_max=None, confirm_probes=None, confirm_delay=None):
+        self.backoff_factor = BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.backoff_max = BACKOFF_MAX_INTERVAL if backoff_max is None else backoff_max
+        self.confirm_probes = CONFIRM_PROBES if confirm_probes is None else confirm_probes
+        self.confirm_delay = CONFIRM_DELAY if confirm_delay is None else confirm_delay
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def next_delay(self, server_id, interval, success):
+        """
+        Feed one probe result.
+
+        Returns:
+            float: seconds until the next probe, or None for the regular interval
+        """
+        with self._lock:
+            current = self._states.get(server_id)
+            if current is None:
+                current = self._states[server_id] = _IntervalState(self.confirm_probes)
+
+            if success != current.success:
+                if current.streak > self.confirm_probes:
+                    current.confirmations = self.confirm_probes
+                current.success = success
+                current.streak = 0
+            current.streak += 1
+
+            if current.confirmations:
+                current.confirmations -= 1
+                return self.confirm_delay
+            if success or self.backoff_factor <= 1:
+                return None
+            # Failures since the burst ended: 1 is the regular interval
+            steps = current.streak - self.confirm_probes - 1
+            if steps <= 0:
+                return None
+            return min(interval * self.backoff_factor ** min(steps, 64), max(interval, self.backoff_max))
+
+    def seed(self, server_id, success):
+        """Start a server as stable up or down, e.g. down when it already was before a restart."""
+        with self._lock:
+            self._states[server_id] = _IntervalState(self.confirm_probes, success)
+
+    def forget(self, server_id):
+        """Drop a removed server's state."""
+        with self._lock:
+            self._states.pop(server_id, None)
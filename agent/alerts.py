@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+from sqlalchemy import func, select
+from db.models import AlertLog, PingLog
+from db.partitions import log_sources
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Consecutive failures before a server is declared down, and consecutive
+# successes before a down server is declared recovered - can be overridden
+# by environment variables. A recovery threshold above 1 keeps a flapping
+# server from alerting on every blip.
+ALERT_DOWN_THRESHOLD = int(os.getenv("AGENT_ALERT_DOWN_THRESHOLD", "3"))
+ALERT_UP_THRESHOLD = int(os.getenv("AGENT_ALERT_UP_THRESHOLD", "1"))
+
+UP = "up"
+DOWN = "down"
+
+class _ServerState:
+    __slots__ = ("state", "failures", "successes")
+
+    def __init__(self, state=UP, failures=0, successes=0):
+        self.state = state
+        self.failures = failures
+        self.successes = successes
+
+class AlertTracker:
+    """
+    Per-server up/down state machine fed with every probe result.
+
+    An up server goes down after `down_threshold` consecutive failures and
+    a down server comes back up after `up_threshold` consecutive successes.
+    Only those transitions produce an alert, and evaluating a result is a
+    couple of counter updates - no history is read back from the database.
+    """
+
+    def __init__(self, down_threshold=None, up_threshold=None):
+        self.down_threshold = down_threshold or ALERT_DOWN_THRESHOLD
+        self.up_threshold = up_threshold or ALERT_UP_THRESHOLD
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def state(self, server_id):
+        """Current state of a server, UP until proven otherwise."""
+        current = self._states.get(server_id)
+        return current.state if current else UP
+
+    def observe(self, server_id, success):
+        """
+        Feed one probe result.
+
+        Returns:
+            tuple: (alert_type, message) when the server changed state, else None
+        """
+        with self._lock:
+            current = self._states.get(server_id)
+            if current is None:
+                current = self._states[server_id] = _ServerState()
+
+            if success:
+                current.failures = 0
+                current.successes += 1
+                if current.state == DOWN and current.successes >= self.up_threshold:
+                    current.state = UP
+                    return "recovery", "Server recovered after downtime."
+            else:
+                current.successes = 0
+                current.failures += 1
+                if current.state == UP and current.failures >= self.down_threshold:
+                    current.state = DOWN
+                    return "downtime", f"Server failed {current.failures} consecutive pings."
+            return None
+
+    def forget(self, server_id):
+        """Drop a removed server's state."""
+        with self._lock:
+            self._states.pop(server_id, None)
+
+    def load(self, session, server_ids):
+        """
+        Rebuild the state of `server_ids` from the database.
+
+        The last downtime/recovery alert gives the state, and the newest
+        ping logs give the current streak, so a restart neither repeats
+        an alert nor forgets a server that was already down. This runs
+        once at startup: one query for the alerts, then one short index
+        read per server.
+        """
+        latest = (
+            select(func.max(AlertLog.id))
+            .where(AlertLog.alert_type.in_(("downtime", "recovery")))
+            .group_by(AlertLog.server_id)
+        )
+        last_alerts = dict(
+            session.query(AlertLog.server_id, AlertLog.alert_type).filter(AlertLog.id.in_(latest)).all()
+        )
+
+        window = max(self.down_threshold, self.up_threshold)
+        # Newest month partition first, then the main table
+        main, *partitions = log_sources(session.connection())
+        sources = partitions[::-1] + [main]
+        states = {}
+        for server_id in server_ids:
+            query = (
+                select(PingLog.timestamp, PingLog.id, PingLog.success)
+                .where(PingLog.server_id == server_id)
+                .order_by(PingLog.timestamp.desc(), PingLog.id.desc())
+                .limit(window)
+            )
+            rows = []
+            for options in sources:
+                rows += session.execute(query, execution_options=options).all()
+                if len(rows) >= window:
+                    break
+            recent = [success for _, _, success in sorted(rows, reverse=True)[:window]]
+            streak = 0
+            for success in recent:
+                if success != recent[0]:
+                    break
+                streak += 1
+            current = _ServerState(DOWN if last_alerts.get(server_id) == "downtime" else UP)
+            if recent and recent[0]:
+                current.successes = streak
+            elif recent:
+                current.failures = streak
+            states[server_id] = current
+
+        with self._lock:
+            self._states.update(states)
+        down = sum(1 for current in states.values() if current.state == DOWN)
+        logging.info(f"🚦 Alert state loaded for {len(states)} servers ({down} down)")
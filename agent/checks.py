@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import random
+import ssl
+import struct
+import time
+from urllib.parse import urlsplit
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Check types a server can use; "icmp" is handled by the engine's prober
+CHECK_TYPES = ("icmp", "tcp", "http", "dns")
+
+# HTTP checks - can be overridden by environment variables
+HTTP_METHOD = os.getenv("AGENT_HTTP_METHOD", "HEAD").upper()
+HTTP_MAX_IDLE_PER_HOST = int(os.getenv("AGENT_HTTP_MAX_IDLE_PER_HOST", "4"))
+HTTP_IDLE_TIMEOUT = float(os.getenv("AGENT_HTTP_IDLE_TIMEOUT", "30"))
+HTTP_MAX_BODY = 1024 * 1024  # GET bodies are read and discarded, up to this size
+HTTP_USER_AGENT = "lord-of-the-pings"
+
+DNS_DEFAULT_PORT = 53
+DNS_QUERY_TYPES = {"A": 1, "AAAA": 28}
+DNS_QUERY_TYPE = os.getenv("AGENT_DNS_QUERY_TYPE", "A").upper()
+
+_DNS_HEADER = struct.Struct("!HHHHHH")
+
+
+def _result(success, started):
+    return {"success": success, "response_time": (time.perf_counter() - started) * 1000 if success else None}
+
+
+def _failed():
+    return {"success": False, "response_time": None}
+
+
+class TcpChecker:
+    """Succeeds when a TCP connection to the server's port is accepted."""
+
+    async def check(self, target, timeout):
+        if not target.port:
+            logging.warning(f"TCP check for {target.name} has no port")
+            return _failed()
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(target.ip_address, target.port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return _failed()
+        result = _result(True, started)
+        writer.close()
+        return result
+
+    def close(self):
+        pass
+
+
+class _HttpResponseError(Exception):
+    """The response could not be parsed; the connection is not reused."""
+
+
+class HttpChecker:
+    """
+    HTTP(S) check with keep-alive connections pooled per host.
+
+    The request goes to the server's IP address (and `port`, or the URL's
+    port), with the URL's host name in the Host header and for TLS, so a
+    name-based virtual host is checked on one specific machine. Any status
+    below 400 counts as up. Idle connections are reused for the next check
+    of the same host, which saves the TCP and TLS handshakes every interval.
+    """
+
+    def __init__(self, method=None, max_idle_per_host=None, idle_timeout=None):
+        self.method = method or HTTP_METHOD
+        self.max_idle_per_host = HTTP_MAX_IDLE_PER_HOST if max_idle_per_host is None else max_idle_per_host
+        self.idle_timeout = HTTP_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self._idle = {}
+        self._ssl_context = None
+
+    def _endpoint(self, target):
+        url = urlsplit(target.url or f"http://{target.ip_address}/")
+        scheme = url.scheme.lower() or "http"
+        port = target.port or url.port or (443 if scheme == "https" else 80)
+        host = url.hostname or target.ip_address
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        return (scheme, target.ip_address, port, host), path
+
+    async def check(self, target, timeout):
+        key, path = self._endpoint(target)
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(self._request(key, path), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, _HttpResponseError, ssl.SSLError):
+            return _failed()
+        return _result(status < 400, started)
+
+    async def _request(self, key, path):
+        connection = self._acquire(key)
+        if connection is not None:
+            try:
+                return await self._exchange(key, connection, path)
+            except (OSError, asyncio.IncompleteReadError):
+                pass  # The server closed the idle connection, try once on a fresh one
+        return await self._exchange(key, await self._connect(key), path)
+
+    async def _connect(self, key):
+        scheme, ip_address, port, host = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return await asyncio.open_connection(ip_address, port, ssl=self._ssl_context, server_hostname=host)
+        return await asyncio.open_connection(ip_address, port)
+
+    async def _exchange(self, key, connection, path):
+        try:
+            return await self._roundtrip(key, connection, path)
+        except BaseException:
+            connection[1].close()  # Never return a half-read connection to the pool
+            raise
+
+    async def _roundtrip(self, key, connection, path):
+        reader, writer = connection
+        scheme, _, port, host = key
+        default_port = 443 if scheme == "https" else 80
+        host_header = host if port == default_port else f"{host}:{port}"
+        writer.write(
+            f"{self.method} {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: {HTTP_USER_AGENT}\r\n"
+            "Accept: */*\r\nConnection: keep-alive\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+        try:
+            version, status, *_ = (await reader.readuntil(b"\r\n")).decode("latin-1").split(" ", 2)
+            status = int(status)
+        except (ValueError, asyncio.LimitOverrunError):
+            raise _HttpResponseError()
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = version.upper() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if self.method != "HEAD" and status >= 200 and status not in (204, 304):
+            try:
+                reusable = await self._discard_body(reader, headers) and reusable
+            except (ValueError, asyncio.LimitOverrunError):
+                raise _HttpResponseError()
+
+        if reusable:
+            self._release(key, connection)
+        else:
+            writer.close()
+        return status
+
+    async def _discard_body(self, reader, headers):
+        """Read past the response body. Returns False when the connection cannot be reused."""
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            total = 0
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                total += size
+                if total > HTTP_MAX_BODY:
+                    return False
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    return True
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > HTTP_MAX_BODY:
+                return False
+            await reader.readexactly(length)
+            return True
+        return False  # Body ends when the server closes the connection
+
+    def _acquire(self, key):
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            reader, writer, expires = idle.pop()
+            if expires > now and not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _release(self, key, connection):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) >= self.max_idle_per_host:
+            connection[1].close()
+            return
+        idle.append((*connection, time.monotonic() + self.idle_timeout))
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle = {}
+
+
+def build_dns_query(ident, name, query_type):
+    """Build a recursive DNS query for one name."""
+    labels = b"".join(
+        bytes([len(label)]) + label for label in (part.encode("idna") for part in name.rstrip(".").split("."))
+    )
+    return _DNS_HEADER.pack(ident, 0x0100, 1, 0, 0, 0) + labels + b"\0" + struct.pack("!HH", query_type, 1)
+
+
+def parse_dns_response(packet, ident):
+    """
+    Parse the header of a DNS response.
+
+    Returns:
+        tuple: (rcode, answer_count), or None if the packet is not a response to `ident`
+    """
+    if len(packet) < _DNS_HEADER.size:
+        return None
+    reply_id, flags, _, answers, _, _ = _DNS_HEADER.unpack_from(packet)
+    if reply_id != ident or not flags & 0x8000:
+        return None
+    return flags & 0x000F, answers
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    def __init__(self, ident, reply):
+        self.ident = ident
+        self.reply = reply
+
+    def datagram_received(self, data, addr):
+        parsed = parse_dns_response(data, self.ident)
+        if parsed is not None and not self.reply.done():
+            self.reply.set_result(parsed)
+
+    def error_received(self, exc):
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+class DnsChecker:
+    """
+    Asks the DNS server at the server's address (and `port`, default 53) to
+    resolve the name in `url`. Succeeds on a NOERROR answer with at least one
+    record, so both a dead resolver and a missing record count as down.
+    """
+
+    def __init__(self, query_type=None):
+        self.query_type = DNS_QUERY_TYPES.get(query_type or DNS_QUERY_TYPE, 1)
+
+    async def check(self, target, timeout):
+        if not target.url:
+            logging.warning(f"DNS check for {target.name} has no name to resolve")
+            return _failed()
+        loop = asyncio.get_running_loop()
+        ident = random.getrandbits(16)
+        reply = loop.create_future()
+        started = time.perf_counter()
+        transport = None
+        try:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DnsProtocol(ident, reply),
+                remote_addr=(target.ip_address, target.port or DNS_DEFAULT_PORT)
+            )
+            transport.sendto(build_dns_query(ident, target.url, self.query_type))
+            rcode, answers = await asyncio.wait_for(reply, timeout)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return _failed()
+        finally:
+            if transport is not None:
+                transport.close()
+        return _result(rcode == 0 and answers > 0, started)
+
+    def close(self):
+        pass
+
+
+def default_checkers():
+    """The checkers a probe engine uses for every check type besides ICMP."""
+    return {"tcp": TcpChecker(), "http": HttpChecker(), "dns": DnsChecker()}
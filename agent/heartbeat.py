@@ -1,7 +1,5 @@
-import platform
-import subprocess
-import time
 import logging
+from agent.probe_engine import ProbeTarget, default_engine
 
 # Configure logging
 logging.basicConfig(
@@ -26,18 +24,6 @@ def ping_host(ip_address, retries=2):
     return result  # Final failed attempt
 
 def _single_ping(ip_address):
-    """Perform a single ping attempt."""
-    param = "-n" if platform.system().lower() == "windows" else "-c"
-    cmd = ["ping", param, "1", ip_address]
-
-    try:
-        start = time.time()
-        subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=3)
-        duration = (time.time() - start) * 1000
-        return {"success": True, "response_time": round(duration, 2)}
-    except subprocess.TimeoutExpired:
-        logging.warning(f"Ping to {ip_address} timed out")
-        return {"success": False, "response_time": None}
-    except Exception as e:
-        logging.error(f"Error pinging {ip_address}: {e}")
-        return {"success": False, "response_time": None}
+    """Perform a single ping attempt through the shared probe engine."""
+    target = ProbeTarget(server_id=None, name=ip_address, ip_address=ip_address)
+    return default_engine().submit(target).result()
@@ -1,8 +1,11 @@
 import logging
+import threading
 from datetime import datetime
-from db.models import PingLog, Server, AlertLog
+from db.models import Server
 from db.init_db import init_db
+from agent.alerts import AlertTracker
 from agent.heartbeat import ping_host
+from agent.writer import AlertRecord, ProbeRecord, write_batch
 
 # Configure logging
 logging.basicConfig(
@@ -11,83 +14,56 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# Alert state shared by every call in this process
+_tracker = None
+_tracker_lock = threading.Lock()
+
 def log_ping_for_server(server):
     """Pings a server and logs the result into PingLog."""
+    session = None
     try:
         session = init_db()
         result = ping_host(server.ip_address)
+        record_ping_result(session, server, result)
+    except Exception as e:
+        logging.error(f"Error in log_ping_for_server: {e}")
+    finally:
+        if session is not None:
+            session.close()
 
-        ping_log = PingLog(
+def default_tracker(session):
+    """Process-wide alert tracker, loaded from the database on first use."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            tracker = AlertTracker()
+            tracker.load(session, [server_id for (server_id,) in session.query(Server.id)])
+            _tracker = tracker
+    return _tracker
+
+def record_ping_result(session, server, result):
+    """Logs an already collected ping result into PingLog/PingResult and raises alerts."""
+    try:
+        record = ProbeRecord(
             server_id=server.id,
             timestamp=datetime.utcnow(),
+            success=result["success"],
             response_time=result["response_time"],
-            success=result["success"]
+            check_type=server.check_type or "icmp"
         )
+        records = [record]
+        alert = default_tracker(session).observe(server.id, record.success)
+        if alert is not None:
+            alert_type, message = alert
+            records.append(AlertRecord(server.id, record.timestamp, alert_type, message))
 
-        session.add(ping_log)
+        # Same statements as the agent's batched writer, so PingResult and
+        # the server's last ping time stay current
+        write_batch(session.connection(), records)
         session.commit()
-        logging.info(f"📡 Logged: {ping_log}")
-
-        if should_trigger_downtime_alert(session, server.id):
-            alert = AlertLog(
-                server_id=server.id,
-                alert_type="downtime",
-                message="Server failed 3 consecutive pings."
-            )
-            session.add(alert)
-            session.commit()
+        logging.info(f"📡 Logged: {record}")
+        for alert in records[1:]:
             logging.info(f"🚨 Alert triggered: {alert}")
-
-        if should_trigger_recovery_alert(session, server.id):
-            alert = AlertLog(
-                server_id=server.id,
-                alert_type="recovery",
-                message="Server recovered after downtime."
-            )
-            session.add(alert)
-            session.commit()
-            logging.info(f"✅ Recovery alert triggered: {alert}")
-    except Exception as e:
-        logging.error(f"Error in log_ping_for_server: {e}")
-
-def should_trigger_downtime_alert(session, server_id, window=3):
-    """
-    Checks if the last `window` logs were all failures.
-    """
-    try:
-        logs = (
-            session.query(PingLog)
-            .filter_by(server_id=server_id)
-            .order_by(PingLog.timestamp.desc())
-            .limit(window)
-            .all()
-        )
-        return len(logs) == window and all(not log.success for log in logs)
-    except Exception as e:
-        logging.error(f"Error in should_trigger_downtime_alert: {e}")
-        return False
-
-def should_trigger_recovery_alert(session, server_id):
-    """
-    Triggers recovery alert if the most recent ping is successful,
-    and at least 3 previous logs were failures.
-    """
-    try:
-        logs = (
-            session.query(PingLog)
-            .filter_by(server_id=server_id)
-            .order_by(PingLog.timestamp.desc())
-            .limit(4)
-            .all()
-        )
-
-        if len(logs) < 4:
-            return False
-
-        return (
-            logs[0].success and        # most recent ping succeeded
-            all(not log.success for log in logs[1:])  # previous 3 were failures
-        )
     except Exception as e:
-        logging.error(f"Error in should_trigger_recovery_alert: {e}")
-        return False
+        session.rollback()
+        logging.error(f"Error in record_ping_result: {e}")
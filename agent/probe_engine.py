@@ -0,0 +1,211 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import platform
+import re
+import threading
+import time
+from collections import namedtuple
+from agent.checks import default_checkers
+from agent.icmp import IcmpProber
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Concurrency limits - can be overridden by environment variables
+MAX_INFLIGHT = int(os.getenv("AGENT_MAX_INFLIGHT", "200"))
+MAX_INFLIGHT_PER_SUBNET = int(os.getenv("AGENT_MAX_INFLIGHT_PER_SUBNET", "32"))
+SUBNET_PREFIX_V4 = int(os.getenv("AGENT_SUBNET_PREFIX", "24"))
+SUBNET_PREFIX_V6 = int(os.getenv("AGENT_SUBNET_PREFIX_V6", "64"))
+PROBE_TIMEOUT = float(os.getenv("AGENT_PROBE_TIMEOUT", "2"))
+
+# Probe backend: "icmp" (built-in sockets), "subprocess" (system ping) or "auto"
+PROBE_BACKEND = os.getenv("AGENT_PROBE_BACKEND", "auto").lower()
+
+# Worker processes to spread probes over (0 probes in the agent process itself)
+PROBE_WORKERS = int(os.getenv("AGENT_PROBE_WORKERS", "0"))
+
+# A probe target is decoupled from the ORM so it can safely cross threads.
+# `port` and `url` are only used by the TCP, HTTP and DNS check types.
+ProbeTarget = namedtuple(
+    "ProbeTarget", ["server_id", "name", "ip_address", "check_type", "port", "url"],
+    defaults=("icmp", None, None)
+)
+
+_RTT_PATTERN = re.compile(r"time[=<]\s*([\d.]+)\s*ms", re.IGNORECASE)
+
+
+def failed_result():
+    """Result returned for a probe that did not get a reply."""
+    return {"success": False, "response_time": None}
+
+
+def subnet_key(ip_address):
+    """Return the subnet an address belongs to, used for per-subnet limits."""
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return ip_address
+    prefix = SUBNET_PREFIX_V4 if ip.version == 4 else SUBNET_PREFIX_V6
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+class SubprocessProber:
+    """Probes a host by running the system `ping` command asynchronously."""
+
+    def _command(self, ip_address, timeout):
+        if platform.system().lower() == "windows":
+            return ["ping", "-n", "1", "-w", str(int(timeout * 1000)), ip_address]
+        return ["ping", "-c", "1", "-W", str(max(1, round(timeout))), ip_address]
+
+    async def ping(self, ip_address, timeout):
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *self._command(ip_address, timeout),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout + 3)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logging.warning(f"Ping to {ip_address} timed out")
+            return failed_result()
+
+        if proc.returncode != 0:
+            return failed_result()
+
+        # Prefer the RTT reported by ping itself over our wall clock
+        match = _RTT_PATTERN.search(stdout.decode(errors="replace"))
+        if match:
+            response_time = float(match.group(1))
+        else:
+            response_time = (time.perf_counter() - start) * 1000
+        return {"success": True, "response_time": round(response_time, 2)}
+
+
+def create_prober(backend=None):
+    """Create the prober for the configured backend, falling back to `ping`."""
+    backend = (backend or PROBE_BACKEND).lower()
+    if backend == "subprocess":
+        return SubprocessProber()
+    if backend in ("auto", "icmp"):
+        if IcmpProber.available():
+            return IcmpProber()
+        logging.warning("ICMP sockets are not permitted, falling back to the ping command")
+        return SubprocessProber()
+    raise ValueError(f"Unknown probe backend: {backend}")
+
+
+class ProbeEngine:
+    """
+    Runs probes concurrently on a background asyncio event loop.
+
+    In-flight probes are bounded globally and per target subnet, so a dark
+    subnet cannot use up every slot while its probes wait to time out.
+    ICMP probes go to `prober`; the other check types go to their checker,
+    under the same limits.
+    """
+
+    def __init__(self, prober=None, max_inflight=None, max_per_subnet=None, timeout=None, checkers=None):
+        self.prober = prober or create_prober()
+        self.checkers = default_checkers() if checkers is None else checkers
+        self.max_inflight = max_inflight or MAX_INFLIGHT
+        self.max_per_subnet = max_per_subnet or MAX_INFLIGHT_PER_SUBNET
+        self.timeout = timeout or PROBE_TIMEOUT
+        self._loop = None
+        self._thread = None
+        self._inflight = None
+        self._subnet_limits = {}
+
+    def start(self):
+        """Start the event loop thread (idempotent)."""
+        if self._thread is not None:
+            return self
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(ready,), name="probe-engine", daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        ready.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        """Stop the event loop thread."""
+        if self._thread is None:
+            return
+        # Prober sockets are registered with the loop, close them from it
+        for closeable in (self.prober, *self.checkers.values()):
+            if hasattr(closeable, "close"):
+                self._loop.call_soon_threadsafe(closeable.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+        self._subnet_limits = {}
+
+    def _subnet_limit(self, ip_address):
+        key = subnet_key(ip_address)
+        limit = self._subnet_limits.get(key)
+        if limit is None:
+            limit = self._subnet_limits[key] = asyncio.Semaphore(self.max_per_subnet)
+        return limit
+
+    async def probe(self, target):
+        """Probe a single target, honouring the concurrency limits."""
+        # Take the subnet slot first so waiting on a busy subnet never
+        # holds one of the global slots.
+        async with self._subnet_limit(target.ip_address):
+            async with self._inflight:
+                try:
+                    if target.check_type in (None, "icmp"):
+                        return await self.prober.ping(target.ip_address, self.timeout)
+                    checker = self.checkers.get(target.check_type)
+                    if checker is None:
+                        logging.error(f"Unknown check type {target.check_type!r} for {target.name}")
+                        return failed_result()
+                    return await checker.check(target, self.timeout)
+                except Exception as e:
+                    logging.error(f"Error probing {target.ip_address} ({target.check_type}): {e}")
+                    return failed_result()
+
+    def submit(self, target):
+        """Schedule a probe and return a concurrent.futures.Future for its result."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.probe(target), self._loop)
+
+    def probe_many(self, targets):
+        """Probe all targets concurrently and return (target, result) pairs."""
+        futures = [(target, self.submit(target)) for target in targets]
+        return [(target, future.result()) for target, future in futures]
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def default_engine():
+    """Return the process-wide probe engine, starting it on first use."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            if PROBE_WORKERS > 0:
+                from agent.workers import ProcessProbePool
+                _default_engine = ProcessProbePool(PROBE_WORKERS).start()
+            else:
+                _default_engine = ProbeEngine().start()
+        return _default_engine
@@ -0,0 +1,318 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from db.init_db import init_db, session_scope, writer_session_scope
+from db.retention import enforce_retention
+from db.models import Server
+from db.utils import get_setting, set_setting
+from agent.adaptive import AdaptiveIntervals
+from agent.alerts import DOWN, AlertTracker
+from agent.probe_engine import ProbeTarget, default_engine, failed_result
+from agent.scheduler import ProbeScheduler
+from agent.sharding import AGENT_ID, HashRing, live_agent_ids, record_heartbeat, remove_heartbeat
+from agent.spool import SPOOL_ENABLED, SpoolWriter
+from agent.writer import AlertRecord, ProbeRecord, ResultWriter
+from telemetry.metrics import Counter, Gauge, Histogram
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# How often the heartbeat, pause flag and server config version are checked
+HOUSEKEEPING_INTERVAL = float(os.getenv("AGENT_HOUSEKEEPING_INTERVAL", "5"))
+# Full reload of the server list, catching edits made outside the dashboard
+RESYNC_INTERVAL = float(os.getenv("AGENT_RESYNC_INTERVAL", "300"))
+# How often old ping/alert history is pruned in the background (0 disables it)
+RETENTION_INTERVAL = float(os.getenv("AGENT_RETENTION_INTERVAL", "3600"))
+
+PROBES = Counter("agent_probes_total", "Probe results collected, by outcome.", ["result"])
+PROBES_SUCCEEDED = PROBES.labels("success")
+PROBES_FAILED = PROBES.labels("failure")
+PROBE_RTT = Histogram("agent_probe_rtt_seconds", "Round-trip time of successful probes.")
+PROBE_LATENESS = Histogram(
+    "agent_probe_lateness_seconds", "How long after its scheduled time a probe was dispatched.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+CYCLE_SECONDS = Histogram(
+    "agent_cycle_seconds", "Busy time of one agent loop iteration (housekeeping, dispatch, collection)."
+)
+PROBES_INFLIGHT = Gauge("agent_probes_inflight", "Probes dispatched whose result has not been collected yet.")
+RESULTS_QUEUED = Gauge("agent_results_queue_depth", "Probe results waiting for the agent loop.")
+WRITER_QUEUED = Gauge("agent_writer_queue_depth", "Records waiting for the database writer.")
+SCHEDULED = Gauge("agent_scheduled_servers", "Servers in this agent's schedule.")
+
+def probe_target(server):
+    """Build the engine-side probe target for a server row."""
+    return ProbeTarget(
+        server_id=server.id, name=server.name, ip_address=server.ip_address,
+        check_type=server.check_type or "icmp", port=server.port, url=server.url
+    )
+
+def should_agent_pause():
+    """Check if the agent should pause."""
+    return get_setting("agent_status") == "paused"
+
+class AgentRunner:
+    """
+    Drives the agent: keeps every active server in an in-memory scheduler,
+    dispatches probes to the engine exactly when they are due and hands the
+    results to the batched writer as they come back.
+
+    The server list is only reloaded when the dashboard bumps the
+    `servers_version` setting (or every RESYNC_INTERVAL as a safety net),
+    and changes are applied to the scheduler one server at a time.
+    Alerts come from an in-memory state machine fed with every result,
+    and the next probe of each server is brought forward (to confirm a
+    state change) or backed off (while it stays down) from its results.
+
+    Several runners can share one database: each one writes a heartbeat
+    row, and servers are split between the live agents with a consistent
+    hash ring. When an agent joins, stops or misses its heartbeats, the
+    others see the membership change and resync their share.
+    """
+
+    def __init__(self, engine=None, scheduler=None, writer=None, alerts=None, agent_id=None, clock=time.monotonic,
+                 intervals=None):
+        self.engine = engine or default_engine()
+        # An empty scheduler is falsy, so test for None explicitly
+        self.scheduler = scheduler if scheduler is not None else ProbeScheduler(clock=clock)
+        # With the spool on, results go to local disk first and the database can stall without holding up probes
+        self.writer = writer or (SpoolWriter() if SPOOL_ENABLED else ResultWriter())
+        self.alerts = alerts or AlertTracker()
+        self.intervals = intervals or AdaptiveIntervals()
+        self.agent_id = agent_id or AGENT_ID
+        self.ring = None
+        self.clock = clock
+        self.results = queue.Queue()
+        self.paused = False
+        self.servers_version = None
+        self._next_housekeeping = 0
+        self._next_resync = 0
+        self._stopped = threading.Event()
+        self._retention_thread = None
+        self._probes = 0
+        self._last_heartbeat = None
+        self._inflight = 0
+        self._waited = 0.0
+
+        # Read at scrape time, so they cost nothing on the probe path
+        PROBES_INFLIGHT.set_function(lambda: self._inflight)
+        RESULTS_QUEUED.set_function(self.results.qsize)
+        WRITER_QUEUED.set_function(self.writer.pending)
+        SCHEDULED.set_function(lambda: len(self.scheduler))
+
+    def sync_servers(self, session):
+        """Apply the current set of active servers in this agent's shard to the scheduler."""
+        rows = (
+            session.query(
+                Server.id, Server.name, Server.ip_address, Server.check_type, Server.port, Server.url,
+                Server.ping_interval, Server.last_ping_time
+            )
+            .filter_by(is_active=True)
+            .all()
+        )
+        utcnow = datetime.utcnow()
+        seen = set()
+        new = []
+        updated = 0
+        for row in rows:
+            if self.ring is not None and self.ring.owner(row.id) != self.agent_id:
+                continue
+            seen.add(row.id)
+            target = probe_target(row)
+            interval = row.ping_interval or 60
+            if row.id in self.scheduler:
+                if self.scheduler.payload(row.id) != target or self.scheduler.interval(row.id) != interval:
+                    self.scheduler.update(row.id, interval, payload=target)
+                    updated += 1
+            else:
+                delay = None
+                if row.last_ping_time:
+                    delay = interval - (utcnow - row.last_ping_time).total_seconds()
+                new.append((row.id, interval, delay, target))
+
+        # Servers new to this agent (at startup or taken over from another
+        # agent) continue from their last recorded alert state. Loaded before
+        # they are scheduled, so a failed load is retried on the next sync.
+        added = [server_id for server_id, _, _, _ in new]
+        if added:
+            self.alerts.load(session, added)
+            # A server already down is backed off, not burst-probed as if it had just failed
+            for server_id in added:
+                if self.alerts.state(server_id) == DOWN:
+                    self.intervals.seed(server_id, False)
+        for server_id, interval, delay, target in new:
+            self.scheduler.add(server_id, interval, delay=delay, payload=target)
+
+        removed = [key for key in self.scheduler.keys() if key not in seen]
+        for key in removed:
+            self.scheduler.remove(key)
+            self.alerts.forget(key)
+            self.intervals.forget(key)
+
+        if added or updated or removed:
+            logging.info(f"🗂️ Schedule synced: {len(added)} added, {updated} updated, {len(removed)} removed")
+
+    def heartbeat(self, now):
+        """
+        Publish this agent's heartbeat and load, and refresh the hash ring.
+
+        Returns:
+            bool: True when the set of live agents changed
+        """
+        rate = 0.0
+        if self._last_heartbeat is not None and now > self._last_heartbeat:
+            rate = self._probes * 60 / (now - self._last_heartbeat)
+        self._probes = 0
+        self._last_heartbeat = now
+
+        with writer_session_scope() as session:
+            record_heartbeat(session, self.agent_id, len(self.scheduler), round(rate, 1), self.writer.pending())
+        with session_scope() as session:
+            members = live_agent_ids(session) | {self.agent_id}
+
+        if self.ring is not None and members == self.ring.members:
+            return False
+        logging.info(f"🔗 {len(members)} live agent(s): {', '.join(sorted(members))}")
+        self.ring = HashRing(members)
+        return True
+
+    def housekeeping(self, now):
+        """
+        Heartbeat, pause flag and incremental config sync.
+
+        A locked or unreachable database skips the rest of the run: the
+        agent keeps its last known schedule, ring and pause flag, and goes
+        on probing (into the spool, when it is enabled) until the next run.
+        """
+        try:
+            self._housekeeping(now)
+        except SQLAlchemyError as e:
+            logging.warning(f"⚠️ Housekeeping skipped, keeping the current schedule: {e}")
+
+    def _housekeeping(self, now):
+        set_setting("agent_last_seen", datetime.utcnow().isoformat())
+        ring_changed = self.heartbeat(now)
+        paused = should_agent_pause()
+        if paused != self.paused:
+            logging.info("⏸️ Agent paused." if paused else "▶️ Agent resumed.")
+        self.paused = paused
+
+        version = get_setting("servers_version")
+        if ring_changed or version != self.servers_version or now >= self._next_resync:
+            session = init_db()
+            try:
+                self.sync_servers(session)
+            finally:
+                session.close()
+            self.servers_version = version
+            self._next_resync = now + RESYNC_INTERVAL
+
+    def dispatch_due(self, now):
+        """Hand every due server to the probe engine."""
+        for entry in self.scheduler.pop_due(now):
+            PROBE_LATENESS.observe(max(0.0, now - entry.due))
+            self._inflight += 1
+            dispatched_at = datetime.utcnow()
+            future = self.engine.submit(entry.payload)
+            future.add_done_callback(
+                lambda f, key=entry.key, ts=dispatched_at: self.results.put((key, ts, _future_result(f)))
+            )
+
+    def collect_results(self, timeout):
+        """Wait up to `timeout` seconds for results, evaluate alerts and pass both to the writer."""
+        batch = []
+        started = time.perf_counter()
+        try:
+            batch.append(self.results.get(timeout=max(0, timeout)))
+            self._waited = time.perf_counter() - started
+            while True:
+                batch.append(self.results.get_nowait())
+        except queue.Empty:
+            if not batch:
+                self._waited = time.perf_counter() - started
+
+        now = self.clock()
+        self._inflight -= len(batch)
+        for server_id, timestamp, result in batch:
+            if result["success"]:
+                PROBES_SUCCEEDED.inc()
+                if result["response_time"] is not None:
+                    PROBE_RTT.observe(result["response_time"] / 1000)
+            else:
+                PROBES_FAILED.inc()
+            if server_id not in self.scheduler:
+                continue  # Removed or deactivated while the probe was in flight
+            check_type = self.scheduler.payload(server_id).check_type
+            # Blocks while the writer is backlogged, holding back new dispatches
+            self.writer.submit(ProbeRecord(server_id, timestamp, result["success"], result["response_time"], check_type))
+            self._probes += 1
+            alert = self.alerts.observe(server_id, result["success"])
+            if alert is not None:
+                alert_type, message = alert
+                self.writer.submit(AlertRecord(server_id, timestamp, alert_type, message))
+                logging.info(f"🚨 Alert triggered: {alert_type} for server {server_id}")
+            delay = self.intervals.next_delay(server_id, self.scheduler.interval(server_id), result["success"])
+            self.scheduler.reschedule(server_id, now, delay=delay)
+        return len(batch)
+
+    def step(self):
+        """Run one iteration: housekeeping, dispatch, then sleep until the next deadline."""
+        started = time.perf_counter()
+        now = self.clock()
+        if now >= self._next_housekeeping:
+            self.housekeeping(now)
+            self._next_housekeeping = now + HOUSEKEEPING_INTERVAL
+
+        deadline = self._next_housekeeping
+        if not self.paused:
+            self.dispatch_due(now)
+            next_due = self.scheduler.next_due()
+            if next_due is not None:
+                deadline = min(deadline, next_due)
+        self.collect_results(deadline - self.clock())
+        CYCLE_SECONDS.observe(time.perf_counter() - started - self._waited)
+
+    def run_forever(self):
+        self.writer.start()
+        if RETENTION_INTERVAL > 0:
+            self._retention_thread = threading.Thread(target=self._retention_worker, name="retention", daemon=True)
+            self._retention_thread.start()
+        try:
+            while True:
+                self.step()
+        finally:
+            self.close()
+
+    def _retention_worker(self):
+        """Prune expired history in small batches, off the probe loop."""
+        while not self._stopped.wait(RETENTION_INTERVAL):
+            try:
+                enforce_retention()
+            except Exception as e:
+                logging.error(f"❌ Retention run failed: {e}")
+
+    def close(self):
+        """Flush buffered results to the database and leave the ring before exiting."""
+        self._stopped.set()
+        logging.info("💾 Flushing buffered ping results...")
+        self.writer.stop()
+        try:
+            with writer_session_scope() as session:
+                remove_heartbeat(session, self.agent_id)
+        except Exception as e:
+            logging.error(f"Failed to remove agent heartbeat: {e}")
+
+def _future_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        logging.error(f"Probe failed: {e}")
+        return failed_result()
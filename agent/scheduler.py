@@ -0,0 +1,190 @@
+import heapq
+import itertools
+import os
+import random
+import time
+import zlib
+
+# Scheduling knobs - can be overridden by environment variables
+SCHEDULE_JITTER = float(os.getenv("AGENT_SCHEDULE_JITTER", "0.05"))  # fraction of the interval
+SCHEDULE_SPREAD_MAX = float(os.getenv("AGENT_SCHEDULE_SPREAD_MAX", "60"))  # seconds
+# Global probe budget across all servers (0 = unlimited)
+MAX_PROBES_PER_SECOND = float(os.getenv("AGENT_MAX_PROBES_PER_SECOND", "0"))
+
+
+def spread_offset(key, interval, spread_max=SCHEDULE_SPREAD_MAX):
+    """
+    Stable offset in [0, min(interval, spread_max)) for a schedule key.
+
+    Servers that are all overdue at start-up (or share an interval) get
+    spread across the window instead of firing in the same instant.
+    """
+    fraction = zlib.crc32(str(key).encode()) / 2 ** 32
+    return fraction * min(interval, spread_max)
+
+
+class _Entry:
+    __slots__ = ("key", "interval", "base", "due", "payload", "token", "inflight")
+
+    def __init__(self, key, interval, base, payload):
+        self.key = key
+        self.interval = interval
+        self.base = base
+        self.due = base
+        self.payload = payload
+        self.token = 0
+        self.inflight = False
+
+
+class ProbeScheduler:
+    """
+    In-memory priority queue of probe targets keyed on their next due time.
+
+    Times are `time.monotonic()` seconds. Each entry keeps an unjittered base
+    time that advances by exactly one interval per probe, so jitter never
+    accumulates into drift. Popped entries are "in flight" until they are
+    rescheduled, so a slow probe never overlaps with the next one for the
+    same server.
+
+    With a `max_rate` budget, due entries are handed out through a token
+    bucket holding one second's worth of probes; anything over budget
+    stays queued in due order and goes out as tokens refill.
+    """
+
+    def __init__(self, jitter=SCHEDULE_JITTER, spread_max=SCHEDULE_SPREAD_MAX, clock=time.monotonic, rng=None,
+                 max_rate=None):
+        self.jitter = jitter
+        self.spread_max = spread_max
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.max_rate = MAX_PROBES_PER_SECOND if max_rate is None else max_rate
+        self._burst = max(1.0, self.max_rate)
+        self._tokens = self._burst
+        self._refilled = None
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def payload(self, key):
+        entry = self._entries.get(key)
+        return entry.payload if entry else None
+
+    def interval(self, key):
+        entry = self._entries.get(key)
+        return entry.interval if entry else None
+
+    def _push(self, entry):
+        entry.token += 1
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry.key, entry.token))
+
+    def _jittered(self, entry, span):
+        if not self.jitter:
+            return entry.base
+        return entry.base + self.rng.uniform(-self.jitter, self.jitter) * span
+
+    def _refill(self, now):
+        if self._refilled is not None and now > self._refilled:
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self.max_rate)
+        if self._refilled is None or now > self._refilled:
+            self._refilled = now
+
+    def add(self, key, interval, delay=None, payload=None):
+        """
+        Schedule `key` every `interval` seconds.
+
+        `delay` is the number of seconds until the first probe; when it is
+        None or not positive (the server is overdue) the first probe is
+        spread over the start-up window.
+        """
+        now = self.clock()
+        if delay is None or delay <= 0:
+            delay = spread_offset(key, interval, self.spread_max)
+        entry = _Entry(key, interval, now + delay, payload)
+        self._entries[key] = entry
+        self._push(entry)
+
+    def update(self, key, interval, payload=None):
+        """Apply a configuration change to an existing entry."""
+        entry = self._entries[key]
+        entry.payload = payload
+        if interval == entry.interval:
+            return
+        # Keep the phase of the last probe, but honour the new interval
+        entry.base += interval - entry.interval
+        entry.interval = interval
+        if not entry.inflight:
+            entry.base = max(entry.base, self.clock())
+            entry.due = entry.base
+            self._push(entry)
+
+    def remove(self, key):
+        """Stop scheduling `key`. Stale heap items are skipped lazily."""
+        self._entries.pop(key, None)
+
+    def pop_due(self, now=None):
+        """Pop every entry due at `now` (within the probe budget) and mark it in flight."""
+        now = self.clock() if now is None else now
+        if self.max_rate:
+            self._refill(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            if self.max_rate and self._tokens < 1:
+                break
+            _, _, key, token = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry.token != token or entry.inflight:
+                continue
+            entry.inflight = True
+            due.append(entry)
+            if self.max_rate:
+                self._tokens -= 1
+        return due
+
+    def reschedule(self, key, now=None, delay=None):
+        """
+        Schedule the next probe of an in-flight entry one interval after the last.
+
+        A `delay` overrides the interval for this one probe: the next probe
+        is then `delay` seconds after `now`, and the regular rhythm resumes
+        from there on the following reschedule.
+        """
+        entry = self._entries.get(key)
+        if entry is None or not entry.inflight:
+            return None
+        now = self.clock() if now is None else now
+        entry.inflight = False
+        if delay is not None:
+            entry.base = now + delay
+            span = delay
+        else:
+            entry.base += entry.interval
+            span = entry.interval
+        if entry.base < now:
+            # Missed slots are skipped rather than fired back to back
+            entry.base = now
+        entry.due = self._jittered(entry, span)
+        self._push(entry)
+        return entry.due
+
+    def next_due(self):
+        """Monotonic time of the earliest pending probe the budget allows, or None."""
+        while self._heap:
+            _, _, key, token = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry.token == token and not entry.inflight:
+                due = self._heap[0][0]
+                if self.max_rate and self._tokens < 1 and self._refilled is not None:
+                    # Out of budget: wake up when the next token is available
+                    due = max(due, self._refilled + (1 - self._tokens) / self.max_rate)
+                return due
+            heapq.heappop(self._heap)
+        return None
@@ -0,0 +1,62 @@
+import bisect
+import hashlib
+import os
+import socket
+from datetime import datetime, timedelta
+from db.models import AgentHeartbeat
+
+# Identity of this agent instance - set it to keep the same shard across restarts
+AGENT_ID = os.getenv("AGENT_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# An agent whose heartbeat is older than this is considered dead and its servers are reassigned
+AGENT_HEARTBEAT_TIMEOUT = float(os.getenv("AGENT_HEARTBEAT_TIMEOUT", "30"))
+# Points per agent on the hash ring; more points give a more even split
+RING_REPLICAS = int(os.getenv("AGENT_RING_REPLICAS", "64"))
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent-hash ring assigning server ids to agents.
+
+    Every agent places `replicas` points on the ring and a server belongs to
+    the first point at or after its own hash. When an agent joins or leaves,
+    only the servers on its arcs move; everyone else keeps their owner.
+    """
+
+    def __init__(self, members, replicas=None):
+        self.members = frozenset(members)
+        replicas = replicas or RING_REPLICAS
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def __len__(self):
+        return len(self.members)
+
+    def owner(self, key):
+        """Agent responsible for `key`, or None when the ring is empty."""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[index]
+
+def record_heartbeat(session, agent_id, assigned_servers=0, probes_per_minute=0.0, writer_backlog=0):
+    """Insert or refresh this agent's heartbeat row, in the caller's transaction."""
+    heartbeat = session.get(AgentHeartbeat, agent_id)
+    if heartbeat is None:
+        heartbeat = AgentHeartbeat(agent_id=agent_id, hostname=socket.gethostname(), pid=os.getpid())
+        session.add(heartbeat)
+    heartbeat.last_seen = datetime.utcnow()
+    heartbeat.assigned_servers = assigned_servers
+    heartbeat.probes_per_minute = probes_per_minute
+    heartbeat.writer_backlog = writer_backlog
+
+def live_agent_ids(session, timeout=None):
+    """Ids of every agent that sent a heartbeat within `timeout` seconds."""
+    since = datetime.utcnow() - timedelta(seconds=timeout or AGENT_HEARTBEAT_TIMEOUT)
+    return {agent_id for (agent_id,) in session.query(AgentHeartbeat.agent_id).filter(AgentHeartbeat.last_seen >= since)}
+
+def remove_heartbeat(session, agent_id):
+    """Drop this agent from the ring so the others take over its servers right away."""
+    session.query(AgentHeartbeat).filter_by(agent_id=agent_id).delete()
@@ -0,0 +1,472 @@
+"""
+Local write-ahead spool between the agent loop and the database.
+
+With AGENT_SPOOL enabled, probe results and alerts are appended to
+segment files in a local directory instead of an in-memory queue:
+
+    <spool dir>/<segment number>.spool
+
+Each record is one frame: payload length and CRC32 (little-endian uint32
+each) followed by the record as JSON. Appends only go to the page cache;
+the file is fsynced every AGENT_SPOOL_FSYNC_INTERVAL seconds, so a crash
+loses at most that much and the loop never waits on the disk.
+
+A background thread replays synced frames into the database in batches.
+The position it has replayed up to is stored in `spool_offsets` in the
+same transaction as the rows, so after a crash, a restart or a database
+outage replay resumes exactly where the last commit ended: no row is
+written twice and none is skipped (ping logs in month partitions are the
+exception, see db/partitions.py). A locked or unreachable database only
+delays the replay, while probing and spooling go on.
+
+Disk use is bounded by AGENT_SPOOL_MAX_BYTES: when the database stays
+away long enough to fill it, the oldest unreplayed segment is dropped
+(and counted) rather than letting the spool fill the disk.
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from db.init_db import get_writer_engine
+from db.models import SpoolOffset
+from agent.writer import (
+    AlertRecord, BATCH_ROWS, COMMIT_SECONDS, ProbeRecord, ROWS_WRITTEN, WRITE_FAILURES, WRITER_BATCH_SIZE,
+    WRITER_FLUSH_INTERVAL, write_batch
+)
+from telemetry.metrics import Counter, Gauge, Histogram
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows: the spool directory is not locked there
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Opt-in local spool for probe results - can be overridden by environment variables.
+# Every agent needs its own directory; it is locked while the agent runs.
+SPOOL_ENABLED = os.getenv("AGENT_SPOOL", "false").lower() in ("1", "true", "yes", "on")
+SPOOL_DIR = os.getenv("AGENT_SPOOL_DIR", "spool")
+# Seconds between fsyncs of the spool (the most a crash of the host can lose)
+SPOOL_FSYNC_INTERVAL = float(os.getenv("AGENT_SPOOL_FSYNC_INTERVAL", "0.2"))
+# Size of one segment file, and of the whole spool before the oldest segment is dropped
+SPOOL_SEGMENT_BYTES = int(os.getenv("AGENT_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv("AGENT_SPOOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+SUFFIX = ".spool"
+# payload length, CRC32 of the payload
+_FRAME = struct.Struct("<II")
+
+SPOOL_BYTES = Gauge("agent_spool_bytes", "Size of the local result spool on disk.")
+SPOOL_FSYNC_SECONDS = Histogram("agent_spool_fsync_seconds", "Time to fsync the local result spool.")
+SPOOL_DROPPED = Counter(
+    "agent_spool_records_dropped_total", "Spooled records dropped unreplayed to keep the spool under its size limit."
+)
+
+def encode_record(record):
+    """One spool frame for a ProbeRecord or AlertRecord."""
+    if isinstance(record, AlertRecord):
+        fields = ["a", record.server_id, record.timestamp.isoformat(), record.alert_type, record.message]
+    else:
+        fields = [
+            "p", record.server_id, record.timestamp.isoformat(), record.success, record.response_time,
+            record.check_type
+        ]
+    payload = json.dumps(fields, separators=(",", ":")).encode()
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_record(payload):
+    kind, server_id, timestamp, *fields = json.loads(payload)
+    record_type = AlertRecord if kind == "a" else ProbeRecord
+    return record_type(server_id, datetime.fromisoformat(timestamp), *fields)
+
+def read_frames(path, offset=0, end=None):
+    """
+    Yield (offset after the frame, payload) for the frames of a segment from `offset`.
+
+    Stops at `end`, at the end of the file, or at the first torn or
+    corrupt frame, which is where a crash interrupted an append.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while end is None or offset < end:
+            header = f.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                return
+            length, crc = _FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset += _FRAME.size + length
+            yield offset, payload
+
+class Spool:
+    """
+    Append-only segment files of one agent.
+
+    Positions are (segment number, byte offset) tuples and compare in
+    spool order. Writing always starts a new segment, so segments left
+    by an earlier run are only ever read.
+    """
+
+    def __init__(self, directory, segment_bytes=None, max_bytes=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or SPOOL_SEGMENT_BYTES
+        self.max_bytes = max_bytes or SPOOL_MAX_BYTES
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, "lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise RuntimeError(f"Spool {directory} is in use by another agent")
+        self.spool_id = self._read_id()
+
+        self._lock = threading.Lock()
+        self._segments = self._list_segments()
+        self._current = (self._segments[-1] if self._segments else 0) + 1
+        self._segments.append(self._current)
+        self._file = open(self._path(self._current), "ab")
+        self._sealed = []  # Rotated-out segment files, fsynced and closed by the next sync()
+        self.first_segment = self._current
+        self._written = (self._current, 0)
+        self._synced = self._written
+
+    def _read_id(self):
+        """Identity of this spool in `spool_offsets`, created with the directory."""
+        path = os.path.join(self.directory, "spool.id")
+        if not os.path.exists(path):
+            with open(f"{path}.tmp", "w") as f:
+                f.write(uuid.uuid4().hex)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{path}.tmp", path)
+        with open(path) as f:
+            return f.read().strip()
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            number, ext = os.path.splitext(name)
+            if ext == SUFFIX and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:012d}{SUFFIX}")
+
+    def first_position(self):
+        with self._lock:
+            return (self._segments[0], 0)
+
+    def end_position(self):
+        """Position after the last appended record."""
+        with self._lock:
+            return self._written
+
+    def append(self, record):
+        """Append a record to the current segment (not yet fsynced)."""
+        frame = encode_record(record)
+        with self._lock:
+            self._file.write(frame)
+            segment, offset = self._written
+            self._written = (segment, offset + len(frame))
+            if self._written[1] >= self.segment_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        # No fsync here: append() runs on the agent loop, so the old segment
+        # is fsynced and closed by the background thread's next sync()
+        self._file.flush()
+        self._sealed.append(self._file)
+        self._current += 1
+        self._segments.append(self._current)
+        self._file = open(self._path(self._current), "ab")
+        self._written = (self._current, 0)
+
+    def sync(self):
+        """fsync everything appended so far. Returns the synced position."""
+        with self._lock:
+            if self._synced == self._written:
+                return self._synced
+            self._file.flush()
+            position = self._written
+            sealed, self._sealed = self._sealed, []
+            # fsync a duplicate, so appends are not held up by the disk and
+            # a rotation may seal the segment meanwhile
+            fd = os.dup(self._file.fileno())
+        started = time.perf_counter()
+        try:
+            for sealed_file in sealed:
+                os.fsync(sealed_file.fileno())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            for sealed_file in sealed:
+                sealed_file.close()
+        SPOOL_FSYNC_SECONDS.observe(time.perf_counter() - started)
+        with self._lock:
+            self._synced = max(self._synced, position)
+            return self._synced
+
+    def read(self, position, limit):
+        """
+        Read up to `limit` synced records from `position`.
+
+        Returns:
+            tuple: (records, position after them)
+        """
+        with self._lock:
+            end = self._synced
+            segments = list(self._segments)
+        segment, offset = position
+        records = []
+        while len(records) < limit and (segment, offset) < end:
+            later = [number for number in segments if number > segment]
+            if segment in segments:
+                stop = end[1] if segment == end[0] else None
+                for offset, payload in read_frames(self._path(segment), offset, stop):
+                    records.append(decode_record(payload))
+                    if len(records) >= limit:
+                        break
+                else:
+                    if segment == end[0]:
+                        break
+                    # End of a closed segment, or the torn tail left by a crash
+                    segment, offset = later[0], 0
+                continue
+            # Dropped or released: continue with the next segment there is
+            if not later:
+                break
+            segment, offset = later[0], 0
+        return records, (segment, offset)
+
+    def release(self, position):
+        """Delete segments that lie entirely before `position`."""
+        with self._lock:
+            done = [number for number in self._segments if number < position[0] and number != self._current]
+            self._segments = [number for number in self._segments if number not in done]
+        for number in done:
+            os.remove(self._path(number))
+
+    def size(self):
+        with self._lock:
+            segments = list(self._segments)
+        total = 0
+        for number in segments:
+            try:
+                total += os.path.getsize(self._path(number))
+            except FileNotFoundError:
+                pass  # Released while we were adding up
+        return total
+
+    def enforce_limit(self, position):
+        """
+        Drop the oldest closed segments while the spool is over `max_bytes`.
+
+        Returns:
+            tuple: (position to replay from, records dropped unreplayed)
+        """
+        with self._lock:
+            segments = list(self._segments)
+            current = self._current
+        sizes = {number: os.path.getsize(self._path(number)) for number in segments}
+        total = sum(sizes.values())
+        dropped = 0
+        while total > self.max_bytes and segments[0] != current:
+            oldest = segments.pop(0)
+            if position[0] <= oldest:
+                start = position[1] if position[0] == oldest else 0
+                dropped += sum(1 for _ in read_frames(self._path(oldest), start))
+                position = (segments[0], 0)
+            with self._lock:
+                self._segments.remove(oldest)
+            os.remove(self._path(oldest))
+            total -= sizes[oldest]
+        return position, dropped
+
+    def count(self, position, before):
+        """Number of records from `position` in the segments numbered below `before`."""
+        with self._lock:
+            segments = [number for number in self._segments if position[0] <= number < before]
+        return sum(
+            sum(1 for _ in read_frames(self._path(number), position[1] if number == position[0] else 0))
+            for number in segments
+        )
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._file.close()
+        self._lock_file.close()
+
+def _load_position(conn, spool_id):
+    table = SpoolOffset.__table__
+    row = conn.execute(select(table.c.segment, table.c.offset).where(table.c.spool_id == spool_id)).first()
+    return None if row is None else (row.segment, row.offset)
+
+def _save_position(conn, spool_id, position):
+    table = SpoolOffset.__table__
+    values = {"segment": position[0], "offset": position[1], "updated_at": datetime.utcnow()}
+    result = conn.execute(update(table).where(table.c.spool_id == spool_id).values(**values))
+    if result.rowcount == 0:
+        conn.execute(insert(table).values(spool_id=spool_id, **values))
+
+class SpoolWriter:
+    """
+    Drop-in replacement for ResultWriter that goes through the local spool.
+
+    `submit()` only appends to the spool, so it never blocks on the
+    database. A background thread fsyncs the spool every `fsync_interval`
+    seconds and replays it in batches of `batch_size`, at least every
+    `flush_interval` seconds, retrying with backoff while the database
+    is unavailable. Records still spooled at `stop()` are replayed by the
+    next run.
+    """
+
+    def __init__(self, directory=None, batch_size=None, flush_interval=None, fsync_interval=None,
+                 segment_bytes=None, max_bytes=None, engine=None):
+        self.spool = Spool(directory or SPOOL_DIR, segment_bytes, max_bytes)
+        self.batch_size = batch_size or WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or WRITER_FLUSH_INTERVAL
+        self.fsync_interval = fsync_interval or SPOOL_FSYNC_INTERVAL
+        self.engine = engine
+        self._position = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._replayed = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._flush_requested = False
+        self._next_replay = 0
+        self._delay = 0.5
+        self.written = 0
+        self.dropped = 0
+
+        SPOOL_BYTES.set_function(self.spool.size)
+
+    def start(self):
+        """Start the replay thread (idempotent)."""
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="spool-replay", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, record, timeout=None):
+        """Append a record to the spool; `timeout` is accepted for ResultWriter compatibility."""
+        self.spool.append(record)
+        with self._lock:
+            self._pending += 1
+            full = self._pending >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written to the database."""
+        target = self.spool.end_position()
+        with self._replayed:
+            self._flush_requested = True
+            self._wake.set()
+            return self._replayed.wait_for(
+                lambda: self._position is not None and self._position >= target, timeout
+            )
+
+    def stop(self):
+        """Replay what the database accepts and stop; the rest stays spooled for the next run."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        if self._pending:
+            logging.warning(f"📼 {self._pending} ping results stay in the spool until the next start")
+        self.spool.close()
+
+    def pending(self):
+        """Number of spooled records not yet in the database."""
+        return self._pending
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.fsync_interval)
+            self._wake.clear()
+            stopping = self._stopping
+            self.spool.sync()
+            now = time.monotonic()
+            if stopping or self._flush_requested or self._pending >= self.batch_size or now >= self._next_replay:
+                self._replay(now)
+            # Bounded even while the stored position cannot be read yet
+            position, dropped = self.spool.enforce_limit(self._position or self.spool.first_position())
+            if self._position is not None:
+                self._position = position
+            if dropped:
+                SPOOL_DROPPED.inc(dropped)
+                self.dropped += dropped
+                with self._lock:
+                    self._pending -= dropped
+                logging.error(f"💥 Spool over {self.spool.max_bytes} bytes: dropped {dropped} unreplayed ping results")
+            if stopping:
+                return
+
+    def _replay(self, now):
+        """Write synced records to the database until caught up, or back off on failure."""
+        engine = self.engine or get_writer_engine()
+        try:
+            if self._position is None:
+                with engine.connect() as conn:
+                    stored = _load_position(conn, self.spool.spool_id)
+                first = self.spool.first_position()
+                self._position = first if stored is None or stored < first else stored
+                # Records of earlier runs; this run's are already counted by submit()
+                backlog = self.spool.count(self._position, self.spool.first_segment)
+                with self._lock:
+                    self._pending += backlog
+                if backlog:
+                    logging.info(f"📼 Replaying {backlog} spooled ping results from an earlier run")
+            while True:
+                records, position = self.spool.read(self._position, self.batch_size)
+                if position == self._position:
+                    break
+                started = time.perf_counter()
+                with engine.begin() as conn:
+                    if records:
+                        write_batch(conn, records)
+                    _save_position(conn, self.spool.spool_id, position)
+                if records:
+                    COMMIT_SECONDS.observe(time.perf_counter() - started)
+                    BATCH_ROWS.observe(len(records))
+                    ROWS_WRITTEN.inc(len(records))
+                    self.written += len(records)
+                with self._lock:
+                    self._pending -= len(records)
+                with self._replayed:
+                    self._position = position
+                    self._replayed.notify_all()
+                self.spool.release(position)
+                logging.debug(f"💾 Replayed {len(records)} ping results from the spool")
+            with self._replayed:
+                self._flush_requested = False
+                self._replayed.notify_all()
+            self._delay = 0.5
+            self._next_replay = now + self.flush_interval
+        except Exception as e:
+            WRITE_FAILURES.inc()
+            logging.error(f"❌ Failed to replay the spool, retrying in {self._delay:.1f}s: {e}")
+            self._next_replay = now + self._delay
+            self._delay = min(self._delay * 2, 30)
+
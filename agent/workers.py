@@ -0,0 +1,299 @@
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from functools import partial
+from multiprocessing.connection import wait
+from agent.probe_engine import (
+    MAX_INFLIGHT, MAX_INFLIGHT_PER_SUBNET, PROBE_WORKERS, ProbeEngine, ProbeTarget, create_prober,
+    failed_result, subnet_key
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# How long a worker waits for new requests before flushing finished results
+WORKER_FLUSH_INTERVAL = 0.005
+# A worker that exits within WORKER_MIN_UPTIME seconds of starting, more than
+# WORKER_MAX_RESTARTS times in a row, is not restarted again
+WORKER_MIN_UPTIME = 10.0
+WORKER_MAX_RESTARTS = 3
+
+
+def _worker_main(requests, results, backend, prober_factory, max_inflight, max_per_subnet, timeout):
+    """
+    Probe worker process: runs its own ProbeEngine and streams results back.
+
+    Requests arrive as (seq, target fields) tuples; results go back in
+    batches of (seq, success, response_time) tuples.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The coordinator handles Ctrl+C
+    prober = prober_factory() if prober_factory else create_prober(backend)
+    engine = ProbeEngine(prober=prober, max_inflight=max_inflight, max_per_subnet=max_per_subnet, timeout=timeout)
+    engine.start()
+
+    outbox = []
+    lock = threading.Lock()
+    inflight = 0
+
+    def done(seq, future):
+        result = future.result()
+        with lock:
+            outbox.append((seq, result["success"], result["response_time"]))
+
+    stopping = False
+    while not stopping or inflight:
+        if not stopping and requests.poll(WORKER_FLUSH_INTERVAL):
+            try:
+                while requests.poll():
+                    item = requests.recv()
+                    if item is None:
+                        stopping = True
+                        break
+                    seq, fields = item
+                    inflight += 1
+                    engine.submit(ProbeTarget(*fields)).add_done_callback(partial(done, seq))
+            except EOFError:
+                stopping = True  # Coordinator went away
+        elif stopping:
+            threading.Event().wait(WORKER_FLUSH_INTERVAL)
+
+        with lock:
+            batch, outbox = outbox, []
+        if batch:
+            inflight -= len(batch)
+            try:
+                results.send(batch)
+            except (BrokenPipeError, OSError):
+                break
+
+    engine.stop()
+
+
+class ProcessProbePool:
+    """
+    Probe engine that spreads probes over several worker processes.
+
+    A drop-in replacement for ProbeEngine: `submit()` returns a Future the
+    same way, so the runner, scheduler and single batched writer stay in
+    the coordinating process. Each worker runs its own event loop and
+    probe sockets and does the reply parsing, so that work is no longer
+    bound to one core.
+
+    Targets are routed to workers by subnet, which keeps the per-subnet
+    in-flight limit exact; the global limit is split evenly.
+
+    A worker that exits is started again and gets the probes it still
+    owed. One that keeps exiting right after it starts is retired, and
+    its subnets move to the remaining workers.
+    """
+
+    def __init__(self, workers=None, backend=None, prober_factory=None, max_inflight=None,
+                 max_per_subnet=None, timeout=None):
+        self.workers = workers or PROBE_WORKERS or multiprocessing.cpu_count()
+        self.backend = backend
+        self.prober_factory = prober_factory
+        self.max_inflight = max(1, -(-(max_inflight or MAX_INFLIGHT) // self.workers))
+        self.max_per_subnet = max_per_subnet or MAX_INFLIGHT_PER_SUBNET
+        self.timeout = timeout
+        # Spawned, not forked: the coordinator already runs threads
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._requests = []
+        self._send_locks = []
+        self._started = []
+        self._crashes = []
+        self._retired = set()
+        # seq -> [future, worker, target, attempts]
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._receiver = None
+        self._stopping = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes and the result receiver (idempotent)."""
+        with self._start_lock:
+            if self._processes:
+                return self
+            self._stopping = False
+            self._retired = set()
+            self._processes = [None] * self.workers
+            self._requests = [None] * self.workers
+            self._send_locks = [threading.Lock() for _ in range(self.workers)]
+            self._started = [0.0] * self.workers
+            self._crashes = [0] * self.workers
+            result_conns = {self._spawn(index): index for index in range(self.workers)}
+
+            self._receiver = threading.Thread(
+                target=self._receive, args=(result_conns,), name="probe-results", daemon=True
+            )
+            self._receiver.start()
+            logging.info(f"🧵 Started {self.workers} probe worker processes")
+        return self
+
+    def _spawn(self, index):
+        """Start worker `index` and return the reading end of its result pipe."""
+        request_reader, request_writer = self._context.Pipe(duplex=False)
+        result_reader, result_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(request_reader, result_writer, self.backend, self.prober_factory,
+                  self.max_inflight, self.max_per_subnet, self.timeout),
+            name=f"probe-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        request_reader.close()
+        result_writer.close()
+        self._processes[index] = process
+        self._requests[index] = request_writer
+        self._started[index] = time.monotonic()
+        return result_reader
+
+    def stop(self):
+        """Let the workers finish their in-flight probes, then shut them down."""
+        with self._start_lock:
+            if not self._processes:
+                return
+            self._stopping = True
+            for index, lock in enumerate(self._send_locks):
+                with lock:
+                    try:
+                        self._requests[index].send(None)
+                    except OSError:
+                        pass
+            for process in self._processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            self._receiver.join()
+            for conn in self._requests:
+                conn.close()
+            self._processes = []
+            self._requests = []
+            self._send_locks = []
+            self._receiver = None
+
+    def _route(self, ip_address):
+        """Worker for a target's subnet, or None when every worker has been retired."""
+        key = zlib.crc32(subnet_key(ip_address).encode())
+        worker = key % self.workers
+        if worker in self._retired:
+            live = [index for index in range(self.workers) if index not in self._retired]
+            if not live:
+                return None
+            worker = live[key % len(live)]
+        return worker
+
+    def _send(self, seq, target):
+        """Send a pending probe to its worker. Returns False when no worker can take it."""
+        worker = self._route(target.ip_address)
+        if worker is None:
+            return False
+        with self._pending_lock:
+            entry = self._pending.get(seq)
+            if entry is None:
+                return True  # Already answered
+            entry[1] = worker
+        try:
+            with self._send_locks[worker]:
+                self._requests[worker].send((seq, tuple(target)))
+        except OSError as e:
+            # The receiver restarts the worker and sends it this probe again
+            logging.warning(f"Probe worker {worker} is gone: {e}")
+        return True
+
+    def submit(self, target):
+        """Hand a probe to its worker and return a concurrent.futures.Future for its result."""
+        self.start()
+        future = Future()
+        seq = next(self._seq)
+        with self._pending_lock:
+            self._pending[seq] = [future, None, target, 1]
+        if not self._send(seq, target):
+            with self._pending_lock:
+                self._pending.pop(seq, None)
+            future.set_result(failed_result())
+        return future
+
+    def probe_many(self, targets):
+        """Probe all targets concurrently and return (target, result) pairs."""
+        futures = [(target, self.submit(target)) for target in targets]
+        return [(target, future.result()) for target, future in futures]
+
+    def _receive(self, workers):
+        while workers:
+            for conn in wait(list(workers)):
+                try:
+                    batch = conn.recv()
+                except EOFError:
+                    replacement = self._worker_exited(workers.pop(conn))
+                    conn.close()
+                    if replacement is not None:
+                        workers[replacement[0]] = replacement[1]
+                    continue
+                with self._pending_lock:
+                    futures = [(self._pending.pop(seq, (None,))[0], success, rtt) for seq, success, rtt in batch]
+                for future, success, response_time in futures:
+                    if future is not None:
+                        future.set_result({"success": success, "response_time": response_time})
+
+    def _worker_exited(self, worker):
+        """
+        Restart (or retire) a worker that exited and resend the probes it owed.
+
+        Returns:
+            tuple: (result connection, worker index) of the new process, or None
+        """
+        if self._stopping:
+            self._fail_pending(worker, "stopped")
+            return None
+        process = self._processes[worker]
+        process.join()
+        quick = time.monotonic() - self._started[worker] < WORKER_MIN_UPTIME
+        self._crashes[worker] = self._crashes[worker] + 1 if quick else 1
+        replacement = None
+        with self._send_locks[worker]:
+            self._requests[worker].close()
+            if self._crashes[worker] > WORKER_MAX_RESTARTS:
+                self._retired.add(worker)
+                logging.error(f"💥 Probe worker {worker} keeps exiting; its subnets move to the other workers")
+            else:
+                replacement = (self._spawn(worker), worker)
+                logging.warning(f"♻️ Probe worker {worker} exited (code {process.exitcode}), restarted it")
+
+        with self._pending_lock:
+            owed = [(seq, entry) for seq, entry in self._pending.items() if entry[1] == worker]
+            for _, entry in owed:
+                entry[3] += 1
+        failed = []
+        for seq, (future, _, target, attempts) in owed:
+            # A probe that was in flight through two crashes may be what crashes the worker
+            if attempts > 2 or not self._send(seq, target):
+                failed.append(seq)
+        self._fail(failed)
+        return replacement
+
+    def _fail_pending(self, worker, reason):
+        with self._pending_lock:
+            owed = [seq for seq, entry in self._pending.items() if entry[1] == worker]
+        if owed:
+            logging.error(f"💥 Probe worker {worker} {reason} with {len(owed)} probes in flight")
+        self._fail(owed)
+
+    def _fail(self, seqs):
+        """Resolve probes that cannot be sent anywhere as failed."""
+        with self._pending_lock:
+            futures = [self._pending.pop(seq)[0] for seq in seqs if seq in self._pending]
+        for future in futures:
+            future.set_result(failed_result())
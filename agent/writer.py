@@ -0,0 +1,253 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db.init_db import get_writer_engine
+from db.models import AlertLog, PingLog, PingResult, Server
+from db.partitions import route_log_rows
+from db.rollups import apply_rollups
+from telemetry.metrics import Counter, Histogram
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Flush policy - can be overridden by environment variables
+WRITER_BATCH_SIZE = int(os.getenv("AGENT_WRITER_BATCH_SIZE", "500"))
+WRITER_FLUSH_INTERVAL = float(os.getenv("AGENT_WRITER_FLUSH_INTERVAL", "1.0"))
+WRITER_QUEUE_SIZE = int(os.getenv("AGENT_WRITER_QUEUE_SIZE", "20000"))
+
+# A single probe outcome, as handed from the agent loop to the writer.
+ProbeRecord = namedtuple(
+    "ProbeRecord", ["server_id", "timestamp", "success", "response_time", "check_type"], defaults=("icmp",)
+)
+# An alert raised by a state transition, written in the same batch as the probe that caused it.
+AlertRecord = namedtuple("AlertRecord", ["server_id", "timestamp", "alert_type", "message"])
+
+_STOP = object()
+
+COMMIT_SECONDS = Histogram("agent_db_commit_seconds", "Time to write and commit one batch of results.")
+BATCH_ROWS = Histogram(
+    "agent_db_batch_rows", "Records per committed batch.", buckets=(1, 10, 50, 100, 250, 500, 1000, 5000)
+)
+ROWS_WRITTEN = Counter("agent_db_rows_written_total", "Records committed to the database.")
+ROWS_DROPPED = Counter("agent_db_rows_dropped_total", "Records dropped after repeated write failures on shutdown.")
+WRITE_FAILURES = Counter("agent_db_write_failures_total", "Failed batch writes (each is retried).")
+
+def _upsert_ping_results(conn, rows):
+    """Insert or update the latest PingResult of every server in `rows`."""
+    table = PingResult.__table__
+    # Every batch gets the next revision, so the dashboard can read what was
+    # written since its last poll however late a probe result arrives.
+    # Writes are serialised (BEGIN IMMEDIATE on SQLite): revisions follow commit order.
+    revision = conn.execute(select(func.coalesce(func.max(table.c.revision), 0))).scalar() + 1
+    rows = [{**row, "revision": revision} for row in rows]
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.server_id],
+            set_={
+                "timestamp": stmt.excluded.timestamp,
+                "is_successful": stmt.excluded.is_successful,
+                "latency_ms": stmt.excluded.latency_ms,
+                "check_type": stmt.excluded.check_type,
+                "revision": stmt.excluded.revision,
+            }
+        )
+        conn.execute(stmt, rows)
+        return
+
+    # Portable fallback: update in bulk, then insert whatever did not exist yet
+    existing = {
+        server_id for (server_id,) in conn.execute(
+            select(table.c.server_id).where(table.c.server_id.in_([row["server_id"] for row in rows]))
+        )
+    }
+    updates = [
+        {"b_server_id": row["server_id"], **{k: v for k, v in row.items() if k != "server_id"}}
+        for row in rows if row["server_id"] in existing
+    ]
+    if updates:
+        conn.execute(
+            update(table).where(table.c.server_id == bindparam("b_server_id")),
+            updates
+        )
+    inserts = [row for row in rows if row["server_id"] not in existing]
+    if inserts:
+        conn.execute(insert(table), inserts)
+
+def write_batch(conn, records):
+    """
+    Persist a batch of ProbeRecords and AlertRecords in the caller's transaction.
+
+    Every statement is compiled once and executed for the whole batch:
+    the PingLog insert, the INSERT ... ON CONFLICT upsert of PingResult,
+    the update of the servers' last ping time, the rollup buckets and
+    the alert log.
+    """
+    alerts = [r._asdict() for r in records if isinstance(r, AlertRecord)]
+    if alerts:
+        conn.execute(insert(AlertLog.__table__), alerts)
+        records = [r for r in records if not isinstance(r, AlertRecord)]
+    if not records:
+        return
+
+    log_rows = [
+        {
+            "server_id": r.server_id,
+            "timestamp": r.timestamp,
+            "success": r.success,
+            "response_time": r.response_time,
+            "check_type": r.check_type,
+        }
+        for r in records
+    ]
+    for options, rows in route_log_rows(conn, log_rows):
+        conn.execute(insert(PingLog.__table__), rows, execution_options=options)
+
+    # Only the newest record of each server matters for the summary tables
+    latest = {}
+    for r in records:
+        current = latest.get(r.server_id)
+        if current is None or r.timestamp >= current.timestamp:
+            latest[r.server_id] = r
+
+    _upsert_ping_results(conn, [
+        {
+            "server_id": r.server_id,
+            "timestamp": r.timestamp,
+            "is_successful": r.success,
+            "latency_ms": r.response_time,
+            "check_type": r.check_type,
+        }
+        for r in latest.values()
+    ])
+
+    servers = Server.__table__
+    conn.execute(
+        update(servers)
+        .where(servers.c.id == bindparam("b_id"))
+        .values(last_ping_time=bindparam("b_timestamp")),
+        [{"b_id": r.server_id, "b_timestamp": r.timestamp} for r in latest.values()]
+    )
+
+    apply_rollups(conn, records)
+
+class ResultWriter:
+    """
+    Background writer that buffers probe results and flushes them in bulk.
+
+    A batch is flushed when it reaches `batch_size` records or when its
+    oldest record is `flush_interval` seconds old, whichever comes first.
+    The queue is bounded: when the database falls behind, `submit()` blocks,
+    which in turn holds back probe dispatch instead of growing memory.
+    Failed flushes are retried with backoff, and `stop()` drains and flushes
+    everything still buffered.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None, engine=None):
+        self.batch_size = batch_size or WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or WRITER_FLUSH_INTERVAL
+        self.engine = engine
+        self._queue = queue.Queue(maxsize=max_queue or WRITER_QUEUE_SIZE)
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the writer thread (idempotent)."""
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, record, timeout=None):
+        """Queue a record for writing, blocking while the queue is full."""
+        self._queue.put(record, timeout=timeout)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self):
+        """Flush whatever is buffered and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def pending(self):
+        """Number of items waiting in the queue."""
+        return self._queue.qsize()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # The oldest buffered record is due
+
+            if item is _STOP:
+                self._write(batch)
+                return
+            if isinstance(item, threading.Event):
+                self._write(batch)
+                batch = []
+                item.set()
+                continue
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            self._write(batch)
+            batch = []
+
+    def _write(self, batch):
+        if not batch:
+            return
+        delay = 0.5
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                started = time.perf_counter()
+                with (self.engine or get_writer_engine()).begin() as conn:
+                    write_batch(conn, batch)
+                COMMIT_SECONDS.observe(time.perf_counter() - started)
+                BATCH_ROWS.observe(len(batch))
+                ROWS_WRITTEN.inc(len(batch))
+                self.written += len(batch)
+                logging.debug(f"💾 Flushed {len(batch)} ping results")
+                return
+            except Exception as e:
+                WRITE_FAILURES.inc()
+                if self._stopping and attempt >= 3:
+                    ROWS_DROPPED.inc(len(batch))
+                    self.dropped += len(batch)
+                    logging.error(f"💥 Dropping {len(batch)} ping results on shutdown: {e}")
+                    return
+                logging.error(f"❌ Failed to flush {len(batch)} ping results (attempt {attempt}): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark dashboard-style read latency while the agent is writing.
+
+Runs the same workload against a throwaway SQLite file twice: once with the
+default journal settings and once with the SQLITE_TUNING profile (WAL,
+synchronous=NORMAL, mmap, cache size and busy timeout, plus the dedicated
+BEGIN IMMEDIATE writer engine).
+
+Usage:
+    python benchmarks/sqlite_profile.py --servers 2000 --duration 10 [--json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db.init_db
+from db.init_db import configure_db, get_writer_engine, session_scope
+from db.models import Server, PingResult
+from agent.writer import ProbeRecord, write_batch
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def seed(server_count):
+    with session_scope() as session:
+        session.add_all([
+            Server(name=f"bench-{i}", ip_address=f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}")
+            for i in range(server_count)
+        ])
+
+def writer_loop(server_count, batch_size, stop, stats):
+    engine = get_writer_engine()
+    timestamp = datetime.utcnow()
+    i = 0
+    while not stop.is_set():
+        records = []
+        for _ in range(batch_size):
+            timestamp += timedelta(milliseconds=1)
+            records.append(ProbeRecord(1 + i % server_count, timestamp, i % 10 != 0, 12.5))
+            i += 1
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                write_batch(conn, records)
+            stats["rows"] += len(records)
+            stats["commit_ms"].append((time.perf_counter() - started) * 1000)
+        except Exception:
+            stats["errors"] += 1
+
+def reader_process(url, tuned, duration, results):
+    """Dashboard stand-in: a separate process, like a gunicorn worker."""
+    db.init_db.SQLITE_TUNING = tuned
+    configure_db(url)
+    stats = {"latency_ms": [], "errors": 0}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            with session_scope() as session:
+                session.query(Server.name, PingResult.is_successful, PingResult.latency_ms) \
+                    .outerjoin(PingResult).order_by(Server.id).limit(100).all()
+            stats["latency_ms"].append((time.perf_counter() - started) * 1000)
+        except Exception:
+            stats["errors"] += 1
+    results.put(stats)
+
+def run(tuned, server_count, duration, readers, batch_size):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.init_db.SQLITE_TUNING = tuned
+        configure_db(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+        seed(server_count)
+
+        url = db.init_db.DB_URL
+        stop = threading.Event()
+        write_stats = {"rows": 0, "commit_ms": [], "errors": 0}
+        writer = threading.Thread(target=writer_loop, args=(server_count, batch_size, stop, write_stats))
+        writer.start()
+
+        # Spawned, not forked: the children must not inherit our pooled connections
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        processes = [
+            context.Process(target=reader_process, args=(url, tuned, duration, queue))
+            for _ in range(readers)
+        ]
+        for process in processes:
+            process.start()
+        read_stats = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        stop.set()
+        writer.join()
+        configure_db("sqlite://")
+
+    latencies = [value for stats in read_stats for value in stats["latency_ms"]]
+    return {
+        "profile": "tuned" if tuned else "default",
+        "reads": len(latencies),
+        "read_errors": sum(stats["errors"] for stats in read_stats),
+        "read_p50_ms": round(statistics.median(latencies), 2) if latencies else None,
+        "read_p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "read_p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "read_max_ms": round(max(latencies), 2) if latencies else None,
+        "rows_written_per_s": round(write_stats["rows"] / duration),
+        "commit_p95_ms": round(percentile(write_stats["commit_ms"], 95), 2) if write_stats["commit_ms"] else None,
+        "write_errors": write_stats["errors"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite read-latency-under-write benchmark")
+    parser.add_argument("--servers", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="Emit machine-readable results")
+    args = parser.parse_args()
+
+    results = [
+        run(tuned, args.servers, args.duration, args.readers, args.batch_size)
+        for tuned in (False, True)
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(
+            f"{result['profile']:>8}: reads={result['reads']} "
+            f"p50={result['read_p50_ms']}ms p95={result['read_p95_ms']}ms "
+            f"p99={result['read_p99_ms']}ms max={result['read_max_ms']}ms "
+            f"read_errors={result['read_errors']} "
+            f"writes={result['rows_written_per_s']} rows/s "
+            f"commit_p95={result['commit_p95_ms']}ms write_errors={result['write_errors']}"
+        )
+
+if __name__ == "__main__":
+    main()
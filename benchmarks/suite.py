@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Performance regression suite for the agent and the dashboard.
+
+Every benchmark runs against a throwaway SQLite file filled with synthetic,
+deterministic data:
+
+    agent_cycle     one full probe cycle (dispatch, collect, write) with an
+                    in-process prober that answers instantly
+    pinglog_write   write_batch throughput for PingLog/PingResult/rollups
+    dashboard       home() and /api/servers latency as history grows
+    alerts          AlertTracker evaluation cost and startup load
+
+Results are JSON. Metric names end in `_ms`/`_us` (lower is better) or
+`_per_s` (higher is better), which is what the compare mode relies on;
+it exits with status 1 when any metric is worse than the baseline by
+more than the threshold.
+
+Usage:
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json [--threshold 0.2]
+    python benchmarks/suite.py --only agent_cycle,alerts --servers 100,1000,5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db.init_db
+from db.init_db import configure_db, get_writer_engine, init_db
+from agent.alerts import AlertTracker
+from agent.probe_engine import ProbeEngine
+from agent.runner import AgentRunner
+from agent.scheduler import ProbeScheduler
+from agent.writer import ProbeRecord, ResultWriter, write_batch
+from benchmarks.sqlite_profile import percentile, seed
+
+BENCHMARKS = ("agent_cycle", "pinglog_write", "dashboard", "alerts")
+
+class InstantProber:
+    """Stands in for the network: every probe succeeds straight away."""
+
+    async def ping(self, ip_address, timeout):
+        await asyncio.sleep(0)
+        return {"success": True, "response_time": 1.0}
+
+class fresh_database:
+    """Context manager pointing the shared engine at an empty temporary database."""
+
+    def __enter__(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        configure_db(f"sqlite:///{os.path.join(self.tmpdir.name, 'bench.db')}")
+        return self
+
+    def __exit__(self, *exc):
+        configure_db("sqlite://")
+        self.tmpdir.cleanup()
+
+def timings(samples):
+    """p50/p95 of a list of millisecond samples."""
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+    }
+
+def seed_history(server_count, logs_per_server, batch_size=5000):
+    """Write `logs_per_server` probe results for every server through the agent's write path."""
+    engine = get_writer_engine()
+    start = datetime.utcnow() - timedelta(minutes=logs_per_server)
+    records = []
+    for step in range(logs_per_server):
+        timestamp = start + timedelta(minutes=step)
+        for server_id in range(1, server_count + 1):
+            records.append(ProbeRecord(server_id, timestamp, (server_id + step) % 17 != 0, 5.0 + server_id % 50))
+            if len(records) >= batch_size:
+                with engine.begin() as conn:
+                    write_batch(conn, records)
+                records = []
+    if records:
+        with engine.begin() as conn:
+            write_batch(conn, records)
+
+def bench_agent_cycle(server_counts, cycles):
+    results = {}
+    for count in server_counts:
+        with fresh_database():
+            seed(count)
+            engine = ProbeEngine(prober=InstantProber(), max_inflight=1000, max_per_subnet=1000)
+            runner = AgentRunner(
+                engine=engine,
+                scheduler=ProbeScheduler(jitter=0, spread_max=0),
+                writer=ResultWriter(),
+            )
+            session = init_db()
+            try:
+                runner.sync_servers(session)
+            finally:
+                session.close()
+            runner.writer.start()
+            interval = 60
+            started = time.monotonic()
+            samples = []
+            try:
+                for cycle in range(cycles):
+                    began = time.perf_counter()
+                    # Every server becomes due at once: the worst case for one cycle
+                    runner.dispatch_due(started + cycle * interval + 1)
+                    collected = 0
+                    while collected < count:
+                        collected += runner.collect_results(1.0)
+                    runner.writer.flush()
+                    samples.append((time.perf_counter() - began) * 1000)
+            finally:
+                runner.writer.stop()
+                engine.stop()
+            cycle_ms = statistics.median(samples)
+            results[str(count)] = {
+                "cycle_ms": round(cycle_ms, 2),
+                "probes_per_s": round(count / cycle_ms * 1000),
+            }
+    return results
+
+def bench_pinglog_write(server_count, batch_sizes, rows):
+    results = {}
+    for batch_size in batch_sizes:
+        with fresh_database():
+            seed(server_count)
+            engine = get_writer_engine()
+            timestamp = datetime(2024, 1, 1)
+            written = 0
+            commits = []
+            began = time.perf_counter()
+            while written < rows:
+                records = []
+                for i in range(batch_size):
+                    timestamp += timedelta(milliseconds=10)
+                    records.append(ProbeRecord(1 + (written + i) % server_count, timestamp, i % 10 != 0, 12.5))
+                started = time.perf_counter()
+                with engine.begin() as conn:
+                    write_batch(conn, records)
+                commits.append((time.perf_counter() - started) * 1000)
+                written += batch_size
+            elapsed = time.perf_counter() - began
+            results[str(batch_size)] = {
+                "rows_per_s": round(written / elapsed),
+                "commit_p95_ms": round(percentile(commits, 95), 2),
+            }
+    return results
+
+def bench_dashboard(server_count, history_sizes, requests):
+    from dashboard.app import app
+    app.config.update(TESTING=True)
+    results = {}
+    for history in history_sizes:
+        with fresh_database():
+            seed(server_count)
+            seed_history(server_count, history)
+            client = app.test_client()
+            entry = {}
+            for name, path in (("home", "/"), ("api_servers", "/api/servers")):
+                client.get(path)  # Warm caches and the connection pool
+                samples = []
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    response = client.get(path)
+                    samples.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{path} returned {response.status_code}")
+                entry.update({f"{name}_{key}": value for key, value in timings(samples).items()})
+            results[str(history)] = entry
+    return results
+
+def bench_alerts(server_count, observations):
+    tracker = AlertTracker(down_threshold=3, up_threshold=2)
+    outcomes = [(i % server_count, (i // server_count) % 5 != 0) for i in range(observations)]
+    began = time.perf_counter()
+    for server_id, success in outcomes:
+        tracker.observe(server_id, success)
+    elapsed = time.perf_counter() - began
+
+    with fresh_database():
+        seed(server_count)
+        seed_history(server_count, 5)
+        session = init_db()
+        try:
+            started = time.perf_counter()
+            AlertTracker().load(session, range(1, server_count + 1))
+            load_ms = (time.perf_counter() - started) * 1000
+        finally:
+            session.close()
+
+    return {
+        "observe_per_s": round(observations / elapsed),
+        "observe_us": round(elapsed / observations * 1e6, 3),
+        "load_ms": round(load_ms, 2),
+    }
+
+def flatten(results, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, for comparing runs metric by metric."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(baseline, current, threshold):
+    """
+    Compare two runs metric by metric.
+
+    Returns:
+        tuple: (rows, regressions) where each row is (metric, baseline, current, change)
+    """
+    before = flatten(baseline["results"])
+    after = flatten(current["results"])
+    rows = []
+    regressions = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        if name.endswith("_per_s"):
+            worse = change < -threshold
+        elif name.endswith("_ms") or name.endswith("_us"):
+            worse = change > threshold
+        else:
+            worse = False
+        rows.append((name, old, new, change))
+        if worse:
+            regressions.append(name)
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent and dashboard performance suite")
+    parser.add_argument("--only", default=",".join(BENCHMARKS),
+                        help=f"Comma-separated benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--servers", default="100,1000",
+                        help="Server counts for the agent cycle benchmark")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--dashboard-servers", type=int, default=200)
+    parser.add_argument("--history", default="0,200",
+                        help="Ping logs per server for the dashboard benchmark")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--write-rows", type=int, default=20000)
+    parser.add_argument("--batch-sizes", default="1,100,500")
+    parser.add_argument("--alert-observations", type=int, default=200000)
+    parser.add_argument("--tuned", action="store_true", help="Run with SQLITE_TUNING enabled")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change counted as a regression in compare mode")
+    args = parser.parse_args()
+
+    def ints(value):
+        return [int(item) for item in value.split(",") if item]
+
+    db.init_db.SQLITE_TUNING = args.tuned
+    selected = [name for name in args.only.split(",") if name]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in selected:
+        print(f"Running {name}...", file=sys.stderr)
+        if name == "agent_cycle":
+            results[name] = bench_agent_cycle(ints(args.servers), args.cycles)
+        elif name == "pinglog_write":
+            results[name] = bench_pinglog_write(args.dashboard_servers, ints(args.batch_sizes), args.write_rows)
+        elif name == "dashboard":
+            results[name] = bench_dashboard(args.dashboard_servers, ints(args.history), args.requests)
+        elif name == "alerts":
+            results[name] = bench_alerts(args.dashboard_servers, args.alert_observations)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sqlite_tuning": args.tuned,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not args.compare:
+        print(json.dumps(report, indent=2))
+        return
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(baseline, report, args.threshold)
+    for name, old, new, change in rows:
+        marker = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<45} {old:>12} -> {new:>12} ({change:+.1%}){marker}")
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,32 @@
 import os
+import csv
+import io
+import json
 import logging
 import sys
+import time
 import pathlib
 
 # Add the parent directory to the Python path
 sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
 
-from flask import Flask, render_template, redirect, request, url_for, flash, jsonify
+from flask import Flask, Response, g, render_template, redirect, request, url_for, flash, jsonify
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField, BooleanField, SubmitField
-from wtforms.validators import DataRequired, IPAddress, NumberRange
-from sqlalchemy.orm import joinedload
-from db.init_db import init_db
-from db.utils import get_setting, set_setting
-from db.models import Server, AlertLog
+from wtforms import StringField, IntegerField, BooleanField, SelectField, SubmitField
+from wtforms.validators import DataRequired, NumberRange, Optional, ValidationError
+from db.init_db import db_session, get_engine
+from db.utils import get_setting, set_setting, bump_servers_version
+from db.models import Server
+from db.validation import clean_ip_address, probe_settings_error
+from db.summary import agent_heartbeats, server_summaries, recent_alerts
+from agent.checks import CHECK_TYPES
+from agent.sharding import AGENT_HEARTBEAT_TIMEOUT
+from db.rollups import RESOLUTIONS, rollup_series, uptime_by_server
+from db.latency import latency_percentiles
+from db.bulk import BulkError, deactivate_servers, export_servers, import_servers, iter_rows, update_servers
+from dashboard.events import broadcaster, describe_agent_status, stream_events
+from db.history import HISTORY_FIELDS, HISTORY_MAX_LIMIT, decode_cursor, encode_cursor, iter_ping_logs, ping_log_page
+from telemetry.metrics import CONTENT_TYPE, METRICS_MULTIPROCESS_DIR, REGISTRY, Histogram, MultiProcessRegistry
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import re
@@ -30,17 +43,67 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "you-shall-not-pass-this-to-version-control")
 
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Dashboard request latency per route.", ["route", "method", "status"]
+)
+# Under gunicorn, every worker adds its snapshot and each scrape sums them all
+METRICS = MultiProcessRegistry(METRICS_MULTIPROCESS_DIR) if METRICS_MULTIPROCESS_DIR else REGISTRY
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Time every request under its route pattern (not the raw path, which would explode label cardinality)."""
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+    if METRICS is not REGISTRY:
+        METRICS.maybe_write()
+    return response
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """Close the request's database session and return its connection to the pool."""
+    db_session.remove()
+
 # Form classes for validation
-class AddServerForm(FlaskForm):
+class ServerCheckForm(FlaskForm):
+    """How a server is checked; shared by the add and edit forms."""
+    check_type = SelectField('Check Type', choices=[(t, t.upper()) for t in CHECK_TYPES], default="icmp")
+    port = IntegerField('Port', validators=[Optional(), NumberRange(min=1, max=65535)])
+    url = StringField('URL / Host Name', validators=[Optional()])
+
+    def validate(self, extra_validators=None):
+        # Checked here and not in validate_<field>: Optional() skips those for empty fields
+        if not super().validate(extra_validators):
+            return False
+        problem = probe_settings_error(self.check_type.data, self.port.data, self.url.data)
+        if problem is not None:
+            field, message = problem
+            getattr(self, field).errors.append(message)
+            return False
+        return True
+
+def valid_ip_address(form, field):
+    """IPv4 or IPv6 address, by the same rule as bulk import."""
+    try:
+        clean_ip_address(field.data)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+class AddServerForm(ServerCheckForm):
     name = StringField('Server Name', validators=[DataRequired()])
-    ip_address = StringField('IP Address', validators=[DataRequired(), IPAddress()])
+    ip_address = StringField('IP Address', validators=[DataRequired(), valid_ip_address])
     ping_interval = IntegerField('Ping Interval (seconds)', validators=[DataRequired(), NumberRange(min=1, max=3600)])
     is_active = BooleanField('Active')
     submit = SubmitField('Add Server')
 
-class EditServerForm(FlaskForm):
+class EditServerForm(ServerCheckForm):
     name = StringField('Server Name', validators=[DataRequired()])
-    ip_address = StringField('IP Address', validators=[DataRequired(), IPAddress()])
+    ip_address = StringField('IP Address', validators=[DataRequired(), valid_ip_address])
     ping_interval = IntegerField('Ping Interval (seconds)', validators=[DataRequired(), NumberRange(min=1, max=3600)])
     is_active = BooleanField('Active')
     submit = SubmitField('Update Server')
@@ -48,42 +111,26 @@ class EditServerForm(FlaskForm):
 @app.route('/')
 def home():
     try:
-        session = init_db()
-        servers = (
-            session.query(Server)
-            .options(
-                joinedload(Server.ping_result),
-                joinedload(Server.ping_logs),
-                joinedload(Server.alerts)
-            )
-            .all()
-        )
-        alerts = session.query(AlertLog).order_by(AlertLog.timestamp.desc()).limit(10).all()
+        session = db_session()
+        servers = server_summaries(session)
+        uptime = uptime_by_server(session, datetime.utcnow() - timedelta(hours=24))
+        alerts = recent_alerts(session)
+        agents = agent_heartbeats(session)
+        agents_since = datetime.utcnow() - timedelta(seconds=AGENT_HEARTBEAT_TIMEOUT)
         
         raw_status = get_setting("agent_status", "paused")
         last_seen_raw = get_setting("agent_last_seen")
         
-        status_color = "paused"
-        if last_seen_raw:
-            last_seen = datetime.fromisoformat(last_seen_raw)
-            delta = datetime.utcnow() - last_seen
-            if delta > timedelta(minutes=2):
-                status_color = "offline"
-            else:
-                status_color = raw_status
-        
-        agent_status = (
-            f"{raw_status} (heartbeat OK)"
-            if status_color != "offline"
-            else f"{raw_status} (no recent heartbeat)"
-        )
+        agent_status, status_color = describe_agent_status(raw_status, last_seen_raw)
         
-        return render_template('home.html', servers=servers, alerts=alerts, 
+        return render_template('home.html', servers=servers, alerts=alerts, uptime=uptime,
+                             agents=agents, agents_since=agents_since,
                              agent_status=agent_status, status_color=status_color)
     except Exception as e:
         logging.error(f"Error in home route: {e}")
         flash("An error occurred while loading the dashboard", "error")
-        return render_template('home.html', servers=[], alerts=[], agent_status="unknown", status_color="offline")
+        return render_template('home.html', servers=[], alerts=[], uptime={}, agents=[], agents_since=None,
+                             agent_status="unknown", status_color="offline")
 
 @app.route("/add-server", methods=["GET", "POST"])
 def add_server():
@@ -91,15 +138,19 @@ def add_server():
     
     if form.validate_on_submit():
         try:
-            session = init_db()
+            session = db_session()
             new_server = Server(
                 name=form.name.data,
-                ip_address=form.ip_address.data,
+                ip_address=clean_ip_address(form.ip_address.data),
                 ping_interval=form.ping_interval.data,
-                is_active=form.is_active.data
+                is_active=form.is_active.data,
+                check_type=form.check_type.data,
+                port=form.port.data,
+                url=form.url.data or None
             )
             session.add(new_server)
             session.commit()
+            bump_servers_version()
             flash(f"Server '{form.name.data}' added successfully!", "success")
             return redirect(url_for('home'))
         except Exception as e:
@@ -110,7 +161,7 @@ def add_server():
 
 @app.route("/edit-server/<int:server_id>", methods=["GET", "POST"])
 def edit_server(server_id):
-    session = init_db()
+    session = db_session()
     server = session.query(Server).get(server_id)
     
     if not server:
@@ -122,10 +173,14 @@ def edit_server(server_id):
     if form.validate_on_submit():
         try:
             server.name = form.name.data
-            server.ip_address = form.ip_address.data
+            server.ip_address = clean_ip_address(form.ip_address.data)
             server.ping_interval = form.ping_interval.data
             server.is_active = form.is_active.data
+            server.check_type = form.check_type.data
+            server.port = form.port.data
+            server.url = form.url.data or None
             session.commit()
+            bump_servers_version()
             flash(f"Server '{server.name}' updated successfully!", "success")
             return redirect(url_for('home'))
         except Exception as e:
@@ -137,7 +192,7 @@ def edit_server(server_id):
 @app.route("/delete-server/<int:server_id>", methods=["POST"])
 def delete_server(server_id):
     try:
-        session = init_db()
+        session = db_session()
         server = session.query(Server).get(server_id)
         
         if not server:
@@ -145,6 +200,7 @@ def delete_server(server_id):
         else:
             session.delete(server)
             session.commit()
+            bump_servers_version()
             flash(f"Server '{server.name}' deleted successfully!", "success")
     except Exception as e:
         logging.error(f"Error deleting server: {e}")
@@ -187,31 +243,32 @@ def agent_status_partial():
         raw_status = get_setting("agent_status", "paused")
         last_seen_raw = get_setting("agent_last_seen")
 
-        status_color = "paused"
-        if last_seen_raw:
-            last_seen = datetime.fromisoformat(last_seen_raw)
-            delta = datetime.utcnow() - last_seen
-            if delta > timedelta(minutes=2):
-                status_color = "offline"
-            else:
-                status_color = raw_status
-
-        agent_status = (
-            f"{raw_status} (heartbeat OK)"
-            if status_color != "offline"
-            else f"{raw_status} (no recent heartbeat)"
-        )
+        agent_status, status_color = describe_agent_status(raw_status, last_seen_raw)
 
         return render_template("partials/agent_status.html", agent_status=agent_status, status_color=status_color)
     except Exception as e:
         logging.error(f"Error in agent_status_partial: {e}")
         return render_template("partials/agent_status.html", agent_status="unknown", status_color="offline")
 
+@app.route("/events")
+def events():
+    """Server-Sent Events stream of server status and agent heartbeat changes."""
+    return Response(
+        stream_events(broadcaster),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics of the dashboard (of every worker, with METRICS_MULTIPROCESS_DIR set)."""
+    return Response(METRICS.render(), headers={"Content-Type": CONTENT_TYPE})
+
 @app.route("/api/servers", methods=["GET"])
 def api_servers():
     """API endpoint to get all servers."""
     try:
-        session = init_db()
+        session = db_session()
         servers = session.query(Server).all()
         servers_data = []
         for server in servers:
@@ -220,12 +277,213 @@ def api_servers():
                 'name': server.name,
                 'ip_address': server.ip_address,
                 'is_active': server.is_active,
-                'ping_interval': server.ping_interval
+                'ping_interval': server.ping_interval,
+                'check_type': server.check_type,
+                'port': server.port,
+                'url': server.url
             })
         return jsonify(servers_data)
     except Exception as e:
         logging.error(f"Error in API endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+def _bulk_rows():
+    """Rows of the request body, parsed as a stream: CSV, a JSON array or NDJSON."""
+    fmt = request.args.get("format")
+    if fmt is None:
+        fmt = "csv" if request.mimetype in ("text/csv", "application/csv") else "json"
+    return iter_rows(io.TextIOWrapper(request.stream, encoding="utf-8", newline=""), fmt)
+
+@app.route("/api/servers/bulk", methods=["POST"])
+def api_servers_bulk_import():
+    """Create servers, or insert-or-update them by name (?mode=upsert, the default), in one transaction."""
+    try:
+        report = import_servers(_bulk_rows(), mode=request.args.get("mode", "upsert"))
+    except BulkError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error in bulk import: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+    return jsonify(report.to_dict())
+
+@app.route("/api/servers/bulk", methods=["PATCH"])
+def api_servers_bulk_update():
+    """Partial updates of existing servers, each row keyed on name, in one transaction."""
+    try:
+        report = update_servers(_bulk_rows())
+    except BulkError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error in bulk update: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+    return jsonify(report.to_dict())
+
+@app.route("/api/servers/bulk/deactivate", methods=["POST"])
+def api_servers_bulk_deactivate():
+    """Deactivate the servers named in {"names": [...]} in one transaction."""
+    payload = request.get_json(silent=True)
+    names = payload.get("names") if isinstance(payload, dict) else None
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return jsonify({"error": "Body must be {\"names\": [...]}"}), 400
+    try:
+        report = deactivate_servers(names)
+    except Exception as e:
+        logging.error(f"Error in bulk deactivate: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+    return jsonify(report.to_dict())
+
+@app.route("/api/servers/export", methods=["GET"])
+def api_servers_export():
+    """Every server as CSV (default) or NDJSON, in the format the bulk import accepts."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(export_servers(fmt), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=servers.{fmt}"})
+
+@app.route("/api/servers/<int:server_id>/rollups", methods=["GET"])
+def api_server_rollups(server_id):
+    """Uptime and latency aggregates for one server, for charts over long ranges."""
+    try:
+        end = datetime.fromisoformat(request.args["end"]) if "end" in request.args else datetime.utcnow()
+        start = datetime.fromisoformat(request.args["start"]) if "start" in request.args else end - timedelta(hours=24)
+        resolution = request.args.get("resolution")
+        if resolution is not None and resolution not in RESOLUTIONS:
+            return jsonify({"error": f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO 8601 timestamps"}), 400
+
+    try:
+        session = db_session()
+        rollups = rollup_series(session, server_id, start, end, resolution)
+        return jsonify([
+            {
+                'bucket_start': rollup.bucket_start.isoformat(),
+                'resolution': rollup.resolution,
+                'success_count': rollup.success_count,
+                'failure_count': rollup.failure_count,
+                'uptime': round(100.0 * rollup.success_count / (rollup.success_count + rollup.failure_count), 2)
+                          if rollup.success_count + rollup.failure_count else None,
+                'latency_min': rollup.latency_min,
+                'latency_avg': rollup.latency_avg,
+                'latency_max': rollup.latency_max,
+                'latency_p95': rollup.latency_p95
+            }
+            for rollup in rollups
+        ])
+    except Exception as e:
+        logging.error(f"Error in rollups API endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+def _latency(server_ids, per_server):
+    try:
+        end = datetime.fromisoformat(request.args["end"]) if "end" in request.args else datetime.utcnow()
+        start = datetime.fromisoformat(request.args["start"]) if "start" in request.args else end - timedelta(hours=24)
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO 8601 timestamps"}), 400
+    if start >= end:
+        return jsonify({"error": "start must be before end"}), 400
+
+    try:
+        with get_engine().connect() as conn:
+            result = latency_percentiles(conn, start, end, server_ids, per_server=per_server)
+        result.update(start=start.isoformat(), end=end.isoformat())
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Error in latency API endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/api/servers/<int:server_id>/latency", methods=["GET"])
+def api_server_latency(server_id):
+    """p50/p95/p99 latency (ms) of one server over a time range, from the rollup sketches."""
+    return _latency([server_id], per_server=False)
+
+@app.route("/api/latency", methods=["GET"])
+def api_latency():
+    """
+    p50/p95/p99 latency (ms) over a time range, merged across the servers
+    given as repeated ?server_id= (all servers by default); ?per_server=1
+    adds the percentiles of each server.
+    """
+    try:
+        server_ids = [int(value) for value in request.args.getlist("server_id")] or None
+    except ValueError:
+        return jsonify({"error": "server_id must be an integer"}), 400
+    per_server = request.args.get("per_server", "").lower() in ("1", "true", "yes")
+    return _latency(server_ids, per_server)
+
+def _ndjson_lines(rows):
+    for row in rows:
+        record = dict(zip(HISTORY_FIELDS, row))
+        record["timestamp"] = record["timestamp"].isoformat()
+        yield json.dumps(record) + "\n"
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HISTORY_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for an empty result
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+def _ping_history(server_id=None):
+    """
+    Stream ping logs as NDJSON (default) or CSV.
+
+    Query parameters: start/end (ISO 8601), format (ndjson or csv),
+    limit (page size) and cursor (from the previous page's X-Next-Cursor
+    header). Without `limit`, the whole range is streamed.
+    """
+    try:
+        start = datetime.fromisoformat(request.args["start"]) if "start" in request.args else None
+        end = datetime.fromisoformat(request.args["end"]) if "end" in request.args else None
+        after = decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+        limit = request.args.get("limit", type=int)
+        output = request.args.get("format", "ndjson")
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO 8601 timestamps and cursor must come from X-Next-Cursor"}), 400
+    if output not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    if limit is not None and not 1 <= limit <= HISTORY_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {HISTORY_MAX_LIMIT}"}), 400
+
+    try:
+        if server_id is not None and db_session.get(Server, server_id) is None:
+            return jsonify({"error": "Server not found"}), 404
+
+        headers = {}
+        if limit is None:
+            rows = iter_ping_logs(get_engine(), server_id, start, end, after)
+        else:
+            # One bounded page; the extra row tells whether another one follows
+            with get_engine().connect() as conn:
+                rows = ping_log_page(conn, server_id, start, end, after, limit + 1)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                headers["X-Next-Cursor"] = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    except Exception as e:
+        logging.error(f"Error in ping history API endpoint: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+    if output == "csv":
+        return Response(_csv_lines(rows), mimetype="text/csv", headers=headers)
+    return Response(_ndjson_lines(rows), mimetype="application/x-ndjson", headers=headers)
+
+@app.route("/api/servers/<int:server_id>/pings", methods=["GET"])
+def api_server_pings(server_id):
+    """Ping history of one server, streamed in (timestamp, id) order."""
+    return _ping_history(server_id)
+
+@app.route("/api/pings", methods=["GET"])
+def api_pings():
+    """Ping history of all servers, streamed in (timestamp, id) order."""
+    return _ping_history()
+
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
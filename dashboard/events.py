@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from db.init_db import get_engine
+from db.models import AppSetting, PingResult
+
+# How often the shared poller reads the database, however many browsers are connected
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "2"))
+# Seconds between keep-alive comments on an idle stream
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Events buffered per browser before a slow one is disconnected (it reconnects and resyncs)
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+# The agent counts as offline once its heartbeat is older than this
+AGENT_OFFLINE_AFTER = timedelta(minutes=2)
+
+def describe_agent_status(raw_status, last_seen_raw, now=None):
+    """
+    Turn the agent_status and agent_last_seen settings into what the dashboard shows.
+
+    Returns:
+        tuple: (label, color) where color is running, paused or offline
+    """
+    status_color = "paused"
+    if last_seen_raw:
+        last_seen = datetime.fromisoformat(last_seen_raw)
+        if (now or datetime.utcnow()) - last_seen > AGENT_OFFLINE_AFTER:
+            status_color = "offline"
+        else:
+            status_color = raw_status
+    label = (
+        f"{raw_status} (heartbeat OK)"
+        if status_color != "offline"
+        else f"{raw_status} (no recent heartbeat)"
+    )
+    return label, status_color
+
+def format_event(event, data):
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class StatusBroadcaster:
+    """
+    One database poller per process, fanning status changes out to every
+    connected browser.
+
+    Each poll is a single read of the PingResult rows written since the
+    last poll, by revision (the order they were written in, not when the
+    probe ran, so results the agent spooled during an outage are not
+    missed), plus the agent settings. Only servers whose status actually changed,
+    and the agent status when it changed, are pushed to subscribers, so
+    database load does not grow with the number of open dashboards. The
+    poller only runs while at least one browser is connected.
+    """
+
+    def __init__(self, poll_interval=None, queue_size=None):
+        self.poll_interval = poll_interval or EVENTS_POLL_INTERVAL
+        self.queue_size = queue_size or EVENTS_QUEUE_SIZE
+        self.servers = {}
+        self.agent = None
+        self._revision = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+    def subscribe(self):
+        """
+        Register a browser and return its event queue.
+
+        The queue starts with the current agent status and every known
+        server status, so a page that reconnects catches up without a reload.
+        """
+        events = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self.agent is not None:
+                events.put_nowait(("agent", self.agent))
+            if self.servers:
+                events.put_nowait(("servers", list(self.servers.values())))
+            self._subscribers.add(events)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="status-events", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def poll(self, now=None):
+        """Read what changed since the last poll and publish it."""
+        now = now or datetime.utcnow()
+        results = PingResult.__table__
+        settings = AppSetting.__table__
+        query = select(
+            results.c.server_id, results.c.is_successful, results.c.latency_ms, results.c.timestamp, results.c.revision
+        )
+        if self._revision is not None:
+            # The last revision is read again: unchanged rows are not published twice
+            query = query.where(results.c.revision >= self._revision)
+        with get_engine().connect() as conn:
+            rows = conn.execute(query).all()
+            values = dict(conn.execute(
+                select(settings.c.key, settings.c.value)
+                .where(settings.c.key.in_(("agent_status", "agent_last_seen")))
+            ).all())
+
+        label, color = describe_agent_status(values.get("agent_status", "paused"), values.get("agent_last_seen"), now)
+        agent = {"status": label, "color": color}
+
+        changed = []
+        with self._lock:
+            for row in rows:
+                status = {
+                    "id": row.server_id,
+                    "success": row.is_successful,
+                    "latency_ms": row.latency_ms,
+                    "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                }
+                if self.servers.get(row.server_id) != status:
+                    self.servers[row.server_id] = status
+                    changed.append(status)
+                self._revision = max(self._revision or 0, row.revision or 0)
+            if self._revision is None:
+                self._revision = 0
+            agent_changed = agent != self.agent
+            self.agent = agent
+
+        if changed:
+            self.publish("servers", changed)
+        if agent_changed:
+            self.publish("agent", agent)
+
+    def publish(self, event, data):
+        """Queue an event for every subscriber, disconnecting any that fell too far behind."""
+        with self._lock:
+            for events in list(self._subscribers):
+                try:
+                    events.put_nowait((event, data))
+                except queue.Full:
+                    self._subscribers.discard(events)
+                    _close(events)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._subscribers:
+                    self._wakeup.wait()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Error polling status events: {e}")
+            time.sleep(self.poll_interval)
+
+def _close(events):
+    """Replace a queue's backlog with the end-of-stream marker."""
+    try:
+        while True:
+            events.get_nowait()
+    except queue.Empty:
+        pass
+    events.put_nowait(None)
+
+def stream_events(broadcaster, keepalive=None):
+    """Generator for one /events response; unsubscribes when the browser goes away."""
+    keepalive = keepalive or EVENTS_KEEPALIVE
+    events = broadcaster.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                item = events.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                return
+            yield format_event(*item)
+    finally:
+        broadcaster.unsubscribe(events)
+
+# Shared by every request handled by this process
+broadcaster = StatusBroadcaster()
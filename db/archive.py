@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Columnar archive of cold ping history.
+
+Whole days of `ping_logs` older than ARCHIVE_AFTER_DAYS are moved out of
+SQLite into one file per server per day:
+
+    <archive dir>/<YYYY-MM-DD>/<server_id>.plog
+
+Each file is a 32-byte header followed by four columns, sorted by
+(timestamp, id):
+
+    ids           int64    one per row
+    offsets       uint32   milliseconds since the start of the day
+    latency       float32  response time in ms, NaN when there is none
+    success       bitset   one bit per row, least significant bit first
+
+That is about 16 bytes per probe against well over 100 for a row plus its
+indexes in SQLite. Files are memory-mapped and read through zero-copy
+views of the mapping, and a time range is found by bisecting the offsets,
+so reading a few minutes of an archived day does not touch the rest.
+Timestamps keep millisecond precision and the check type is not kept.
+
+Usage:
+    python db/archive.py [--after-days 7]
+"""
+
+import bisect
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, distinct, func, select
+from db.models import PingLog
+from db.partitions import log_sources
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Where archive files live (defaults to "<sqlite db>.archive") and how many
+# days of raw logs stay in the database - can be overridden by environment variables
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+
+MAGIC = b"PLG1"
+SUFFIX = ".plog"
+
+# magic, row count, server id, start of the day in epoch seconds, padding to 32 bytes
+_HEADER = struct.Struct("<4sIqq8x")
+
+EPOCH = datetime(1970, 1, 1)
+DAY = timedelta(days=1)
+
+# Same fields, in the same order, as the history API reads from `ping_logs`
+ArchivedPing = namedtuple("ArchivedPing", ("id", "server_id", "timestamp", "success", "response_time"))
+
+def archive_dir(engine=None):
+    """The archive directory: ARCHIVE_DIR, or next to a file-backed SQLite database, else None."""
+    if ARCHIVE_DIR:
+        return ARCHIVE_DIR
+    if engine is None:
+        from db.init_db import get_engine
+        engine = get_engine()
+    url = engine.url
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        return f"{url.database}.archive"
+    return None
+
+def _day_path(directory, day, server_id):
+    return os.path.join(directory, f"{day:%Y-%m-%d}", f"{server_id}{SUFFIX}")
+
+def archived_days(directory):
+    """Days with archive files, oldest first."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    days = []
+    for name in os.listdir(directory):
+        try:
+            days.append(datetime.strptime(name, "%Y-%m-%d"))
+        except ValueError:
+            continue
+    return sorted(days)
+
+def _column(view, typecode):
+    """Zero-copy typed view of little-endian data (a swapped copy on big-endian hosts)."""
+    if sys.byteorder == "little":
+        return view.cast(typecode)
+    column = array(typecode, view.tobytes())
+    column.byteswap()
+    return column
+
+class ArchiveFile:
+    """
+    One memory-mapped archive file.
+
+    `ids`, `offsets` and `latency` are views straight into the mapping;
+    nothing is copied until rows are read out of them.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, count, self.server_id, day = _HEADER.unpack_from(self._view)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a ping archive: {path}")
+        self.day = EPOCH + timedelta(seconds=day)
+        self.count = count
+
+        position = _HEADER.size
+        self.ids = _column(self._view[position:position + 8 * count], "q")
+        position += 8 * count
+        self.offsets = _column(self._view[position:position + 4 * count], "I")
+        position += 4 * count
+        self.latency = _column(self._view[position:position + 4 * count], "f")
+        position += 4 * count
+        self.success_bits = self._view[position:position + (count + 7) // 8]
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, timestamp):
+        return math.ceil((timestamp - self.day) / timedelta(milliseconds=1))
+
+    def _index(self, timestamp):
+        """Index of the first row at or after `timestamp`."""
+        if timestamp is None or timestamp <= self.day:
+            return 0
+        return bisect.bisect_left(self.offsets, self._offset(timestamp))
+
+    def row(self, index):
+        latency = self.latency[index]
+        return ArchivedPing(
+            self.ids[index],
+            self.server_id,
+            self.day + timedelta(milliseconds=self.offsets[index]),
+            bool(self.success_bits[index >> 3] >> (index & 7) & 1),
+            None if math.isnan(latency) else round(latency, 3)
+        )
+
+    def rows(self, start=None, end=None, after=None):
+        """Rows in [start, end) and after the (timestamp, id) position `after`, in order."""
+        index = self._index(start)
+        if after is not None:
+            index = max(index, self._index(after[0]))
+        stop = self._index(end) if end is not None else self.count
+        while index < stop:
+            row = self.row(index)
+            index += 1
+            if after is not None and (row.timestamp, row.id) <= after:
+                continue
+            yield row
+
+    def close(self):
+        for name in ("ids", "offsets", "latency", "success_bits", "_view"):
+            column = getattr(self, name, None)
+            if isinstance(column, memoryview):
+                column.release()
+        self._mmap.close()
+
+def write_archive_file(path, server_id, day, rows):
+    """
+    Write (id, timestamp, success, response_time) rows of one server and day.
+
+    The file is written next to its final name, flushed to disk and then
+    renamed, so readers never see a partial file.
+    """
+    rows = sorted(
+        ((row_id, (timestamp - day) // timedelta(milliseconds=1), success, response_time)
+         for row_id, timestamp, success, response_time in rows),
+        key=lambda row: (row[1], row[0])
+    )
+    ids = array("q", (row[0] for row in rows))
+    offsets = array("I", (row[1] for row in rows))
+    latency = array("f", (math.nan if row[3] is None else row[3] for row in rows))
+    bits = bytearray((len(rows) + 7) // 8)
+    for index, row in enumerate(rows):
+        if row[2]:
+            bits[index >> 3] |= 1 << (index & 7)
+    if sys.byteorder != "little":
+        for column in (ids, offsets, latency):
+            column.byteswap()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.tmp"
+    with open(partial, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(rows), server_id, int((day - EPOCH).total_seconds())))
+        for column in (ids, offsets, latency):
+            f.write(column.tobytes())
+        f.write(bits)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+
+def iter_archived(server_id=None, start=None, end=None, after=None, directory=None):
+    """
+    Archived pings in (timestamp, id) order, filtered like `ping_log_page`.
+
+    Days outside the range are skipped by name, and within a day the files
+    of several servers are merged as they are read.
+    """
+    directory = directory or archive_dir()
+    lower = start
+    if after is not None and (lower is None or after[0] > lower):
+        lower = after[0]
+    for day in archived_days(directory):
+        if lower is not None and day + DAY <= lower:
+            continue
+        if end is not None and day >= end:
+            return
+        if server_id is not None:
+            paths = [_day_path(directory, day, server_id)]
+        else:
+            folder = os.path.join(directory, f"{day:%Y-%m-%d}")
+            paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(SUFFIX)]
+        files = [ArchiveFile(path) for path in paths if os.path.exists(path)]
+        try:
+            yield from heapq.merge(
+                *(archive.rows(start, end, after) for archive in files),
+                key=lambda row: (row.timestamp, row.id)
+            )
+        finally:
+            for archive in files:
+                archive.close()
+
+def _archive_day(conn, directory, day, sources):
+    """Move one day of ping logs into archive files, in the caller's transaction."""
+    logs = PingLog.__table__
+    in_day = (logs.c.timestamp >= day) & (logs.c.timestamp < day + DAY)
+    server_ids = sorted({
+        server_id for options in sources
+        for server_id in conn.execute(select(distinct(logs.c.server_id)).where(in_day), execution_options=options).scalars()
+    })
+    rows_archived = 0
+    for server_id in server_ids:
+        query = (
+            select(logs.c.id, logs.c.timestamp, logs.c.success, logs.c.response_time)
+            .where(logs.c.server_id == server_id, in_day)
+        )
+        rows = [row for options in sources for row in conn.execute(query, execution_options=options)]
+        path = _day_path(directory, day, server_id)
+        merged = {row.id: tuple(row) for row in rows}
+        if os.path.exists(path):
+            # Left behind by a run that stopped before deleting its rows, or late rows for the day
+            with ArchiveFile(path) as archive:
+                for row in archive.rows():
+                    merged.setdefault(row.id, (row.id, row.timestamp, row.success, row.response_time))
+        write_archive_file(path, server_id, day, merged.values())
+        rows_archived += len(rows)
+    # The files are on disk before the rows go, so a crash leaves both copies
+    # and the next run merges them by id
+    for options in sources:
+        conn.execute(delete(logs).where(in_day), execution_options=options)
+    return rows_archived, len(server_ids)
+
+def archive_ping_logs(before=None, engine=None, directory=None):
+    """
+    Move every whole day of ping logs before `before` into archive files.
+
+    `before` defaults to ARCHIVE_AFTER_DAYS ago and is rounded down to a
+    day boundary, so only closed days are archived. Each day is moved in
+    its own write transaction.
+
+    Returns:
+        dict: rows and files written, and days archived
+    """
+    if engine is None:
+        from db.init_db import get_writer_engine
+        engine = get_writer_engine()
+    directory = directory or archive_dir(engine)
+    if not directory:
+        raise ValueError("No archive directory: set ARCHIVE_DIR")
+    before = before or datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    before = EPOCH + timedelta(days=(before - EPOCH).days)
+
+    logs = PingLog.__table__
+    with engine.connect() as conn:
+        candidates = [
+            conn.execute(select(func.min(logs.c.timestamp)), execution_options=options).scalar()
+            for options in log_sources(conn, end=before)
+        ]
+    report = {"rows": 0, "files": 0, "days": 0}
+    oldest = min((value for value in candidates if value is not None), default=None)
+    if oldest is None:
+        return report
+    day = EPOCH + timedelta(days=(oldest - EPOCH).days)
+    while day < before:
+        with engine.connect() as conn:
+            sources = log_sources(conn, day, day + DAY)
+            with conn.begin():
+                rows, files = _archive_day(conn, directory, day, sources)
+        if rows:
+            report["rows"] += rows
+            report["files"] += files
+            report["days"] += 1
+        day += DAY
+    if report["rows"]:
+        logging.info(f"🗄️ Archived {report['rows']} ping logs from {report['days']} days into {directory}")
+    return report
+
+def prune_archive(cutoff, directory=None):
+    """Delete archived days before `cutoff`. Returns the number of days removed."""
+    directory = directory or archive_dir()
+    removed = 0
+    for day in archived_days(directory):
+        if day + DAY > cutoff:
+            break
+        folder = os.path.join(directory, f"{day:%Y-%m-%d}")
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+        removed += 1
+    return removed
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move closed days of ping logs into the columnar archive")
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Keep this many days of ping logs in the database")
+    args = parser.parse_args()
+
+    report = archive_ping_logs(datetime.utcnow() - timedelta(days=args.after_days))
+    print(f"✓ Archived {report['rows']} ping logs into {report['files']} files ({report['days']} days)")
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Bulk import, export, update and deactivation of servers.
+
+Rows are parsed as a stream (CSV, a JSON array or NDJSON) and validated
+with the same rules as the dashboard's server form (db/validation.py)
+before the write transaction opens. Valid rows are staged in a temporary
+file, so neither a slow upload nor a large one holds the write lock or
+sits in memory (only the set of names seen, to report duplicates). They
+are then read back and written in chunks with one statement compiled per
+chunk, inside a single transaction. Rows that fail validation are skipped
+and reported with their row number.
+
+Usage:
+    python db/bulk.py import servers.csv [--mode insert|upsert]
+    python db/bulk.py update changes.json
+    python db/bulk.py export [--format csv|ndjson] [--output servers.csv]
+    python db/bulk.py deactivate web-1 web-2
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import bindparam, insert, select, update
+from agent.checks import CHECK_TYPES
+from db.init_db import get_engine, get_writer_engine
+from db.models import Server
+from db.utils import bump_servers_version
+from db.validation import clean_ip_address, probe_settings_error
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Rows per statement - can be overridden by environment variable
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+# Errors listed in a report; the count is always exact
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "1000"))
+
+# Columns that can be imported, exported and updated, in export order
+SERVER_FIELDS = ("name", "ip_address", "ping_interval", "is_active", "location", "check_type", "port", "url")
+
+# Values used for columns an inserted row leaves out
+INSERT_DEFAULTS = {"ping_interval": 60, "is_active": True, "location": None, "check_type": "icmp", "port": None, "url": None}
+
+_TRUE = ("1", "true", "yes", "y", "on")
+_FALSE = ("0", "false", "no", "n", "off", "")
+
+class BulkError(ValueError):
+    """The input could not be parsed at all (as opposed to a single invalid row)."""
+
+class BulkReport:
+    """Outcome of a bulk operation: row counts plus per-row errors."""
+
+    def __init__(self):
+        self.counts = {}
+        self.error_count = 0
+        self.errors = []
+
+    def count(self, key, amount=1):
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+    def error(self, row, name, message):
+        self.error_count += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"row": row, "name": name, "error": message})
+
+    def to_dict(self):
+        return {**self.counts, "error_count": self.error_count, "errors": sorted(self.errors, key=lambda e: e["row"])}
+
+def iter_csv_rows(stream):
+    """Yield (row number, dict) from a CSV text stream with a header row."""
+    for number, row in enumerate(csv.DictReader(stream), start=1):
+        # Empty cells mean "not given", so they do not overwrite on upsert
+        yield number, {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+
+def iter_json_rows(stream, chunk_size=65536):
+    """
+    Yield (row number, dict) from a JSON array of objects or from NDJSON,
+    decoding one object at a time so the whole document is never in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    number = 0
+    in_array = None
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if in_array is None and buffer:
+            in_array = buffer.startswith("[")
+            if in_array:
+                buffer = buffer[1:].lstrip()
+        if in_array and buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if in_array and buffer.startswith("]"):
+            return
+        if buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise BulkError(f"Invalid JSON after row {number}: {e.msg}")
+                value = None  # Probably cut off at the chunk boundary, read more
+            else:
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof:
+                    number += 1
+                    if not isinstance(value, dict):
+                        raise BulkError(f"Row {number} is not a JSON object")
+                    yield number, value
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            if in_array:
+                raise BulkError("JSON array is not closed")
+            return
+        chunk = stream.read(chunk_size)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8")
+        eof = not chunk
+        buffer += chunk
+
+def iter_rows(stream, fmt):
+    """Rows of a text stream in `fmt`: "csv" or "json" (a JSON array or NDJSON)."""
+    if fmt == "csv":
+        return iter_csv_rows(stream)
+    if fmt in ("json", "ndjson"):
+        return iter_json_rows(stream)
+    raise BulkError(f"Unknown format: {fmt}")
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"is_active must be true or false, not {value!r}")
+
+def _to_int(value, field, low, high):
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be an integer")
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{field} must be an integer, not {value!r}")
+    if not low <= number <= high:
+        raise ValueError(f"{field} must be between {low} and {high}")
+    return number
+
+def clean_server_fields(raw, require_identity=True):
+    """
+    Validate and normalise the server columns present in `raw`.
+
+    Applies the dashboard form's rules. Returns a dict holding only the
+    fields that were given, and raises ValueError naming the first problem.
+    """
+    unknown = set(raw) - set(SERVER_FIELDS) - {"id"}
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    clean = {}
+    for field in SERVER_FIELDS:
+        value = raw.get(field)
+        if value is None:
+            continue
+        if field in ("name", "ip_address", "location", "check_type", "url"):
+            value = str(value).strip()
+
+        if field == "name" and not value:
+            raise ValueError("name must not be empty")
+        elif field == "ip_address":
+            value = clean_ip_address(value)
+        elif field in ("location", "url"):
+            value = value or None
+        elif field == "ping_interval":
+            value = _to_int(value, "ping_interval", 1, 3600)
+        elif field == "port":
+            value = _to_int(value, "port", 1, 65535)
+        elif field == "is_active":
+            value = _to_bool(value)
+        elif field == "check_type":
+            value = value.lower()
+            if value not in CHECK_TYPES:
+                raise ValueError(f"check_type must be one of {', '.join(CHECK_TYPES)}")
+        clean[field] = value
+
+    if require_identity:
+        for field in ("name", "ip_address"):
+            if field not in clean:
+                raise ValueError(f"{field} is required")
+    return clean
+
+def check_probe_settings(fields):
+    """The per-check-type rules of the server form, on a complete set of fields."""
+    problem = probe_settings_error(fields.get("check_type"), fields.get("port"), fields.get("url"))
+    if problem is not None:
+        raise ValueError(problem[1])
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _stage(rows):
+    """Write (row number, clean fields) pairs to a temporary file, one JSON line each, and rewind it."""
+    staged = tempfile.TemporaryFile("w+", encoding="utf-8")
+    try:
+        for number, clean in rows:
+            staged.write(json.dumps([number, clean]) + "\n")
+        staged.seek(0)
+    except BaseException:
+        staged.close()
+        raise
+    return staged
+
+def _staged_rows(staged):
+    for line in staged:
+        number, clean = json.loads(line)
+        yield number, clean
+
+def _existing_by_name(conn, names):
+    table = Server.__table__
+    columns = [table.c[field] for field in SERVER_FIELDS]
+    rows = conn.execute(select(table.c.id, *columns).where(table.c.name.in_(names)))
+    return {row.name: row._asdict() for row in rows}
+
+def _update_grouped(conn, rows):
+    """Update servers by name, one executemany per distinct set of changed columns."""
+    table = Server.__table__
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(k for k in row if k != "name")), []).append(row)
+    for columns, group in groups.items():
+        if not columns:
+            continue
+        conn.execute(
+            update(table).where(table.c.name == bindparam("b_name")).values(
+                {column: bindparam(column) for column in columns}
+            ),
+            [{"b_name": row["name"], **{column: row[column] for column in columns}} for row in group]
+        )
+
+def import_servers(rows, mode="upsert", chunk_size=None, engine=None):
+    """
+    Insert, or insert-or-update keyed on name, servers from (row number, dict) pairs.
+
+    Rows are parsed, validated and staged on disk first; the writes then
+    run in one transaction: either every valid row is written or, on a
+    database error, none is. Invalid rows, duplicate names in the
+    input and (in "insert" mode) names that already exist are reported and
+    skipped. In "upsert" mode, existing servers only get the fields the
+    row provides.
+
+    Returns:
+        BulkReport: inserted/updated/unchanged counts and per-row errors
+    """
+    if mode not in ("insert", "upsert"):
+        raise BulkError(f"Unknown mode: {mode}")
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    report = BulkReport()
+    for key in ("inserted", "updated", "unchanged"):
+        report.count(key, 0)
+    seen = set()
+
+    def valid_rows():
+        for number, raw in rows:
+            name = raw.get("name") if isinstance(raw, dict) else None
+            try:
+                clean = clean_server_fields(raw, require_identity=mode == "insert")
+                if "name" not in clean:
+                    raise ValueError("name is required")
+            except ValueError as e:
+                report.error(number, name, str(e))
+                continue
+            if clean["name"] in seen:
+                report.error(number, clean["name"], "Duplicate name in input")
+                continue
+            seen.add(clean["name"])
+            yield number, clean
+
+    # Parsed and validated before the write transaction: a slow upload must
+    # not hold the database write lock the agent is waiting for
+    table = Server.__table__
+    with _stage(valid_rows()) as staged, (engine or get_writer_engine()).begin() as conn:
+        for chunk in _chunks(_staged_rows(staged), chunk_size):
+            existing = _existing_by_name(conn, [clean["name"] for _, clean in chunk])
+            inserts = []
+            updates = []
+            for number, clean in chunk:
+                current = existing.get(clean["name"])
+                try:
+                    if current is None:
+                        if "ip_address" not in clean:
+                            raise ValueError("ip_address is required for a new server")
+                        row = {**INSERT_DEFAULTS, **clean}
+                        check_probe_settings(row)
+                        inserts.append(row)
+                    elif mode == "insert":
+                        raise ValueError("A server with this name already exists")
+                    else:
+                        check_probe_settings({**current, **clean})
+                        changed = {k: v for k, v in clean.items() if current[k] != v}
+                        if changed:
+                            updates.append({"name": clean["name"], **changed})
+                        else:
+                            report.count("unchanged")
+                except ValueError as e:
+                    report.error(number, clean["name"], str(e))
+            if inserts:
+                conn.execute(insert(table), inserts)
+                report.count("inserted", len(inserts))
+            if updates:
+                _update_grouped(conn, updates)
+                report.count("updated", len(updates))
+
+    if report.counts["inserted"] or report.counts["updated"]:
+        bump_servers_version()
+    logging.info(f"📥 Bulk import: {report.counts}, {report.error_count} error(s)")
+    return report
+
+def update_servers(changes, chunk_size=None, engine=None):
+    """
+    Apply partial updates to existing servers, keyed on name, in one transaction.
+
+    `changes` yields (row number, dict) pairs, each dict holding a `name`
+    and the fields to change. Unknown names and invalid values are
+    reported per row and skipped.
+    """
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    report = BulkReport()
+    report.count("updated", 0)
+    report.count("unchanged", 0)
+
+    def valid_changes():
+        for number, raw in changes:
+            name = raw.get("name") if isinstance(raw, dict) else None
+            try:
+                if not isinstance(raw, dict) or not name:
+                    raise ValueError("Each change needs a name")
+                yield number, clean_server_fields(raw, require_identity=False)
+            except ValueError as e:
+                report.error(number, name, str(e))
+
+    # Parsed, validated and staged before the write transaction, like in import_servers()
+    with _stage(valid_changes()) as staged, (engine or get_writer_engine()).begin() as conn:
+        for cleaned in _chunks(_staged_rows(staged), chunk_size):
+            existing = _existing_by_name(conn, [clean["name"] for _, clean in cleaned])
+            updates = []
+            for number, clean in cleaned:
+                current = existing.get(clean["name"])
+                try:
+                    if current is None:
+                        raise ValueError("No server with this name")
+                    check_probe_settings({**current, **clean})
+                except ValueError as e:
+                    report.error(number, clean["name"], str(e))
+                    continue
+                changed = {k: v for k, v in clean.items() if current[k] != v}
+                if changed:
+                    updates.append({"name": clean["name"], **changed})
+                    current.update(changed)  # A later change to the same server sees this one
+                else:
+                    report.count("unchanged")
+            if updates:
+                _update_grouped(conn, updates)
+                report.count("updated", len(updates))
+
+    if report.counts["updated"]:
+        bump_servers_version()
+    return report
+
+def deactivate_servers(names, engine=None):
+    """Deactivate servers by name in one transaction, reporting names that do not exist."""
+    names = list(names)
+    report = BulkReport()
+    table = Server.__table__
+    with (engine or get_writer_engine()).begin() as conn:
+        found = set()
+        for chunk in _chunks(names, BULK_CHUNK_SIZE):
+            found.update(conn.execute(select(table.c.name).where(table.c.name.in_(chunk))).scalars())
+            conn.execute(update(table).where(table.c.name.in_(chunk)).values(is_active=False))
+    for number, name in enumerate(names, start=1):
+        if name not in found:
+            report.error(number, name, "No server with this name")
+    report.count("deactivated", len(found))
+    if found:
+        bump_servers_version()
+    return report
+
+def export_servers(fmt="csv", engine=None, batch_size=None):
+    """Yield every server as CSV or NDJSON text, one chunk per row."""
+    table = Server.__table__
+    query = select(*[table.c[field] for field in SERVER_FIELDS]).order_by(table.c.id)
+    with (engine or get_engine()).connect() as conn:
+        result = conn.execution_options(yield_per=batch_size or BULK_CHUNK_SIZE).execute(query)
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(SERVER_FIELDS)
+            for row in result:
+                writer.writerow(row)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.getvalue():
+                yield buffer.getvalue()
+        elif fmt in ("json", "ndjson"):
+            for row in result:
+                yield json.dumps(dict(zip(SERVER_FIELDS, row))) + "\n"
+        else:
+            raise BulkError(f"Unknown format: {fmt}")
+
+def _format_of(path, explicit):
+    if explicit:
+        return explicit
+    return "csv" if path.lower().endswith(".csv") else "json"
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk server import/export")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    import_parser = subparsers.add_parser("import", help="Load servers from a CSV, JSON or NDJSON file ('-' for stdin)")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "json", "ndjson"])
+    import_parser.add_argument("--mode", choices=["insert", "upsert"], default="upsert")
+    update_parser = subparsers.add_parser("update", help="Change fields of existing servers, keyed on name")
+    update_parser.add_argument("path")
+    update_parser.add_argument("--format", choices=["csv", "json", "ndjson"])
+    export_parser = subparsers.add_parser("export", help="Write every server as CSV or NDJSON")
+    export_parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    export_parser.add_argument("--output", help="File to write (stdout by default)")
+    deactivate_parser = subparsers.add_parser("deactivate", help="Deactivate servers by name")
+    deactivate_parser.add_argument("names", nargs="+")
+    args = parser.parse_args()
+
+    if args.action in ("import", "update"):
+        stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+        try:
+            rows = iter_rows(stream, _format_of(args.path, args.format))
+            report = import_servers(rows, mode=args.mode) if args.action == "import" else update_servers(rows)
+        except BulkError as e:
+            print(f"✗ {e}", file=sys.stderr)
+            sys.exit(2)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    elif args.action == "export":
+        output = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        try:
+            for text in export_servers(args.format):
+                output.write(text)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        sys.exit(0)
+    else:
+        report = deactivate_servers(args.names)
+
+    result = report.to_dict()
+    for error in result.pop("errors"):
+        print(f"  row {error['row']} ({error['name']}): {error['error']}", file=sys.stderr)
+    print(json.dumps(result))
+    sys.exit(1 if report.error_count else 0)
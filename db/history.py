@@ -0,0 +1,89 @@
+import heapq
+import os
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import and_, or_, select
+from db.archive import archive_dir, iter_archived
+from db.models import PingLog
+from db.partitions import log_sources
+
+# Rows fetched per keyset query while streaming - can be overridden by environment variables
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5000"))
+# Largest page a client can ask for with `limit`
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "10000"))
+
+HISTORY_FIELDS = ("id", "server_id", "timestamp", "success", "response_time")
+
+def encode_cursor(timestamp, row_id):
+    """Opaque position after the row with this (timestamp, id)."""
+    return f"{timestamp.isoformat()}_{row_id}"
+
+def decode_cursor(cursor):
+    """Inverse of `encode_cursor`. Raises ValueError on malformed input."""
+    timestamp, _, row_id = cursor.rpartition("_")
+    if not timestamp:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def ping_log_page(conn, server_id=None, start=None, end=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of ping logs ordered by (timestamp, id), starting after `after`.
+
+    The position is carried in the WHERE clause instead of an OFFSET, so
+    every page is an index range scan no matter how deep into the history
+    it is. Month partitions and days moved to the columnar archive are
+    merged in, so callers see one history wherever a row lives.
+    """
+    logs = PingLog.__table__
+    query = select(*(logs.c[field] for field in HISTORY_FIELDS))
+    if server_id is not None:
+        query = query.where(logs.c.server_id == server_id)
+    if start is not None:
+        query = query.where(logs.c.timestamp >= start)
+    if end is not None:
+        query = query.where(logs.c.timestamp < end)
+    if after is not None:
+        after_timestamp, after_id = after
+        query = query.where(
+            logs.c.timestamp >= after_timestamp,
+            or_(logs.c.timestamp > after_timestamp, and_(logs.c.timestamp == after_timestamp, logs.c.id > after_id))
+        )
+    query = query.order_by(logs.c.timestamp, logs.c.id)
+
+    lower = start
+    if after is not None and (lower is None or after[0] > lower):
+        lower = after[0]
+    main, *partitions = log_sources(conn, lower, end)
+    rows = conn.execute(query.limit(limit), execution_options=main).all()
+    # Months are disjoint and come oldest first, so they can be read until the page is full
+    partitioned = []
+    for options in partitions:
+        if len(partitioned) >= limit:
+            break
+        partitioned += conn.execute(query.limit(limit - len(partitioned)), execution_options=options).all()
+
+    archived = list(islice(iter_archived(server_id, start, end, after, archive_dir(conn.engine)), limit))
+    if not archived and not partitioned:
+        return rows
+    return list(islice(heapq.merge(archived, rows, partitioned, key=lambda row: (row.timestamp, row.id)), limit))
+
+def iter_ping_logs(engine, server_id=None, start=None, end=None, after=None, limit=None, page_size=None):
+    """
+    Yield ping logs in (timestamp, id) order, one keyset page at a time.
+
+    Each page is read on its own short-lived connection, so an export of
+    millions of rows holds neither the rows nor a read transaction open
+    for its whole duration.
+    """
+    page_size = page_size or HISTORY_PAGE_SIZE
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        with engine.connect() as conn:
+            rows = ping_log_page(conn, server_id, start, end, after, size)
+        yield from rows
+        if len(rows) < size:
+            return
+        after = (rows[-1].timestamp, rows[-1].id)
+        if remaining is not None:
+            remaining -= len(rows)
@@ -1,8 +1,13 @@
 import os
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from db.models import Base, create_indexes_if_not_exist
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from db.migrations import apply_migrations
+from db.models import Base, add_missing_columns
+from db.partitions import enable_partitions
 
 # Configure logging
 logging.basicConfig(
@@ -14,22 +19,197 @@ logging.basicConfig(
 # Database URL - can be overridden by environment variable
 DB_URL = os.getenv('DATABASE_URL', 'sqlite:///lord_of_the_pings.db')
 
+# Connection pool sizing - can be overridden by environment variables
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+
+# Opt-in SQLite performance profile - can be overridden by environment variables
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'false').lower() in ('1', 'true', 'yes', 'on')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Process-wide engine and session factories, bound on first use
+_engine = None
+_writer_engine = None
+_engine_lock = threading.Lock()
+SessionLocal = sessionmaker()
+
+def _is_memory_url(url):
+    return url in ("sqlite://", "sqlite:///:memory:")
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """
+    Apply the SQLite performance profile to a new connection.
+
+    WAL lets readers keep reading while the agent writes, and with
+    synchronous=NORMAL a commit no longer waits for an fsync of the
+    main database file.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _create_engine(url, writer=False):
+    """Create an engine with a connection pool suited to the database backend."""
+    if url.startswith("sqlite"):
+        connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if _is_memory_url(url):
+            # An in-memory database only lives as long as its one connection
+            return create_engine(url, echo=False, connect_args=connect_args, poolclass=StaticPool)
+        engine = create_engine(
+            url,
+            echo=False,
+            connect_args=connect_args,
+            # The writer engine holds exactly one connection per process
+            pool_size=1 if writer else DB_POOL_SIZE,
+            max_overflow=0 if writer else DB_MAX_OVERFLOW
+        )
+        if SQLITE_TUNING:
+            event.listen(engine, "connect", apply_sqlite_pragmas)
+        # Before BEGIN IMMEDIATE: partitions cannot be attached inside a transaction
+        enable_partitions(engine, writer=writer)
+        if writer:
+            _use_immediate_transactions(engine)
+        return engine
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True
+    )
+
+def _use_immediate_transactions(engine):
+    """
+    Start every transaction with BEGIN IMMEDIATE.
+
+    The write lock is taken up front, so a writer queues on busy_timeout
+    instead of failing with "database is locked" when it tries to upgrade
+    a read transaction halfway through.
+    """
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def bootstrap_db(engine):
+    """Create tables and indexes. Runs once per process, when the engine is created."""
+    Base.metadata.create_all(engine)  # Create all tables defined in models
+    add_missing_columns(engine)  # Upgrade tables created by older versions
+    apply_migrations(engine)  # Index changes recorded in schema_version
+    logging.info("Database initialized and tables created successfully.")
+
+def get_engine():
+    """Return the shared engine, creating it and bootstrapping the schema on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    engine = _create_engine(DB_URL)
+                    bootstrap_db(engine)
+                except Exception as e:
+                    logging.error(f"Failed to initialize database: {e}")
+                    raise
+                SessionLocal.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+def get_writer_engine():
+    """
+    Return the engine for bulk writes.
+
+    For SQLite this is a dedicated single-connection engine using
+    BEGIN IMMEDIATE, so all of a process's bulk writes go through one
+    writer while readers use the shared pool.
+    """
+    global _writer_engine
+    engine = get_engine()
+    if not DB_URL.startswith("sqlite") or _is_memory_url(DB_URL):
+        return engine
+    if _writer_engine is None:
+        with _engine_lock:
+            if _writer_engine is None:
+                _writer_engine = _create_engine(DB_URL, writer=True)
+    return _writer_engine
+
+def configure_db(url):
+    """Point the shared engine at another database (used by tests and tools)."""
+    global DB_URL, _engine, _writer_engine
+    with _engine_lock:
+        db_session.remove()
+        for engine in (_engine, _writer_engine):
+            if engine is not None:
+                engine.dispose()
+        _engine = None
+        _writer_engine = None
+        DB_URL = url
+    return get_engine()
+
+def open_engine():
+    """
+    A new engine on DB_URL that leaves the schema alone, for the migration tool.
+
+    get_engine() bootstraps the schema, applying every pending migration,
+    so a tool that migrates step by step or lists pending versions needs
+    an engine without that. The caller disposes it.
+    """
+    return _create_engine(DB_URL)
+
 def init_db():
-    """Initialize the database and create tables."""
+    """Return a new session on the shared engine. The caller must close it."""
+    get_engine()
+    return SessionLocal()
+
+# Thread-local sessions for the dashboard, removed at the end of each request
+db_session = scoped_session(init_db)
+
+@contextmanager
+def session_scope():
+    """Provide a session that is committed on success and always closed."""
+    session = init_db()
     try:
-        engine = create_engine(DB_URL, echo=False)  # Set echo=False for production
-        Base.metadata.create_all(engine)  # Create all tables defined in models
-        create_indexes_if_not_exist()  # Create indexes if they don't exist
-        logging.info("Database initialized and tables created successfully.")
-        Session = sessionmaker(bind=engine)
-        return Session()  # Return a new session for use
-    except Exception as e:
-        logging.error(f"Failed to initialize database: {e}")
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+@contextmanager
+def writer_session_scope():
+    """
+    Like session_scope(), on the writer engine.
+
+    For the small writes of the agent and the dashboard (settings,
+    heartbeats): on SQLite they take the write lock up front with BEGIN
+    IMMEDIATE and queue behind the process's other writes, instead of
+    upgrading a read transaction, which can fail with SQLITE_BUSY.
+    """
+    session = SessionLocal(bind=get_writer_engine())
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
         raise
+    finally:
+        session.close()
 
 if __name__ == "__main__":
     try:
-        init_db()  # Run the initialization if this script is executed directly
+        get_engine()  # Run the initialization if this script is executed directly
         print("Database initialization completed successfully.")
     except Exception as e:
         print(f"Database initialization failed: {e}")
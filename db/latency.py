@@ -0,0 +1,132 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from db.models import PingRollup
+from db.retention import retention_days
+from db.rollups import RESOLUTIONS, bucket_start
+from db.sketch import LatencySketch
+
+# Percentiles reported by default, as (label, quantile)
+DEFAULT_PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+def cover_range(start, end, finest="1m"):
+    """
+    Split [start, end) into the fewest rollup buckets that cover it.
+
+    Whole days come from the 1d rollups and only the ragged edges from
+    the finer ones, so a range is read as at most ~2x59 minute buckets,
+    ~2x23 hour buckets and one bucket per day, however long it is and
+    however many probes it holds. `start` is rounded down and `end` up
+    to the `finest` resolution.
+
+    Returns:
+        list: (resolution, first bucket start, end) segments
+    """
+    names = [name for name in sorted(RESOLUTIONS, key=RESOLUTIONS.get) if RESOLUTIONS[name] >= RESOLUTIONS[finest]]
+    step = RESOLUTIONS[names[0]]
+    start = bucket_start(start, step)
+    if bucket_start(end, step) != end:
+        end = bucket_start(end, step) + timedelta(seconds=step)
+
+    segments = []
+    tail = []
+    for finer, coarser in zip(names, names[1:]):
+        seconds = RESOLUTIONS[coarser]
+        head_end = min(end, _round_up(start, seconds))
+        tail_start = max(head_end, bucket_start(end, seconds))
+        if start < head_end:
+            segments.append((finer, start, head_end))
+        if tail_start < end:
+            tail.insert(0, (finer, tail_start, end))
+        start, end = head_end, tail_start
+    if start < end:
+        segments.append((names[-1], start, end))
+    return segments + tail
+
+def _round_up(timestamp, seconds):
+    start = bucket_start(timestamp, seconds)
+    return start if start == timestamp else start + timedelta(seconds=seconds)
+
+def finest_retained(timestamp, now=None):
+    """Finest rollup resolution that retention has not pruned at `timestamp`."""
+    now = now or datetime.utcnow()
+    for name in sorted(RESOLUTIONS, key=RESOLUTIONS.get):
+        days = retention_days(f"retention_rollups_{name}_days")
+        if days <= 0 or timestamp >= now - timedelta(days=days):
+            return name
+    return max(RESOLUTIONS, key=RESOLUTIONS.get)
+
+def merged_sketches(conn, start, end, server_ids=None, finest=None):
+    """
+    Merge the latency sketches of every server over [start, end).
+
+    The edges of the range use the finest rollups still retained at
+    `start`: minutes for recent ranges, whole hours or days further back.
+
+    Sketches stored with another accuracy than the first one read cannot
+    be merged with it, and are left out with a warning.
+
+    Returns:
+        dict: server_id -> LatencySketch
+    """
+    if finest is None:
+        finest = finest_retained(start)
+
+    table = PingRollup.__table__
+    sketches = {}
+    # Only sketches of one accuracy merge: the first one read sets it
+    accuracy = None
+    skipped = 0
+    for resolution, segment_start, segment_end in cover_range(start, end, finest):
+        query = select(table.c.server_id, table.c.latency_sketch).where(
+            table.c.resolution == resolution,
+            table.c.bucket_start >= segment_start,
+            table.c.bucket_start < segment_end,
+            table.c.latency_sketch.isnot(None)
+        )
+        if server_ids is not None:
+            query = query.where(table.c.server_id.in_(list(server_ids)))
+        for server_id, encoded in conn.execute(query):
+            sketch = LatencySketch.from_string(encoded)
+            if accuracy is None:
+                accuracy = sketch.relative_accuracy
+            elif sketch.relative_accuracy != accuracy:
+                skipped += 1
+                continue
+            if server_id in sketches:
+                sketches[server_id].merge(sketch)
+            else:
+                sketches[server_id] = sketch
+    if skipped:
+        logging.warning(
+            f"⚠️ Skipped {skipped} latency sketches stored with another accuracy than {accuracy} "
+            "(SKETCH_RELATIVE_ACCURACY changed); percentiles leave their buckets out"
+        )
+    return sketches
+
+def summarize(sketch, percentiles=DEFAULT_PERCENTILES):
+    """Sample count and percentiles (ms, rounded) of one sketch."""
+    values = sketch.quantiles([q for _, q in percentiles])
+    summary = {"count": sketch.count}
+    for (label, _), value in zip(percentiles, values):
+        summary[label] = round(value, 3) if value is not None else None
+    return summary
+
+def latency_percentiles(conn, start, end, server_ids=None, per_server=False, percentiles=DEFAULT_PERCENTILES,
+                        finest=None):
+    """
+    p50/p95/p99 latency in milliseconds over [start, end), for some or all servers.
+
+    The per-bucket sketches are merged, so the cost depends on the number
+    of buckets in the range and not on the number of probes. Results are
+    within the sketch's relative accuracy of the exact percentiles.
+    """
+    sketches = merged_sketches(conn, start, end, server_ids, finest)
+    # Same accuracy as the stored sketches, which may predate a change of SKETCH_RELATIVE_ACCURACY
+    total = LatencySketch(next(iter(sketches.values())).relative_accuracy) if sketches else LatencySketch()
+    for sketch in sketches.values():
+        total.merge(sketch)
+    result = summarize(total, percentiles)
+    if per_server:
+        result["servers"] = {server_id: summarize(sketch, percentiles) for server_id, sketch in sorted(sketches.items())}
+    return result
@@ -9,40 +9,79 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from sqlalchemy import create_engine
-from db.models import Base
-from db.init_db import DB_URL
+from datetime import datetime, timedelta
+from db.models import Base, add_missing_columns
+from db.init_db import get_engine, open_engine
+from db.migrations import MIGRATIONS, applied_versions, apply_migrations
+from db.rollups import rebuild_rollups
+from db.retention import enforce_retention
 
 def create_tables():
     """Create all database tables."""
-    engine = create_engine(DB_URL)
+    engine = get_engine()
     Base.metadata.create_all(engine)
     print("✓ All tables created successfully")
 
 def drop_tables():
     """Drop all database tables (use with caution)."""
-    engine = create_engine(DB_URL)
+    engine = get_engine()
     Base.metadata.drop_all(engine)
     print("✓ All tables dropped successfully")
 
-def migrate():
+def migrate(target=None):
     """Run database migrations."""
     print("Running database migrations...")
     
-    # Create tables if they don't exist
-    create_tables()
-    
-    # Add any data migrations here
-    # For example, adding default settings or initial data
+    # Not get_engine(): its bootstrap would apply every migration, whatever the target
+    engine = open_engine()
+    try:
+        # Create tables if they don't exist
+        Base.metadata.create_all(engine)
+        add_missing_columns(engine)
+        print("✓ All tables created successfully")
+        
+        applied = apply_migrations(engine, target)
+    finally:
+        engine.dispose()
+    for version in applied:
+        print(f"  applied {version}")
     
     print("✓ Migrations completed successfully")
 
+def status():
+    """List every schema migration and whether it has been applied."""
+    engine = open_engine()
+    try:
+        done = applied_versions(engine)
+    finally:
+        engine.dispose()
+    for version, name, _ in MIGRATIONS:
+        print(f"  {'✓' if version in done else ' '} {version}: {name}")
+
+def rollup(days):
+    """Rebuild the 1m/1h/1d rollups from the last `days` days of raw ping logs."""
+    end = datetime.utcnow()
+    with get_engine().begin() as conn:
+        total = rebuild_rollups(conn, end - timedelta(days=days), end)
+    print(f"✓ Rollups rebuilt from {total} ping logs")
+
+def retention():
+    """Delete history older than the configured retention and report what was reclaimed."""
+    report = enforce_retention()
+    for key, value in report.items():
+        print(f"  {key}: {value}")
+    print("✓ Retention applied")
+
 if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description="Database migration tool")
-    parser.add_argument("action", choices=["create", "drop", "migrate"], 
-                       help="Action to perform: create tables, drop tables, or migrate")
+    parser.add_argument("action", choices=["create", "drop", "migrate", "status", "rollup", "retention"], 
+                       help="Action to perform: create tables, drop tables, migrate, list migrations, rebuild rollups, or apply retention")
+    parser.add_argument("--days", type=int, default=90,
+                       help="How many days of history to rebuild rollups for (rollup only)")
+    parser.add_argument("--target", type=int, default=None,
+                       help="Stop at this schema version (migrate only)")
     
     args = parser.parse_args()
     
@@ -51,4 +90,10 @@ if __name__ == "__main__":
     elif args.action == "drop":
         drop_tables()
     elif args.action == "migrate":
-        migrate()
+        migrate(args.target)
+    elif args.action == "status":
+        status()
+    elif args.action == "rollup":
+        rollup(args.days)
+    elif args.action == "retention":
+        retention()
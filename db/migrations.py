@@ -0,0 +1,115 @@
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from db.models import SchemaVersion
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Every migration, in version order: (version, name, function taking the engine)
+MIGRATIONS = []
+
+def migration(version, name):
+    """Register a schema migration. Versions must be applied in increasing order and never change."""
+    def register(function):
+        MIGRATIONS.append((version, name, function))
+        MIGRATIONS.sort()
+        return function
+    return register
+
+def create_index_online(engine, name, table, columns):
+    """
+    Build an index without holding up the agent's writes for the whole migration.
+
+    PostgreSQL builds it CONCURRENTLY. SQLite cannot, so each index is
+    built in its own short transaction, and writers only wait for that
+    one build.
+    """
+    started = time.monotonic()
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+    logging.info(f"🗂️ Index {name} ready in {time.monotonic() - started:.2f}s")
+
+def drop_index_online(engine, name):
+    """Drop an index if it exists (CONCURRENTLY on PostgreSQL)."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+@migration(1, "ping history keyset indexes")
+def _keyset_indexes(engine):
+    create_index_online(engine, "ix_ping_logs_server_id_timestamp_id", "ping_logs", ("server_id", "timestamp", "id"))
+    create_index_online(engine, "ix_ping_logs_timestamp_id", "ping_logs", ("timestamp", "id"))
+
+@migration(2, "alert state index")
+def _alert_state_index(engine):
+    create_index_online(engine, "ix_alert_logs_server_id_alert_type_id", "alert_logs", ("server_id", "alert_type", "id"))
+
+@migration(3, "drop redundant indexes")
+def _drop_redundant_indexes(engine):
+    # Prefixes of the composite indexes above, the primary key again, and
+    # columns no query filters on, each of which slowed down every write
+    for name in (
+        "ix_ping_logs_server_id", "ix_ping_logs_timestamp", "ix_ping_logs_success",
+        "ix_alert_logs_server_id", "ix_alert_logs_alert_type",
+        "ix_ping_result_is_successful",
+        "ix_servers_id", "ix_servers_ip_address", "ix_servers_is_active", "ix_servers_last_ping_time",
+        "ix_servers_created_at",
+    ):
+        drop_index_online(engine, name)
+
+@migration(4, "ping result revision index")
+def _ping_result_revision_index(engine):
+    create_index_online(engine, "ix_ping_result_revision", "ping_result", ("revision",))
+
+def applied_versions(engine):
+    """Versions already recorded in `schema_version` (none before it exists)."""
+    table = SchemaVersion.__table__
+    if not inspect(engine).has_table(table.name):
+        return set()
+    with engine.connect() as conn:
+        return set(conn.execute(select(table.c.version)).scalars())
+
+def apply_migrations(engine, target=None):
+    """
+    Apply every migration not yet recorded, up to `target`, in version order.
+
+    Migrations are idempotent, so a process that races another one to the
+    same version only finds its work already done.
+
+    Returns:
+        list: versions applied by this call
+    """
+    table = SchemaVersion.__table__
+    table.create(engine, checkfirst=True)
+    done = applied_versions(engine)
+    applied = []
+    for version, name, function in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        logging.info(f"⬆️ Applying schema migration {version}: {name}")
+        function(engine)
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(table).values(version=version, name=name, applied_at=datetime.utcnow()))
+        except IntegrityError:
+            logging.info(f"Schema migration {version} was recorded by another process")
+        applied.append(version)
+    return applied
+
+def current_version(engine):
+    """Highest applied schema version (0 for a database that predates migrations)."""
+    return max(applied_versions(engine), default=0)
@@ -1,8 +1,9 @@
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Index
+    Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Index, Text, UniqueConstraint
 )
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
+import logging
 
 Base = declarative_base()
 
@@ -10,32 +11,42 @@ class Server(Base):
     """Represents a server to be monitored."""
     __tablename__ = "servers"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False, index=True)
-    ip_address = Column(String, nullable=False, index=True)
+    ip_address = Column(String, nullable=False)
     location = Column(String, nullable=True)
     ping_interval = Column(Integer, default=60)  # in seconds
-    last_ping_time = Column(DateTime, nullable=True, index=True)  # Last successful ping time
-    is_active = Column(Boolean, default=True, index=True)
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_ping_time = Column(DateTime, nullable=True)  # Last successful ping time
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    check_type = Column(String, nullable=False, default="icmp", server_default="icmp")  # icmp, tcp, http or dns
+    port = Column(Integer, nullable=True)  # tcp: port to connect to; http/dns: overrides the default port
+    url = Column(String, nullable=True)  # http: URL to request; dns: host name to resolve
 
     # Relationships
     ping_result = relationship("PingResult", back_populates="server", uselist=False, cascade="all, delete-orphan")
     alerts = relationship("AlertLog", back_populates="server", cascade="all, delete-orphan")
     ping_logs = relationship("PingLog", back_populates="server", cascade="all, delete-orphan")
+    rollups = relationship("PingRollup", back_populates="server", cascade="all, delete-orphan")
 
     def __repr__(self):
-        return f"<Server(name={self.name}, ip={self.ip_address}, active={self.is_active})>"
+        return f"<Server(name={self.name}, ip={self.ip_address}, check={self.check_type}, active={self.is_active})>"
 
 class PingResult(Base):
     """Stores the most recent ping result for a server."""
     __tablename__ = "ping_result"
+    __table_args__ = (
+        # The dashboard's status poller reads the rows written since its last poll
+        Index("ix_ping_result_revision", "revision"),
+    )
 
     id = Column(Integer, primary_key=True)
     server_id = Column(Integer, ForeignKey("servers.id"), nullable=False, unique=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
-    is_successful = Column(Boolean, index=True)
+    is_successful = Column(Boolean)
     latency_ms = Column(Float)
+    check_type = Column(String, default="icmp", server_default="icmp")
+    revision = Column(Integer)  # Write order: one higher than every earlier batch's (see agent/writer.py)
 
     server = relationship("Server", back_populates="ping_result", uselist=False)
 
@@ -45,10 +56,14 @@ class PingResult(Base):
 class AlertLog(Base):
     """Logs alerts for server events (downtime, recovery, etc.)."""
     __tablename__ = "alert_logs"
+    __table_args__ = (
+        # Latest downtime/recovery alert per server, read from the index alone
+        Index("ix_alert_logs_server_id_alert_type_id", "server_id", "alert_type", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False, index=True)
-    alert_type = Column(String, index=True)  # e.g., "offline", "recovery"
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+    alert_type = Column(String)  # e.g., "offline", "recovery"
     message = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
@@ -60,18 +75,70 @@ class AlertLog(Base):
 class PingLog(Base):
     """Historical log of all ping attempts."""
     __tablename__ = "ping_logs"
+    __table_args__ = (
+        # Keyset pagination of the history API walks (timestamp, id), per server or overall
+        Index("ix_ping_logs_server_id_timestamp_id", "server_id", "timestamp", "id"),
+        Index("ix_ping_logs_timestamp_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow)
     response_time = Column(Float)
-    success = Column(Boolean, default=False, index=True)
+    success = Column(Boolean, default=False)
+    check_type = Column(String, default="icmp", server_default="icmp")
 
     server = relationship("Server", back_populates="ping_logs")
     
     def __repr__(self):
         return f"<PingLog(server={self.server_id}, time={self.timestamp}, success={self.success}, response_time={self.response_time})>"
     
+class PingRollup(Base):
+    """Per-server ping aggregates for one 1m, 1h or 1d time bucket."""
+    __tablename__ = "ping_rollups"
+    __table_args__ = (
+        UniqueConstraint("server_id", "resolution", "bucket_start", name="uq_ping_rollups_bucket"),
+        Index("ix_ping_rollups_resolution_bucket_start", "resolution", "bucket_start"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+    resolution = Column(String, nullable=False)  # "1m", "1h" or "1d"
+    bucket_start = Column(DateTime, nullable=False)
+    success_count = Column(Integer, nullable=False, default=0)
+    failure_count = Column(Integer, nullable=False, default=0)
+    latency_count = Column(Integer, nullable=False, default=0)
+    latency_sum = Column(Float, nullable=False, default=0.0)
+    latency_min = Column(Float)
+    latency_max = Column(Float)
+    latency_p95 = Column(Float)
+    latency_sketch = Column(Text)  # LatencySketch.to_string(), merged on every update
+
+    server = relationship("Server", back_populates="rollups")
+
+    @property
+    def latency_avg(self):
+        return self.latency_sum / self.latency_count if self.latency_count else None
+
+    def __repr__(self):
+        return f"<PingRollup(server={self.server_id}, {self.resolution}@{self.bucket_start}, ok={self.success_count}, fail={self.failure_count})>"
+
+class AgentHeartbeat(Base):
+    """Liveness and load of one agent instance; live agents share the servers between them."""
+    __tablename__ = "agent_heartbeats"
+
+    agent_id = Column(String, primary_key=True)
+    hostname = Column(String)
+    pid = Column(Integer)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow, index=True)
+    assigned_servers = Column(Integer, default=0)
+    probes_per_minute = Column(Float, default=0.0)
+    writer_backlog = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"<AgentHeartbeat(agent={self.agent_id}, last_seen={self.last_seen}, servers={self.assigned_servers})>"
+
 class AppSetting(Base):
     """Application-wide settings."""
     __tablename__ = "app_settings"
@@ -82,45 +149,50 @@ class AppSetting(Base):
     def __repr__(self):
         return f"<AppSettings(key={self.key}, value={self.value})>"
 
-# Add indexes for better performance (only if they don't exist)
-from sqlalchemy import text
+class SpoolOffset(Base):
+    """How far an agent's local result spool has been replayed, committed with the replayed rows."""
+    __tablename__ = "spool_offsets"
 
-# Create indexes only if they don't exist
-def create_indexes_if_not_exist():
-    from sqlalchemy import create_engine
-    from db.init_db import DB_URL
-    
-    engine = create_engine(DB_URL)
-    
-    # Check if indexes exist before creating
-    with engine.connect() as conn:
-        # Server table indexes
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_servers_name'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_servers_name ON servers (name)"))
-        
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_servers_ip_address'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_servers_ip_address ON servers (ip_address)"))
-        
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_servers_is_active'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_servers_is_active ON servers (is_active)"))
-        
-        # PingResult table indexes
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_ping_result_server_id'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_ping_result_server_id ON ping_result (server_id)"))
-        
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_ping_result_is_successful'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_ping_result_is_successful ON ping_result (is_successful)"))
-        
-        # AlertLog table indexes
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_alert_logs_server_id'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_alert_logs_server_id ON alert_logs (server_id)"))
-        
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_alert_logs_alert_type'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_alert_logs_alert_type ON alert_logs (alert_type)"))
-        
-        # PingLog table indexes
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_ping_logs_server_id'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_ping_logs_server_id ON ping_logs (server_id)"))
-        
-        if not conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND name='ix_ping_logs_success'")).fetchone():
-            conn.execute(text("CREATE INDEX ix_ping_logs_success ON ping_logs (success)"))
+    spool_id = Column(String, primary_key=True)
+    segment = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SpoolOffset(spool={self.spool_id}, segment={self.segment}, offset={self.offset})>"
+
+class SchemaVersion(Base):
+    """One applied schema migration (see db/migrations.py)."""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaVersion(version={self.version}, name={self.name})>"
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+def add_missing_columns(engine):
+    """
+    Add columns introduced after a database was created.
+
+    create_all() only creates missing tables, so new nullable (or
+    server-defaulted) columns of existing tables are added here with
+    ALTER TABLE ... ADD COLUMN.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                logging.info(f"➕ Added column {table.name}.{column.name}")
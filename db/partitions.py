@@ -0,0 +1,267 @@
+"""
+Opt-in per-month partitions of `ping_logs` for SQLite.
+
+With PING_LOG_PARTITIONS enabled, probe results are written to one
+SQLite file per calendar month, next to the main database:
+
+    <database>.partitions/<YYYY-MM>.db
+
+Each file holds a `ping_logs` table with the same columns and the two
+keyset indexes, and is ATTACHed to a connection as `ping_logs_<YYYY>_<MM>`
+when a query needs it. Range queries only touch the months they overlap,
+every index stays the size of one month, and expiring a month is a file
+unlink instead of a large DELETE followed by a VACUUM.
+
+The main `ping_logs` table stays in use for history written before
+partitioning was enabled, and for rows of a month that is not attached
+to the writing transaction (late rows for an old month). Readers always
+include it. Ids stay unique across tables: each partition numbers its rows
+from `<month number> << 32`.
+
+Only the writer engine creates partitions; readers attach the files that
+exist. An attached file takes the journal mode and synchronous setting of
+the main database, but a transaction that writes to several files is only
+atomic per file in WAL mode: a crash in the middle of its commit can keep
+the rows of one file and lose those of another. With partitions enabled,
+ping log rows are therefore written at least once, not exactly once, by
+the result spool's replay (which records its position in the main file).
+"""
+
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import event
+
+# Opt-in month partitioning of ping logs - can be overridden by environment variables
+PING_LOG_PARTITIONS = os.getenv("PING_LOG_PARTITIONS", "false").lower() in ("1", "true", "yes", "on")
+PARTITION_DIR = os.getenv("PARTITION_DIR")  # defaults to "<sqlite db>.partitions"
+# SQLite attaches at most 10 databases per connection unless compiled otherwise
+PARTITION_MAX_ATTACHED = int(os.getenv("PARTITION_MAX_ATTACHED", "8"))
+
+ALIAS_PREFIX = "ping_logs_"
+ID_SHIFT = 32
+
+_PARTITION_DDL = (
+    "CREATE TABLE IF NOT EXISTS {alias}.ping_logs ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, server_id INTEGER NOT NULL, timestamp DATETIME, "
+    "response_time FLOAT, success BOOLEAN, check_type VARCHAR DEFAULT 'icmp')",
+    "CREATE INDEX IF NOT EXISTS {alias}.ix_ping_logs_server_id_timestamp_id ON ping_logs (server_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS {alias}.ix_ping_logs_timestamp_id ON ping_logs (timestamp, id)",
+)
+
+def partition_dir(engine):
+    """Directory of the month partitions, or None when partitioning is off for this engine."""
+    if not PING_LOG_PARTITIONS:
+        return None
+    url = engine.url
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return None
+    return PARTITION_DIR or f"{url.database}.partitions"
+
+def month_of(timestamp):
+    """Partition key ("YYYY-MM") of a timestamp."""
+    return f"{timestamp:%Y-%m}"
+
+def month_bounds(month):
+    """[start, end) of a partition key."""
+    start = datetime.strptime(month, "%Y-%m")
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+def alias_of(month):
+    return ALIAS_PREFIX + month.replace("-", "_")
+
+def _month_number(month):
+    start = datetime.strptime(month, "%Y-%m")
+    return start.year * 12 + start.month - 1
+
+def list_partitions(directory):
+    """Existing partition keys, oldest first."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    months = []
+    for name in os.listdir(directory):
+        month, ext = os.path.splitext(name)
+        if ext != ".db":
+            continue
+        try:
+            datetime.strptime(month, "%Y-%m")
+        except ValueError:
+            continue
+        months.append(month)
+    return sorted(months)
+
+def months_in_range(directory, start=None, end=None):
+    """Existing partitions overlapping [start, end), oldest first."""
+    months = []
+    for month in list_partitions(directory):
+        month_start, month_end = month_bounds(month)
+        if (start is None or month_end > start) and (end is None or month_start < end):
+            months.append(month)
+    return months
+
+def _attached(dbapi_connection):
+    return {row[1] for row in dbapi_connection.execute("PRAGMA database_list") if row[1].startswith(ALIAS_PREFIX)}
+
+def _match_main_journal(dbapi_connection, alias):
+    # Journal mode and synchronous are per database file, not per connection
+    journal_mode = dbapi_connection.execute("PRAGMA main.journal_mode").fetchone()[0]
+    synchronous = dbapi_connection.execute("PRAGMA main.synchronous").fetchone()[0]
+    dbapi_connection.execute(f"PRAGMA {alias}.journal_mode={journal_mode}")
+    dbapi_connection.execute(f"PRAGMA {alias}.synchronous={synchronous}")
+
+def _detach_dropped(dbapi_connection, connection_record=None, connection_proxy=None):
+    """Detach partitions whose file has been deleted, by this process or another one."""
+    for _, alias, path in dbapi_connection.execute("PRAGMA database_list").fetchall():
+        if alias.startswith(ALIAS_PREFIX) and not (path and os.path.exists(path)):
+            dbapi_connection.execute(f"DETACH DATABASE {alias}")
+
+def _create_partition(dbapi_connection, month):
+    alias = alias_of(month)
+    for statement in _PARTITION_DDL:
+        dbapi_connection.execute(statement.format(alias=alias))
+    dbapi_connection.execute(
+        f"INSERT INTO {alias}.sqlite_sequence (name, seq) SELECT 'ping_logs', ? "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {alias}.sqlite_sequence WHERE name = 'ping_logs')",
+        (_month_number(month) << ID_SHIFT,)
+    )
+    if dbapi_connection.in_transaction:
+        dbapi_connection.commit()
+
+def attach_months(dbapi_connection, directory, months, create=False):
+    """
+    Make sure the partitions of `months` are attached to a DBAPI connection.
+
+    ATTACH is not allowed inside a transaction, so this has to run before
+    the connection starts one. Older months are detached first when the
+    connection would go over PARTITION_MAX_ATTACHED.
+
+    Returns:
+        set: the aliases attached to the connection afterwards
+    """
+    attached = _attached(dbapi_connection)
+    missing = [
+        month for month in months
+        if alias_of(month) not in attached and (create or os.path.exists(os.path.join(directory, f"{month}.db")))
+    ]
+    if not missing:
+        return attached
+    if dbapi_connection.in_transaction:
+        raise RuntimeError(f"Partitions {', '.join(missing)} must be attached before the transaction begins")
+
+    wanted = {alias_of(month) for month in months}
+    spare = sorted(attached - wanted)
+    while spare and len(attached) + len(missing) > PARTITION_MAX_ATTACHED:
+        alias = spare.pop(0)
+        dbapi_connection.execute(f"DETACH DATABASE {alias}")
+        attached.discard(alias)
+
+    os.makedirs(directory, exist_ok=True)
+    for month in missing[:max(0, PARTITION_MAX_ATTACHED - len(attached))]:
+        dbapi_connection.execute(f"ATTACH DATABASE ? AS {alias_of(month)}", (os.path.join(directory, f"{month}.db"),))
+        _match_main_journal(dbapi_connection, alias_of(month))
+        if create:
+            _create_partition(dbapi_connection, month)
+        attached.add(alias_of(month))
+    return attached
+
+def attach_partitions(conn, start=None, end=None):
+    """
+    Attach the partitions overlapping [start, end) to a SQLAlchemy connection.
+
+    Call it before the first statement of a transaction on the writer
+    engine, which begins with BEGIN IMMEDIATE.
+
+    Returns:
+        list: the partition keys in range, oldest first
+    """
+    directory = partition_dir(conn.engine)
+    if directory is None:
+        return []
+    months = months_in_range(directory, start, end)
+    attached = attach_months(conn.connection.dbapi_connection, directory, months)
+    unavailable = [month for month in months if alias_of(month) not in attached]
+    if unavailable:
+        logging.warning(f"⚠️ Partitions {', '.join(unavailable)} not attached (PARTITION_MAX_ATTACHED={PARTITION_MAX_ATTACHED})")
+    return [month for month in months if alias_of(month) in attached]
+
+def _translate(month):
+    return {"schema_translate_map": {None: alias_of(month)}}
+
+def log_sources(conn, start=None, end=None):
+    """
+    Execution options to run a `ping_logs` query with, once per table, for rows in [start, end).
+
+    The first entry reads the main table; the others read one month each,
+    oldest first, through a schema translation of the same table.
+    """
+    return [{}] + [_translate(month) for month in attach_partitions(conn, start, end)]
+
+def route_log_rows(conn, rows):
+    """
+    Group ping log rows by the table they are written to.
+
+    Returns:
+        list: (execution options, rows) pairs
+    """
+    directory = partition_dir(conn.engine)
+    if directory is None:
+        return [({}, rows)]
+    attached = _attached(conn.connection.dbapi_connection)
+    groups = {}
+    for row in rows:
+        month = month_of(row["timestamp"])
+        groups.setdefault(month if alias_of(month) in attached else None, []).append(row)
+    return [({} if month is None else _translate(month), group) for month, group in groups.items()]
+
+def drop_expired_partitions(engine, cutoff):
+    """
+    Delete the files of months that end at or before `cutoff`. Returns the months dropped.
+
+    The files are deleted while holding a connection of `engine` (the one
+    writer connection of the writer engine) with the months detached from
+    it. Pooled connections that still have a deleted month attached,
+    including those of other processes, detach it on their next checkout.
+    """
+    directory = partition_dir(engine)
+    expired = [month for month in list_partitions(directory) if month_bounds(month)[1] <= cutoff]
+    if not expired:
+        return []
+    with engine.connect() as conn:
+        dbapi_connection = conn.connection.dbapi_connection
+        attached = _attached(dbapi_connection)
+        for month in expired:
+            if alias_of(month) in attached:
+                dbapi_connection.execute(f"DETACH DATABASE {alias_of(month)}")
+            path = os.path.join(directory, f"{month}.db")
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    logging.info(f"🗑️ Dropped ping log partitions {', '.join(expired)}")
+    return expired
+
+def enable_partitions(engine, writer=False, clock=datetime.utcnow):
+    """
+    Set up month partitions on an engine.
+
+    Every engine detaches deleted months when a connection is checked out.
+    The writer engine also attaches (and creates) the current and previous
+    month when a transaction begins: new rows land in the current month,
+    the previous one takes results of the last probes before a month
+    boundary. Readers attach existing months when a query needs them.
+    """
+    directory = partition_dir(engine)
+    if directory is None:
+        return
+
+    event.listen(engine, "checkout", _detach_dropped)
+    if not writer:
+        return
+
+    @event.listens_for(engine, "begin")
+    def _attach_current(conn):
+        now = clock()
+        previous = month_of(datetime(now.year - (now.month == 1), (now.month - 2) % 12 + 1, 1))
+        dbapi_connection = conn.connection.dbapi_connection
+        attach_months(dbapi_connection, directory, [previous], create=False)
+        attach_months(dbapi_connection, directory, [month_of(now)], create=True)
@@ -0,0 +1,156 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select, text
+from db.archive import archive_dir, archived_days, prune_archive
+from db.init_db import get_writer_engine
+from db.models import AgentHeartbeat, AlertLog, PingLog, PingRollup
+from db.partitions import attach_partitions, drop_expired_partitions, log_sources
+from db.rollups import RESOLUTIONS, bucket_start, rebuild_rollups
+from db.utils import get_setting
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Retention in days per data set (0, the default, keeps data forever). Each
+# can be overridden at runtime through the AppSetting of the same name.
+RETENTION_DEFAULTS = {
+    "retention_ping_logs_days": int(os.getenv("RETENTION_PING_LOGS_DAYS", "0")),
+    "retention_alert_logs_days": int(os.getenv("RETENTION_ALERT_LOGS_DAYS", "0")),
+    "retention_rollups_1m_days": int(os.getenv("RETENTION_ROLLUPS_1M_DAYS", "0")),
+    "retention_rollups_1h_days": int(os.getenv("RETENTION_ROLLUPS_1H_DAYS", "0")),
+    "retention_rollups_1d_days": int(os.getenv("RETENTION_ROLLUPS_1D_DAYS", "0")),
+    "retention_agent_heartbeats_days": int(os.getenv("RETENTION_AGENT_HEARTBEATS_DAYS", "0")),
+}
+
+# Rows per DELETE, and the pause between them so other writers get the lock
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "2000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+
+def retention_days(key):
+    """Configured retention for `key`, preferring the AppSetting over the environment."""
+    value = get_setting(key)
+    if value is None:
+        return RETENTION_DEFAULTS[key]
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning(f"Ignoring invalid {key} setting: {value!r}")
+        return RETENTION_DEFAULTS[key]
+
+def _used_bytes(conn):
+    """Bytes of the SQLite file holding live data (None on other databases)."""
+    if conn.dialect.name != "sqlite":
+        return None
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    page_count = conn.execute(text("PRAGMA page_count")).scalar()
+    freelist = conn.execute(text("PRAGMA freelist_count")).scalar()
+    return (page_count - freelist) * page_size
+
+def _delete_in_batches(engine, table, condition, batch_size, pause):
+    """Delete matching rows a batch at a time, each batch in its own short transaction."""
+    deleted = 0
+    while True:
+        # No ORDER BY, so the batch is read from the index on the condition
+        ids = select(table.c.id).where(condition).limit(batch_size)
+        with engine.begin() as conn:
+            count = conn.execute(delete(table).where(table.c.id.in_(ids.scalar_subquery()))).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+        time.sleep(pause)
+
+def _downsample_expiring_days(engine, cutoff):
+    """
+    Make sure every whole day of raw logs about to be deleted has rollups.
+
+    History logged before rollups existed is rolled up first, so deleting
+    raw rows (or archived days) never loses the aggregates.
+    """
+    logs = PingLog.__table__
+    rollups = PingRollup.__table__
+    with engine.connect() as conn:
+        candidates = [
+            conn.execute(select(func.min(logs.c.timestamp)), execution_options=options).scalar()
+            for options in log_sources(conn, end=cutoff)
+        ]
+    candidates += archived_days(archive_dir(engine))[:1]
+    oldest = min((value for value in candidates if value is not None), default=None)
+    if oldest is None:
+        return
+    day = bucket_start(oldest, RESOLUTIONS["1d"])
+    while day < cutoff:
+        with engine.connect() as conn:
+            attach_partitions(conn, day, day + timedelta(days=1))
+            with conn.begin():
+                has_rollups = conn.execute(
+                    select(rollups.c.id).where(rollups.c.resolution == "1d", rollups.c.bucket_start == day).limit(1)
+                ).first()
+                if not has_rollups:
+                    rebuild_rollups(conn, day, day + timedelta(days=1))
+        day += timedelta(days=1)
+
+def enforce_retention(now=None, batch_size=None, pause=None, engine=None):
+    """
+    Delete raw and aggregated rows older than their configured retention.
+
+    Returns:
+        dict: rows deleted per data set, and bytes reclaimed in the database file
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    pause = RETENTION_BATCH_PAUSE if pause is None else pause
+    engine = engine or get_writer_engine()
+
+    with engine.connect() as conn:
+        used_before = _used_bytes(conn)
+
+    report = {}
+    started = time.monotonic()
+
+    days = retention_days("retention_ping_logs_days")
+    if days:
+        cutoff = bucket_start(now - timedelta(days=days), RESOLUTIONS["1d"])
+        _downsample_expiring_days(engine, cutoff)
+        table = PingLog.__table__
+        report["ping_logs"] = _delete_in_batches(engine, table, table.c.timestamp < cutoff, batch_size, pause)
+        # Month partitions go as a whole once the month has expired
+        report["ping_log_partitions"] = len(drop_expired_partitions(engine, cutoff))
+        report["archived_days"] = prune_archive(cutoff, archive_dir(engine))
+
+    days = retention_days("retention_alert_logs_days")
+    if days:
+        table = AlertLog.__table__
+        cutoff = now - timedelta(days=days)
+        report["alert_logs"] = _delete_in_batches(engine, table, table.c.timestamp < cutoff, batch_size, pause)
+
+    table = PingRollup.__table__
+    for resolution in RESOLUTIONS:
+        days = retention_days(f"retention_rollups_{resolution}_days")
+        if days:
+            cutoff = now - timedelta(days=days)
+            condition = (table.c.resolution == resolution) & (table.c.bucket_start < cutoff)
+            report[f"rollups_{resolution}"] = _delete_in_batches(engine, table, condition, batch_size, pause)
+
+    days = retention_days("retention_agent_heartbeats_days")
+    if days:
+        table = AgentHeartbeat.__table__
+        with engine.begin() as conn:
+            report["agent_heartbeats"] = conn.execute(
+                delete(table).where(table.c.last_seen < now - timedelta(days=days))
+            ).rowcount
+
+    with engine.connect() as conn:
+        used_after = _used_bytes(conn)
+    report["bytes_reclaimed"] = used_before - used_after if used_before is not None else None
+    report["seconds"] = round(time.monotonic() - started, 2)
+
+    deleted = sum(value for key, value in report.items() if key not in ("bytes_reclaimed", "seconds"))
+    if deleted:
+        logging.info(f"🧹 Retention removed {deleted} rows: {report}")
+    return report
@@ -0,0 +1,230 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from db.archive import archive_dir, iter_archived
+from db.models import PingLog, PingRollup
+from db.partitions import log_sources
+from db.sketch import LatencySketch
+
+# Bucket sizes in seconds, finest first
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+EPOCH = datetime(1970, 1, 1)
+
+def bucket_start(timestamp, seconds):
+    """Start of the bucket of `seconds` length containing `timestamp`."""
+    offset = int((timestamp - EPOCH).total_seconds()) // seconds * seconds
+    return EPOCH + timedelta(seconds=offset)
+
+def pick_resolution(start, end):
+    """Coarsest resolution that still gives a useful number of points for a range."""
+    span = end - start
+    if span <= timedelta(hours=6):
+        return "1m"
+    if span <= timedelta(days=14):
+        return "1h"
+    return "1d"
+
+class _Bucket:
+    """Running aggregate for one (server, resolution, bucket) key."""
+
+    __slots__ = ("id", "success", "failure", "latency_count", "latency_sum", "latency_min", "latency_max", "sketch")
+
+    def __init__(self):
+        self.id = None
+        self.success = 0
+        self.failure = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.sketch = LatencySketch()
+
+    def add(self, success, response_time):
+        if success:
+            self.success += 1
+        else:
+            self.failure += 1
+        if response_time is not None:
+            self.latency_count += 1
+            self.latency_sum += response_time
+            self.latency_min = response_time if self.latency_min is None else min(self.latency_min, response_time)
+            self.latency_max = response_time if self.latency_max is None else max(self.latency_max, response_time)
+            self.sketch.add(response_time)
+
+    def merge_row(self, row):
+        """Fold in the aggregate already stored in the database."""
+        self.id = row.id
+        self.success += row.success_count
+        self.failure += row.failure_count
+        self.latency_count += row.latency_count
+        self.latency_sum += row.latency_sum
+        for value in (row.latency_min, row.latency_max):
+            if value is not None:
+                self.latency_min = value if self.latency_min is None else min(self.latency_min, value)
+                self.latency_max = value if self.latency_max is None else max(self.latency_max, value)
+        if row.latency_sketch:
+            stored = LatencySketch.from_string(row.latency_sketch)
+            if stored.relative_accuracy != self.sketch.relative_accuracy:
+                # Written before SKETCH_RELATIVE_ACCURACY changed: the bucket continues at the new accuracy
+                stored = stored.rescaled(self.sketch.relative_accuracy)
+            self.sketch.merge(stored)
+
+    def values(self):
+        return {
+            "success_count": self.success,
+            "failure_count": self.failure,
+            "latency_count": self.latency_count,
+            "latency_sum": self.latency_sum,
+            "latency_min": self.latency_min,
+            "latency_max": self.latency_max,
+            "latency_p95": self.sketch.quantile(0.95),
+            "latency_sketch": self.sketch.to_string(),
+        }
+
+def _accumulate(samples):
+    buckets = defaultdict(_Bucket)
+    for server_id, timestamp, success, response_time, *_ in samples:
+        for resolution, seconds in RESOLUTIONS.items():
+            buckets[(server_id, resolution, bucket_start(timestamp, seconds))].add(success, response_time)
+    return buckets
+
+def _merge_existing(conn, buckets):
+    table = PingRollup.__table__
+    wanted = defaultdict(lambda: (set(), set()))
+    for server_id, resolution, start in buckets:
+        server_ids, starts = wanted[resolution]
+        server_ids.add(server_id)
+        starts.add(start)
+
+    for resolution, (server_ids, starts) in wanted.items():
+        rows = conn.execute(
+            select(table).where(
+                table.c.resolution == resolution,
+                table.c.server_id.in_(server_ids),
+                table.c.bucket_start.in_(starts)
+            )
+        )
+        for row in rows:
+            bucket = buckets.get((row.server_id, resolution, row.bucket_start))
+            if bucket is not None:
+                bucket.merge_row(row)
+
+def apply_rollups(conn, samples):
+    """
+    Fold (server_id, timestamp, success, response_time) samples into the
+    1m/1h/1d rollups, in the caller's transaction.
+
+    Only the buckets the samples touch are read and rewritten, so the cost
+    is proportional to the batch and not to the history.
+    """
+    buckets = _accumulate(samples)
+    if not buckets:
+        return
+    _merge_existing(conn, buckets)
+
+    table = PingRollup.__table__
+    inserts = []
+    updates = []
+    for (server_id, resolution, start), bucket in buckets.items():
+        if bucket.id is None:
+            inserts.append({"server_id": server_id, "resolution": resolution, "bucket_start": start, **bucket.values()})
+        else:
+            updates.append({"b_id": bucket.id, **bucket.values()})
+    if inserts:
+        conn.execute(insert(table), inserts)
+    if updates:
+        conn.execute(update(table).where(table.c.id == bindparam("b_id")), updates)
+
+def rebuild_rollups(conn, start, end, window=timedelta(hours=1)):
+    """
+    Recompute rollups from raw ping logs for whole days in [start, end).
+
+    Used to backfill history logged before rollups existed. Raw rows are
+    streamed one window at a time to keep memory flat, from the database
+    (and its month partitions) and from the columnar archive. The range
+    starts at the day of the oldest raw log still there, so rollups of
+    days whose raw logs retention already deleted are left alone.
+    """
+    day = RESOLUTIONS["1d"]
+    start = bucket_start(start, day)
+    if end != bucket_start(end, day):
+        end = bucket_start(end, day) + timedelta(days=1)
+    # Attached before the DELETE below starts the transaction
+    sources = log_sources(conn, start, end)
+    logs = PingLog.__table__
+    directory = archive_dir(conn.engine)
+
+    # Days before the oldest raw log left (deleted by retention) keep their
+    # rollups: they could not be rebuilt
+    in_range = (logs.c.timestamp >= start) & (logs.c.timestamp < end)
+    candidates = [
+        conn.execute(select(func.min(logs.c.timestamp)).where(in_range), execution_options=options).scalar()
+        for options in sources
+    ]
+    archived = iter_archived(None, start, end, directory=directory)
+    try:
+        candidates.append(next((row.timestamp for row in archived), None))
+    finally:
+        archived.close()
+    oldest = min((value for value in candidates if value is not None), default=None)
+    if oldest is None:
+        logging.info(f"📊 No ping logs left for {start:%Y-%m-%d}..{end:%Y-%m-%d}, rollups kept as they are")
+        return 0
+    start = bucket_start(oldest, day)
+
+    table = PingRollup.__table__
+    conn.execute(delete(table).where(table.c.bucket_start >= start, table.c.bucket_start < end))
+
+    total = 0
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        query = (
+            select(logs.c.server_id, logs.c.timestamp, logs.c.success, logs.c.response_time)
+            .where(logs.c.timestamp >= window_start, logs.c.timestamp < window_end)
+        )
+        samples = [row for options in sources for row in conn.execute(query, execution_options=options)]
+        samples += [
+            (row.server_id, row.timestamp, row.success, row.response_time)
+            for row in iter_archived(None, window_start, window_end, directory=directory)
+        ]
+        apply_rollups(conn, samples)
+        total += len(samples)
+        window_start = window_end
+    logging.info(f"📊 Rebuilt rollups for {start:%Y-%m-%d}..{end:%Y-%m-%d} from {total} ping logs")
+    return total
+
+def uptime_by_server(session, since):
+    """Percentage of successful pings per server since `since`, from the hourly rollups."""
+    rows = (
+        session.query(
+            PingRollup.server_id,
+            func.sum(PingRollup.success_count),
+            func.sum(PingRollup.failure_count)
+        )
+        .filter(PingRollup.resolution == "1h", PingRollup.bucket_start >= bucket_start(since, RESOLUTIONS["1h"]))
+        .group_by(PingRollup.server_id)
+        .all()
+    )
+    return {
+        server_id: round(100.0 * success / (success + failure), 2)
+        for server_id, success, failure in rows
+        if success + failure
+    }
+
+def rollup_series(session, server_id, start, end, resolution=None):
+    """Rollup rows for one server in [start, end), at `resolution` or one picked for the range."""
+    resolution = resolution or pick_resolution(start, end)
+    return (
+        session.query(PingRollup)
+        .filter(
+            PingRollup.server_id == server_id,
+            PingRollup.resolution == resolution,
+            PingRollup.bucket_start >= bucket_start(start, RESOLUTIONS[resolution]),
+            PingRollup.bucket_start < end
+        )
+        .order_by(PingRollup.bucket_start)
+        .all()
+    )
@@ -0,0 +1,142 @@
+import base64
+import math
+import os
+
+# Relative accuracy of quantiles read from a sketch - can be overridden by environment variable
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.02"))
+
+# Latencies at or below this (in ms) are counted in a dedicated zero bucket
+MIN_TRACKED_LATENCY_MS = 0.01
+
+class LatencySketch:
+    """
+    Mergeable latency histogram with logarithmic buckets (DDSketch style).
+
+    A value x lands in bucket ceil(log(x) / log(gamma)), so every quantile
+    read back is within `relative_accuracy` of a true sample value. Two
+    sketches with the same accuracy merge by adding bucket counts, which is
+    what lets minute buckets roll up into hours and days.
+    """
+
+    __slots__ = ("relative_accuracy", "gamma", "log_gamma", "bins", "zero_count", "count")
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        """Add a latency sample in milliseconds."""
+        if value <= MIN_TRACKED_LATENCY_MS:
+            self.zero_count += count
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        """Add another sketch's samples into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def rescaled(self, relative_accuracy):
+        """
+        A copy with another accuracy, for a sketch stored before SKETCH_RELATIVE_ACCURACY changed.
+
+        Every bin is re-added at its representative value, so quantiles of
+        the copy carry the error of both accuracies.
+        """
+        sketch = LatencySketch(relative_accuracy)
+        sketch.zero_count = sketch.count = self.zero_count
+        for key, count in self.bins.items():
+            sketch.add(2 * self.gamma ** key / (self.gamma + 1), count)
+        return sketch
+
+    def quantile(self, q):
+        """Estimate the q-quantile (0 <= q <= 1), or None if the sketch is empty."""
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """Estimate several quantiles in one pass over the bins."""
+        if not self.count:
+            return [None] * len(qs)
+        keys = sorted(self.bins)
+        results = {}
+        seen = self.zero_count
+        index = 0
+        for q in sorted(qs):
+            rank = q * (self.count - 1)
+            if rank < self.zero_count:
+                results[q] = 0.0
+                continue
+            while index < len(keys) - 1 and rank >= seen + self.bins[keys[index]]:
+                seen += self.bins[keys[index]]
+                index += 1
+            results[q] = 2 * self.gamma ** keys[index] / (self.gamma + 1)
+        return [results[q] for q in qs]
+
+    def to_string(self):
+        """
+        Compact text form: "accuracy~base64".
+
+        The payload is the zero count followed by every bin as a
+        (key delta, count) pair, all as varints: neighbouring keys are
+        close, so most bins take two bytes.
+        """
+        payload = bytearray()
+        _put_varint(payload, self.zero_count)
+        previous = 0
+        for key, count in sorted(self.bins.items()):
+            _put_varint(payload, _zigzag(key - previous))
+            _put_varint(payload, count)
+            previous = key
+        encoded = base64.b64encode(bytes(payload)).decode("ascii").rstrip("=")
+        return f"{self.relative_accuracy}~{encoded}"
+
+    @classmethod
+    def from_string(cls, data):
+        """Rebuild a sketch from `to_string()` output."""
+        accuracy, encoded = data.split("~")
+        payload = base64.b64decode(encoded + "=" * (-len(encoded) % 4))
+        sketch = cls(float(accuracy))
+        sketch.zero_count, offset = _get_varint(payload, 0)
+        sketch.count = sketch.zero_count
+        key = 0
+        while offset < len(payload):
+            delta, offset = _get_varint(payload, offset)
+            count, offset = _get_varint(payload, offset)
+            key += _unzigzag(delta)
+            sketch.bins[key] = count
+            sketch.count += count
+        return sketch
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+def _put_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def _get_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
@@ -0,0 +1,32 @@
+from sqlalchemy.orm import contains_eager, joinedload
+from db.models import Server, AlertLog, AgentHeartbeat
+
+def server_summaries(session):
+    """
+    Every server with its latest result, loaded in a single query.
+
+    The dashboard only needs the newest probe per server, which PingResult
+    already holds, so the cost grows with the number of servers and not
+    with the size of the ping history.
+    """
+    return (
+        session.query(Server)
+        .outerjoin(Server.ping_result)
+        .options(contains_eager(Server.ping_result))
+        .order_by(Server.id)
+        .all()
+    )
+
+def recent_alerts(session, limit=10):
+    """The newest alerts, with their server loaded in the same query."""
+    return (
+        session.query(AlertLog)
+        .options(joinedload(AlertLog.server))
+        .order_by(AlertLog.timestamp.desc())
+        .limit(limit)
+        .all()
+    )
+
+def agent_heartbeats(session):
+    """Every agent that has reported in, with its last heartbeat and load."""
+    return session.query(AgentHeartbeat).order_by(AgentHeartbeat.agent_id).all()
@@ -1,20 +1,103 @@
-from db.init_db import init_db
-from db.models import Server, AppSetting
+import logging
+import os
+import threading
+import time
+import uuid
+from db.init_db import get_engine, session_scope, writer_session_scope
+from db.models import AppSetting
+
+# Seconds a settings snapshot is served from memory - can be overridden by environment variable
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "5"))
+# File touched on every write so other processes drop their snapshot early
+# (defaults to "<sqlite database>.settings"; TTL only on other databases)
+SETTINGS_MARKER_PATH = os.getenv("SETTINGS_MARKER_PATH")
+
+class SettingsCache:
+    """
+    In-memory snapshot of the app_settings table.
+
+    The whole table is a handful of rows, so it is loaded in one query and
+    reads are dictionary lookups. A snapshot is dropped when it is older
+    than `ttl`, when this process writes a setting, or when the marker
+    file's mtime shows that another process (agent or another dashboard
+    worker) wrote one.
+    """
+
+    def __init__(self, ttl=None, marker_path=None, clock=time.monotonic):
+        self.ttl = SETTINGS_CACHE_TTL if ttl is None else ttl
+        self.marker_path = marker_path or SETTINGS_MARKER_PATH
+        self.clock = clock
+        self._values = None
+        self._engine = None
+        self._expires = 0
+        self._marker_mtime = None
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        values = self._values
+        if values is None or not self._is_fresh():
+            values = self._load()
+        return values.get(key, default)
+
+    def invalidate(self):
+        """Drop the local snapshot and tell other processes to drop theirs."""
+        self._values = None
+        path = self._marker()
+        if path:
+            try:
+                with open(path, "w") as marker:
+                    marker.write(uuid.uuid4().hex)
+            except OSError as e:
+                logging.warning(f"Could not touch settings marker {path}: {e}")
+
+    def _is_fresh(self):
+        if self._engine is not get_engine() or self.clock() >= self._expires:
+            return False
+        return self._read_marker() == self._marker_mtime
+
+    def _load(self):
+        with self._lock:
+            marker_mtime = self._read_marker()
+            with session_scope() as session:
+                values = dict(session.query(AppSetting.key, AppSetting.value).all())
+            self._engine = get_engine()
+            self._marker_mtime = marker_mtime
+            self._expires = self.clock() + self.ttl
+            self._values = values
+            return values
+
+    def _marker(self):
+        if self.marker_path:
+            return self.marker_path
+        url = get_engine().url
+        if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+            return f"{url.database}.settings"
+        return None
+
+    def _read_marker(self):
+        path = self._marker()
+        if not path:
+            return None
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+# Shared by every caller in this process
+settings_cache = SettingsCache()
 
 def get_setting(key, default=None):
-    session = init_db()
-    setting = session.query(AppSetting).filter_by(key=key).first()
-    value = setting.value if setting else default
-    session.close()
-    return value
+    return settings_cache.get(key, default)
 
 def set_setting(key, value):
-    session = init_db()
-    setting = session.query(AppSetting).filter_by(key=key).first()
-    if setting:
-        setting.value = value
-    else:
-        setting = AppSetting(key=key, value=value)
-        session.add(setting)
-    session.commit()
-    session.close()
+    with writer_session_scope() as session:
+        setting = session.query(AppSetting).filter_by(key=key).first()
+        if setting:
+            setting.value = value
+        else:
+            session.add(AppSetting(key=key, value=value))
+    settings_cache.invalidate()
+
+def bump_servers_version():
+    """Signal the agent that the server list changed and should be re-synced."""
+    set_setting("servers_version", uuid.uuid4().hex)
@@ -0,0 +1,26 @@
+"""Rules for server settings, shared by the dashboard's server forms and bulk import."""
+
+import ipaddress
+
+def clean_ip_address(value):
+    """Normalised form of an IPv4 or IPv6 address; raises ValueError for anything else."""
+    try:
+        return str(ipaddress.ip_address(str(value).strip()))
+    except ValueError:
+        raise ValueError(f"Invalid IP address: {value!r}")
+
+def probe_settings_error(check_type, port, url):
+    """
+    What is missing for a server to be checked with `check_type`.
+
+    Returns:
+        tuple: (field, message) of the first problem, or None
+    """
+    check_type = check_type or "icmp"
+    if check_type == "tcp" and not port:
+        return "port", "TCP checks need a port"
+    if check_type == "dns" and not url:
+        return "url", "DNS checks need a host name to resolve"
+    if check_type == "http" and url and not url.lower().startswith(("http://", "https://")):
+        return "url", "HTTP checks need an http:// or https:// URL"
+    return None
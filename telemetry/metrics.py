@@ -0,0 +1,387 @@
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Directory shared by the processes of one service (the dashboard's gunicorn
+# workers), whose metrics are then added up on every scrape; unset, each
+# process only reports its own
+METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR")
+# Seconds between snapshots a process writes to that directory
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))
+
+class _Shards:
+    """
+    Per-thread cells for a metric.
+
+    Each thread updates only its own cell, so the hot path takes no lock;
+    the lock is only taken the first time a thread touches the metric and
+    when a scrape sums the cells up.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._factory()
+            with self._lock:
+                self._cells.append(cell)
+            return cell
+
+    def cells(self):
+        with self._lock:
+            return list(self._cells)
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(lambda: [0.0])
+
+    def inc(self, amount=1):
+        self._shards.cell()[0] += amount
+
+    def value(self):
+        return sum(cell[0] for cell in self._shards.cells())
+
+class _GaugeChild:
+    __slots__ = ("_value", "_function")
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """Read the value from `function` at scrape time instead: free on the hot path."""
+        self._function = function
+
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception as e:
+                logging.debug(f"Gauge callback failed: {e}")
+                return math.nan
+        return self._value
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_shards")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # Per-thread [count per bucket..., +Inf count, sum]
+        self._shards = _Shards(lambda: [0] * (len(buckets) + 1) + [0.0])
+
+    def observe(self, value):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        """Context manager observing the duration of its block."""
+        return _Timer(self)
+
+    def value(self):
+        totals = [0] * (len(self._buckets) + 2)
+        for cell in self._shards.cells():
+            for i, count in enumerate(cell):
+                totals[i] += count
+        return totals
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Child metric for one combination of label values."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}, use .labels()")
+        return self.labels()
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (f'{key}="{_escape(value)}"' for key, value in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return self._render_value(values, child.value())
+
+    def _render_value(self, values, value):
+        return [f"{self.name}{self._label_text(values)} {_format(value)}"]
+
+    def samples(self):
+        """(label values, value) of every child, for adding up across processes."""
+        return [(values, child.value()) for values, child in sorted(self._children.items())]
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    """Value that can go up and down, set directly or read from a callback at scrape time."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _render_value(self, values, totals):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), totals):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else _format(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(values, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {_format(totals[-1])}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {cumulative}")
+        return lines
+
+class Registry:
+    """The set of metrics one process exposes."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class MultiProcessRegistry:
+    """
+    Adds up the metrics of several processes of one service, like gunicorn workers.
+
+    Every process writes a snapshot of its own registry to
+    `<directory>/<pid>.json`, at most every `interval` seconds from
+    `maybe_write()` and on every scrape. Whichever process answers a scrape
+    adds up the snapshots of all live processes, so every scrape sees the
+    whole service. Counters, histograms and gauges are summed. The snapshot
+    of a process that has exited is deleted, which Prometheus sees as a
+    counter reset.
+    """
+
+    def __init__(self, directory, registry=None, interval=None):
+        self.directory = directory
+        self.registry = registry or REGISTRY
+        self.interval = METRICS_SNAPSHOT_INTERVAL if interval is None else interval
+        self._written = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self):
+        """Write this process's snapshot (atomically, so readers never see half of it)."""
+        snapshot = {
+            metric.name: [[list(values), value] for values, value in metric.samples()]
+            for metric in self.registry.metrics()
+        }
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+        self._written = time.monotonic()
+
+    def maybe_write(self):
+        if time.monotonic() - self._written >= self.interval:
+            self.write()
+
+    def _snapshots(self):
+        for name in os.listdir(self.directory):
+            pid, ext = os.path.splitext(name)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            if not _pid_alive(int(pid)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Removed by another worker
+                continue
+            try:
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError) as e:
+                logging.debug(f"Skipping metrics snapshot {path}: {e}")
+
+    def render(self):
+        """The summed metrics of every live process, in the Prometheus text format."""
+        self.write()
+        totals = {}
+        for snapshot in self._snapshots():
+            for name, samples in snapshot.items():
+                merged = totals.setdefault(name, {})
+                for values, value in samples:
+                    key = tuple(values)
+                    current = merged.get(key)
+                    if current is None:
+                        merged[key] = value
+                    elif isinstance(value, list):
+                        merged[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        merged[key] = current + value
+        lines = []
+        for metric in self.registry.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, value in sorted(totals.get(metric.name, {}).items()):
+                lines.extend(metric._render_value(values, value))
+        return "\n".join(lines) + "\n"
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, owned by someone else
+    return True
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+# Process-wide registry
+REGISTRY = Registry()
+
+def start_metrics_server(port, host="0.0.0.0", registry=None):
+    """
+    Serve /metrics from a daemon thread (for processes without a web app, like the agent).
+
+    Returns the server, or None when the port cannot be bound.
+    """
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not worth a log line each
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        # Typically a second agent on the host with the same port: it keeps probing without /metrics
+        logging.error(f"❌ Cannot serve metrics on {host}:{port}: {e}. Give each agent its own AGENT_METRICS_PORT")
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logging.info(f"📈 Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
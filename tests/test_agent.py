@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import os
+import runpy
+import tempfile
+import threading
+import time
+import unittest
+from functools import partial
+from agent.adaptive import AdaptiveIntervals
+from agent.alerts import DOWN, UP, AlertTracker
+from agent.checks import build_dns_query, parse_dns_response
+from agent.icmp import build_echo_request, checksum, parse_echo_reply
+from agent.probe_engine import ProbeEngine, ProbeTarget, subnet_key
+from agent.scheduler import ProbeScheduler, spread_offset
+from agent.sharding import HashRing
+from agent import workers
+from agent.workers import ProcessProbePool
+
+class FakeProber:
+    """Prober that sleeps instead of touching the network."""
+
+    def __init__(self, delay=0.05, down=()):
+        self.delay = delay
+        self.down = set(down)
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def ping(self, ip_address, timeout):
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        await asyncio.sleep(self.delay)
+        self.inflight -= 1
+        if ip_address in self.down:
+            return {"success": False, "response_time": None}
+        return {"success": True, "response_time": self.delay * 1000}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def make_targets(count, prefix="10.0"):
+    return [
+        ProbeTarget(server_id=i, name=f"srv{i}", ip_address=f"{prefix}.{i // 250}.{i % 250 + 1}")
+        for i in range(count)
+    ]
+
+class TestProbeEngine(unittest.TestCase):
+    def test_probes_run_concurrently(self):
+        prober = FakeProber(delay=0.1, down={"10.0.0.1"})
+        engine = ProbeEngine(prober=prober, max_inflight=100, max_per_subnet=100)
+        try:
+            start = time.time()
+            results = engine.probe_many(make_targets(50))
+            elapsed = time.time() - start
+        finally:
+            engine.stop()
+
+        self.assertEqual(len(results), 50)
+        self.assertLess(elapsed, 1.0)
+        self.assertFalse(results[0][1]["success"])
+        self.assertTrue(all(result["success"] for _, result in results[1:]))
+
+    def test_inflight_limits(self):
+        prober = FakeProber(delay=0.005)
+        engine = ProbeEngine(prober=prober, max_inflight=8, max_per_subnet=3)
+        try:
+            engine.probe_many(make_targets(20))
+            self.assertLessEqual(prober.max_inflight, 3)
+
+            prober.max_inflight = 0
+            engine.probe_many(make_targets(1000))
+            self.assertLessEqual(prober.max_inflight, 8)
+        finally:
+            engine.stop()
+
+    def test_subnet_key(self):
+        self.assertEqual(subnet_key("192.168.1.100"), "192.168.1.0/24")
+        self.assertEqual(subnet_key("2001:db8::1"), "2001:db8::/64")
+        self.assertEqual(subnet_key("not-an-ip"), "not-an-ip")
+
+class TestProcessProbePool(unittest.TestCase):
+    def test_results_come_back_from_every_worker(self):
+        targets = make_targets(300)
+        down = {target.ip_address for target in targets[::7]}
+        pool = ProcessProbePool(workers=3, prober_factory=partial(FakeProber, delay=0.01, down=down))
+        try:
+            results = pool.probe_many(targets)
+
+            self.assertEqual([target for target, _ in results], targets)
+            for target, result in results:
+                self.assertEqual(result["success"], target.ip_address not in down)
+            self.assertEqual(len({pool._route(target.ip_address) for target in targets}), 2)
+
+        finally:
+            pool.stop()
+
+    def test_dead_worker_is_restarted_with_its_probes(self):
+        targets = make_targets(60)
+        pool = ProcessProbePool(workers=2, prober_factory=partial(FakeProber, delay=0.3)).start()
+        try:
+            worker = pool._route(targets[0].ip_address)
+            owned = [target for target in targets if pool._route(target.ip_address) == worker]
+            futures = [pool.submit(target) for target in owned]
+            # Killed with those probes in flight: they are sent again to its replacement
+            dead = pool._processes[worker]
+            dead.kill()
+            self.assertTrue(all(future.result(timeout=20)["success"] for future in futures))
+            self.assertIsNot(pool._processes[worker], dead)
+            self.assertTrue(pool._processes[worker].is_alive())
+            self.assertTrue(pool.submit(owned[0]).result(timeout=10)["success"])
+        finally:
+            pool.stop()
+
+    def test_worker_that_keeps_exiting_is_retired(self):
+        targets = make_targets(60)
+        pool = ProcessProbePool(workers=2, prober_factory=partial(FakeProber, delay=0.01)).start()
+        try:
+            worker = pool._route(targets[0].ip_address)
+            for _ in range(workers.WORKER_MAX_RESTARTS + 1):
+                process = pool._processes[worker]
+                process.kill()
+                for _ in range(500):
+                    if pool._processes[worker] is not process or worker in pool._retired:
+                        break
+                    time.sleep(0.01)
+            self.assertIn(worker, pool._retired)
+            # Its subnets are probed by the other worker now
+            self.assertNotEqual(pool._route(targets[0].ip_address), worker)
+            self.assertTrue(pool.submit(targets[0]).result(timeout=10)["success"])
+        finally:
+            pool.stop()
+
+    def test_spawned_workers_do_not_set_up_agent_logging(self):
+        # Spawned workers run agent/agent.py again as __mp_main__
+        handlers = list(logging.getLogger().handlers)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                runpy.run_path(os.path.join(ROOT, "agent", "agent.py"), run_name="__mp_main__")
+                self.assertFalse(os.path.exists("logs"))
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(logging.getLogger().handlers, handlers)
+
+class TestChecks(unittest.TestCase):
+    """TCP, HTTP and DNS checks against servers on the loopback interface."""
+
+    def setUp(self):
+        self.connections = 0
+        self.engine = ProbeEngine(prober=FakeProber(), max_inflight=10, max_per_subnet=10, timeout=1).start()
+        # The test servers run on a loop of their own
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.engine.stop()
+        self.serve(self._cancel_handlers())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def serve(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _cancel_handlers(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def probe(self, **fields):
+        return self.engine.submit(ProbeTarget(1, "local", "127.0.0.1", **fields)).result()
+
+    async def _http_server(self):
+        async def handle(reader, writer):
+            self.connections += 1
+            try:
+                while True:
+                    request = await reader.readuntil(b"\r\n\r\n")
+                    status = b"404 Not Found" if b" /missing " in request else b"200 OK"
+                    body = b"" if request.startswith(b"HEAD ") else b"ok"
+                    writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 2\r\n\r\n" + body)
+                    await writer.drain()
+            except asyncio.IncompleteReadError:
+                writer.close()
+        return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+    def test_tcp_check(self):
+        server = self.serve(asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0))
+        port = server.sockets[0].getsockname()[1]
+        self.assertTrue(self.probe(check_type="tcp", port=port)["success"])
+        self.loop.call_soon_threadsafe(server.close)
+        time.sleep(0.1)
+        self.assertFalse(self.probe(check_type="tcp", port=port)["success"])
+
+    def test_http_check_reuses_connections(self):
+        server = self.serve(self._http_server())
+        port = server.sockets[0].getsockname()[1]
+        url = f"http://health.example:{port}/ok"
+        for _ in range(3):
+            result = self.probe(check_type="http", url=url)
+            self.assertTrue(result["success"])
+            self.assertIsNotNone(result["response_time"])
+        self.assertFalse(self.probe(check_type="http", url=f"http://health.example:{port}/missing")["success"])
+        self.assertEqual(self.connections, 1)
+
+    def test_dns_check(self):
+        class Resolver(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                answers = 0 if b"\x07missing" in data else 1
+                flags = 0x8180 if answers else 0x8183  # NOERROR / NXDOMAIN
+                self.transport.sendto(data[:2] + (flags).to_bytes(2, "big") + b"\x00\x01" +
+                                      answers.to_bytes(2, "big") + b"\x00\x00\x00\x00" + data[12:], addr)
+
+        transport, _ = self.serve(self.loop.create_datagram_endpoint(Resolver, local_addr=("127.0.0.1", 0)))
+        port = transport.get_extra_info("sockname")[1]
+        self.assertTrue(self.probe(check_type="dns", port=port, url="example.com")["success"])
+        self.assertFalse(self.probe(check_type="dns", port=port, url="missing.example.com")["success"])
+
+    def test_dns_packets(self):
+        query = build_dns_query(0x1234, "example.com", 1)
+        self.assertEqual(query[12:], b"\x07example\x03com\x00\x00\x01\x00\x01")
+        reply = query[:2] + b"\x81\x80\x00\x01\x00\x02\x00\x00\x00\x00" + query[12:]
+        self.assertEqual(parse_dns_response(reply, 0x1234), (0, 2))
+        self.assertIsNone(parse_dns_response(reply, 0x4321))
+        self.assertIsNone(parse_dns_response(query, 0x1234))  # A query, not a response
+
+class TestIcmpPackets(unittest.TestCase):
+    def test_echo_request_checksum(self):
+        packet = build_echo_request(0x1234, 7)
+        self.assertEqual(packet[0], 8)
+        # A packet including its own checksum sums to zero
+        self.assertEqual(checksum(packet), 0)
+
+    def test_parse_echo_reply(self):
+        reply = bytes([0, 0]) + build_echo_request(0x1234, 7)[2:]
+        self.assertEqual(parse_echo_reply(reply), (0x1234, 7))
+
+        # Raw IPv4 sockets prepend a 20 byte IP header
+        ip_header = bytes([0x45]) + bytes(19)
+        self.assertEqual(parse_echo_reply(ip_header + reply, has_ip_header=True), (0x1234, 7))
+
+        # Our own echo requests are not replies
+        self.assertIsNone(parse_echo_reply(build_echo_request(0x1234, 7)))
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestProbeScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = ProbeScheduler(jitter=0, clock=self.clock)
+
+    def test_due_order_and_exact_deadline(self):
+        self.scheduler.add("a", 60, delay=30)
+        self.scheduler.add("b", 10, delay=5)
+        self.assertEqual(self.scheduler.next_due(), 1005.0)
+        self.assertEqual(self.scheduler.pop_due(1004.9), [])
+        self.assertEqual([e.key for e in self.scheduler.pop_due(1005.0)], ["b"])
+
+        # In-flight entries are not handed out again until rescheduled
+        self.assertEqual(self.scheduler.next_due(), 1030.0)
+        self.assertEqual(self.scheduler.reschedule("b", 1006.0), 1015.0)
+        self.assertEqual(self.scheduler.next_due(), 1015.0)
+
+    def test_missed_slots_are_skipped(self):
+        self.scheduler.add("a", 1, delay=1)
+        self.scheduler.pop_due(1001.0)
+        # The probe took longer than the interval
+        self.assertEqual(self.scheduler.reschedule("a", 1005.0), 1005.0)
+
+    def test_overdue_servers_are_spread(self):
+        for key in range(100):
+            self.scheduler.add(key, 60)
+        due_times = {self.scheduler._entries[key].due for key in range(100)}
+        self.assertGreater(len(due_times), 90)
+        self.assertTrue(all(1000 <= due < 1060 for due in due_times))
+        self.assertEqual(spread_offset(7, 60), spread_offset(7, 60))
+
+    def test_incremental_updates(self):
+        self.scheduler.add("a", 60, delay=60)
+        self.scheduler.update("a", 30, payload="new")
+        self.assertEqual(self.scheduler.next_due(), 1030.0)
+        self.assertEqual(self.scheduler.payload("a"), "new")
+
+        self.scheduler.remove("a")
+        self.assertNotIn("a", self.scheduler)
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_jitter_does_not_drift(self):
+        scheduler = ProbeScheduler(jitter=0.1, clock=self.clock)
+        scheduler.add("a", 10, delay=10)
+        for _ in range(50):
+            scheduler.pop_due(float("inf"))
+            due = scheduler.reschedule("a", 0)
+        self.assertLessEqual(abs(due - 1510.0), 1.0)
+        scheduler.pop_due(float("inf"))
+        self.assertLessEqual(abs(scheduler.reschedule("a", 0) - 1520.0), 1.0)
+
+    def test_delay_overrides_one_interval(self):
+        self.scheduler.add("a", 60, delay=60)
+        self.scheduler.pop_due(1060.0)
+        self.assertEqual(self.scheduler.reschedule("a", 1061.0, delay=1), 1062.0)
+        self.scheduler.pop_due(1062.0)
+        self.assertEqual(self.scheduler.reschedule("a", 1062.5), 1122.0)
+
+    def test_probe_budget(self):
+        scheduler = ProbeScheduler(jitter=0, clock=self.clock, max_rate=10)
+        for key in range(25):
+            scheduler.add(key, 60, delay=1)
+        self.assertEqual(len(scheduler.pop_due(1001.0)), 10)
+        # Out of tokens: the rest waits for the bucket to refill
+        self.assertEqual(scheduler.pop_due(1001.0), [])
+        self.assertAlmostEqual(scheduler.next_due(), 1001.1)
+        self.assertEqual(len(scheduler.pop_due(1001.5)), 5)
+        self.assertEqual(len(scheduler.pop_due(1010.0)), 10)
+        self.assertIsNone(scheduler.next_due())
+
+class TestAdaptiveIntervals(unittest.TestCase):
+    def setUp(self):
+        self.intervals = AdaptiveIntervals(backoff_factor=2, backoff_max=300, confirm_probes=2, confirm_delay=1)
+
+    def feed(self, *results):
+        return [self.intervals.next_delay("a", 60, success) for success in results]
+
+    def test_confirmation_burst_then_backoff(self):
+        self.assertEqual(self.feed(True, True), [None, None])
+        self.assertEqual(self.feed(False, False, False, False, False, False, False), [1, 1, None, 120, 240, 300, 300])
+        # Recovery is confirmed just as quickly, then the regular interval resumes
+        self.assertEqual(self.feed(True, True, True, True), [1, 1, None, None])
+
+    def test_flapping_does_not_keep_bursting(self):
+        self.assertEqual(self.feed(False, True, False, True, False, True), [1, 1, None, None, None, None])
+
+    def test_confirm_probes_other_than_the_default(self):
+        intervals = AdaptiveIntervals(backoff_factor=2, backoff_max=300, confirm_probes=3, confirm_delay=1)
+        self.assertEqual([intervals.next_delay("a", 60, False) for _ in range(6)], [1, 1, 1, None, 120, 240])
+
+    def test_seeded_down_server_is_backed_off_without_a_burst(self):
+        self.intervals.seed("a", False)
+        self.assertEqual(self.feed(False, False), [120, 240])
+        # Its recovery is still confirmed
+        self.assertEqual(self.feed(True, True, True), [1, 1, None])
+
+    def test_disabled(self):
+        intervals = AdaptiveIntervals(backoff_factor=1, confirm_probes=0)
+        self.assertEqual([intervals.next_delay("a", 60, False) for _ in range(5)], [None] * 5)
+
+class TestAlertTracker(unittest.TestCase):
+    def test_alerts_only_on_transitions(self):
+        tracker = AlertTracker(down_threshold=3, up_threshold=1)
+        outcomes = [False, False, False, False, False, True, True, False]
+        alerts = [tracker.observe(1, success) for success in outcomes]
+        self.assertEqual(
+            [alert[0] if alert else None for alert in alerts],
+            [None, None, "downtime", None, None, "recovery", None, None]
+        )
+
+    def test_recovery_hysteresis(self):
+        tracker = AlertTracker(down_threshold=2, up_threshold=3)
+        for success in (False, False, True, True, False, True, True):
+            self.assertNotEqual(tracker.observe(1, success), ("recovery", "Server recovered after downtime."))
+        self.assertEqual(tracker.state(1), DOWN)
+        self.assertEqual(tracker.observe(1, True)[0], "recovery")
+        self.assertEqual(tracker.state(1), UP)
+        # Other servers are independent
+        self.assertEqual(tracker.state(2), UP)
+
+
+class TestHashRing(unittest.TestCase):
+    def test_servers_are_spread_and_move_minimally(self):
+        keys = range(3000)
+        three = HashRing(["a", "b", "c"])
+        owners = {key: three.owner(key) for key in keys}
+        counts = [list(owners.values()).count(member) for member in "abc"]
+        self.assertTrue(all(700 < count < 1300 for count in counts), counts)
+
+        # When "c" leaves, only its servers move
+        two = HashRing(["a", "b"])
+        for key in keys:
+            if owners[key] != "c":
+                self.assertEqual(two.owner(key), owners[key])
+            else:
+                self.assertIn(two.owner(key), ("a", "b"))
+
+        self.assertIsNone(HashRing([]).owner(1))
+
+if __name__ == '__main__':
+    unittest.main()
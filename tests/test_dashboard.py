@@ -0,0 +1,261 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from db.init_db import configure_db, get_engine, session_scope
+from agent.writer import ProbeRecord, write_batch
+from db.models import Server, PingLog, PingResult, AlertLog
+from dashboard.app import app
+from dashboard.events import StatusBroadcaster
+from db.utils import set_setting
+
+class DashboardTestCase(unittest.TestCase):
+    """Runs the Flask app against a throwaway SQLite file."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = configure_db(f"sqlite:///{os.path.join(self.tmpdir.name, 'test.db')}")
+        app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        configure_db("sqlite://")
+        self.tmpdir.cleanup()
+
+    def seed(self, server_count, logs_per_server, first=0):
+        t0 = datetime.utcnow() - timedelta(days=1)
+        with session_scope() as session:
+            for i in range(first, first + server_count):
+                server = Server(name=f"srv{i}", ip_address=f"10.0.{i // 250}.{i % 250 + 1}")
+                session.add(server)
+                session.flush()
+                session.add(PingResult(server_id=server.id, is_successful=i % 2 == 0, latency_ms=12.5, timestamp=t0))
+                session.add_all([
+                    PingLog(server_id=server.id, success=True, response_time=10.0,
+                            timestamp=t0 + timedelta(seconds=j))
+                    for j in range(logs_per_server)
+                ])
+                session.add(AlertLog(server_id=server.id, alert_type="downtime", message="down"))
+
+    def count_queries(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            response = self.client.get(path)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return len(statements), response
+
+class TestHome(DashboardTestCase):
+    def test_home_query_count_is_bounded(self):
+        self.seed(2, 5)
+        self.client.get("/")  # Load the settings cache
+        small, _ = self.count_queries("/")
+
+        self.seed(40, 50, first=2)
+        large, response = self.count_queries("/")
+
+        # Servers, uptime rollups, alerts and agents, regardless of data size;
+        # settings are served from memory
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 4)
+        self.assertIn(b"srv39", response.data)
+        self.assertIn(b"12.5 ms", response.data)
+
+    def test_home_without_results(self):
+        with session_scope() as session:
+            session.add(Server(name="fresh", ip_address="10.0.0.1"))
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"fresh", response.data)
+
+class TestPingHistory(DashboardTestCase):
+    def test_pages_follow_the_cursor_without_gaps(self):
+        self.seed(3, 7)
+        seen = []
+        cursor = None
+        while True:
+            path = "/api/servers/2/pings?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(json.loads(line) for line in response.data.decode().splitlines())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual({row["server_id"] for row in seen}, {2})
+        self.assertEqual(seen, sorted(seen, key=lambda row: (row["timestamp"], row["id"])))
+
+    def test_full_export_streams_in_pages(self):
+        self.seed(4, 5)
+        with unittest.mock.patch("db.history.HISTORY_PAGE_SIZE", 3):
+            response = self.client.get("/api/pings?format=csv")
+            self.assertTrue(response.is_streamed)
+            rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        # 20 rows over 7 keyset pages, none lost or repeated at page boundaries
+        self.assertEqual(len({row["id"] for row in rows}), 20)
+
+    def test_time_range_and_validation(self):
+        self.seed(1, 10)
+        with session_scope() as session:
+            timestamps = sorted(t for (t,) in session.query(PingLog.timestamp))
+        start, end = timestamps[2].isoformat(), timestamps[5].isoformat()
+        response = self.client.get(f"/api/pings?start={start}&end={end}")
+        self.assertEqual(len(response.data.decode().splitlines()), 3)
+
+        self.assertEqual(self.client.get("/api/pings?start=yesterday").status_code, 400)
+        self.assertEqual(self.client.get("/api/pings?format=xml").status_code, 400)
+        self.assertEqual(self.client.get("/api/servers/99/pings").status_code, 404)
+
+class TestStatusEvents(DashboardTestCase):
+    def drain(self, events):
+        items = []
+        while not events.empty():
+            items.append(events.get_nowait())
+        return items
+
+    def test_only_changes_are_pushed_to_every_subscriber(self):
+        self.seed(3, 0)
+        broadcaster = StatusBroadcaster(poll_interval=3600)
+        broadcaster._thread = True  # Poll by hand instead of from the background thread
+        viewers = [broadcaster.subscribe() for _ in range(20)]
+
+        broadcaster.poll()
+        for events in viewers:
+            first = dict(self.drain(events))
+            self.assertEqual(len(first["servers"]), 3)
+            self.assertEqual(first["agent"]["color"], "paused")
+
+        # A result that reaches the database long after its probe ran, e.g. replayed from the agent's spool
+        with get_engine().begin() as conn:
+            write_batch(conn, [ProbeRecord(2, datetime.utcnow() - timedelta(days=2), False, None)])
+        set_setting("agent_status", "running")
+        set_setting("agent_last_seen", datetime.utcnow().isoformat())
+
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        broadcaster.poll()
+        # One results read and one settings read, however many browsers are watching
+        self.assertEqual(len(statements), 2)
+        for events in viewers:
+            pushed = dict(self.drain(events))
+            self.assertEqual([server["id"] for server in pushed["servers"]], [2])
+            self.assertEqual(pushed["agent"]["color"], "running")
+
+        broadcaster.poll()
+        self.assertEqual(self.drain(viewers[0]), [])
+
+    def test_stream_starts_with_current_snapshot(self):
+        self.seed(2, 0)
+        broadcaster = StatusBroadcaster(poll_interval=3600)
+        broadcaster.poll()
+        with unittest.mock.patch("dashboard.app.broadcaster", broadcaster):
+            response = self.client.get("/events")
+            self.assertEqual(response.mimetype, "text/event-stream")
+            chunks = iter(response.response)
+            self.assertTrue(next(chunks).startswith(b"retry:"))
+            self.assertTrue(next(chunks).startswith(b"event: agent"))
+            servers = next(chunks).decode()
+            response.close()
+        self.assertTrue(servers.startswith("event: servers"))
+        self.assertEqual(len(json.loads(servers.split("data: ", 1)[1])), 2)
+        self.assertEqual(broadcaster.subscriber_count(), 0)
+
+class TestServerForms(DashboardTestCase):
+    def test_check_settings_are_validated_and_saved(self):
+        form = dict(name="web", ip_address="10.0.0.1", ping_interval=60, check_type="tcp", is_active="y")
+        response = self.client.post("/add-server", data=form)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"TCP checks need a port", response.data)
+
+        response = self.client.post("/add-server", data=dict(form, port=443))
+        self.assertEqual(response.status_code, 302)
+        with session_scope() as session:
+            server = session.query(Server).one()
+            self.assertEqual((server.check_type, server.port, server.url), ("tcp", 443, None))
+
+    def test_ip_addresses_follow_the_bulk_import_rules(self):
+        form = dict(name="v6", ip_address="2001:DB8::1", ping_interval=60, check_type="icmp", is_active="y")
+        self.assertEqual(self.client.post("/add-server", data=form).status_code, 302)
+        response = self.client.post("/add-server", data=dict(form, name="bad", ip_address="not-an-ip"))
+        self.assertIn(b"Invalid IP address", response.data)
+        with session_scope() as session:
+            self.assertEqual([s.ip_address for s in session.query(Server)], ["2001:db8::1"])
+
+class TestLatencyApi(DashboardTestCase):
+    def test_percentiles_for_one_and_several_servers(self):
+        self.seed(2, 0)
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        with get_engine().begin() as conn:
+            write_batch(conn, [
+                ProbeRecord(1 + i % 2, now - timedelta(minutes=i), True, float(10 + i % 2 * 90))
+                for i in range(1, 101)
+            ])
+
+        response = self.client.get("/api/servers/2/latency")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["count"], 50)
+        self.assertAlmostEqual(response.json["p50"], 100, delta=2)
+
+        response = self.client.get("/api/latency?server_id=1&server_id=2&per_server=1")
+        self.assertEqual(response.json["count"], 100)
+        self.assertAlmostEqual(response.json["p99"], 100, delta=2)
+        self.assertAlmostEqual(response.json["servers"]["1"]["p95"], 10, delta=0.2)
+
+        self.assertEqual(self.client.get("/api/latency?server_id=x").status_code, 400)
+        self.assertEqual(self.client.get("/api/latency?start=2024-01-02&end=2024-01-01").status_code, 400)
+
+class TestBulkApi(DashboardTestCase):
+    def test_import_update_deactivate_and_export(self):
+        body = "name,ip_address,ping_interval\nweb-1,10.0.0.1,30\nweb-2,bad,30\nweb-3,10.0.0.3,\n"
+        response = self.client.post("/api/servers/bulk", data=body, content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json["inserted"], response.json["error_count"]), (2, 1))
+        self.assertEqual(response.json["errors"][0]["row"], 2)
+
+        response = self.client.patch("/api/servers/bulk", json=[{"name": "web-3", "ping_interval": 120}])
+        self.assertEqual(response.json["updated"], 1)
+        response = self.client.post("/api/servers/bulk/deactivate", json={"names": ["web-1"]})
+        self.assertEqual(response.json["deactivated"], 1)
+
+        response = self.client.get("/api/servers/export?format=ndjson")
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([(r["name"], r["ping_interval"], r["is_active"]) for r in rows],
+                         [("web-1", 30, False), ("web-3", 120, True)])
+
+        # The CSV export is accepted back as an import
+        exported = self.client.get("/api/servers/export").get_data(as_text=True)
+        response = self.client.post("/api/servers/bulk", data=exported, content_type="text/csv")
+        self.assertEqual((response.json["unchanged"], response.json["error_count"]), (2, 0))
+
+        self.assertEqual(self.client.post("/api/servers/bulk", data="[{", content_type="application/json").status_code, 400)
+
+class TestMetricsEndpoint(DashboardTestCase):
+    def test_request_latency_is_recorded_per_route(self):
+        self.seed(1, 0)
+        self.client.get("/api/servers/1/pings?limit=5")
+        self.client.get("/no-such-page")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{route="/api/servers/<int:server_id>/pings",method="GET",status="200"}',
+            text
+        )
+        self.assertIn('route="unmatched",method="GET",status="404"', text)
+
+if __name__ == '__main__':
+    unittest.main()
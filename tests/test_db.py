@@ -0,0 +1,1032 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from unittest import mock
+import db.init_db
+import db.partitions
+from agent.adaptive import AdaptiveIntervals
+from agent.alerts import DOWN, UP, AlertTracker
+from agent.runner import AgentRunner
+from agent.spool import Spool, SpoolWriter
+from agent.writer import AlertRecord, ProbeRecord, ResultWriter, write_batch
+from db.init_db import configure_db, get_engine, get_writer_engine, init_db, session_scope
+from db.models import Server, PingLog, PingResult, PingRollup, AlertLog, AppSetting, AgentHeartbeat
+from db.migrations import MIGRATIONS, applied_versions, apply_migrations
+from db.history import iter_ping_logs, ping_log_page
+from db.partitions import ID_SHIFT, attach_partitions, list_partitions, month_of, partition_dir
+from db.retention import enforce_retention
+from db.rollups import rebuild_rollups, rollup_series, uptime_by_server
+from db.archive import ArchiveFile, archive_dir, archive_ping_logs, iter_archived
+from db.bulk import BulkError, deactivate_servers, import_servers, iter_json_rows, iter_rows, update_servers
+from db.latency import cover_range, latency_percentiles
+from db.sketch import LatencySketch
+from db.summary import recent_alerts
+from db.utils import SettingsCache, get_setting, set_setting
+
+class DatabaseTestCase(unittest.TestCase):
+    """Points the shared engine at a throwaway SQLite file for each test."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "test.db")
+        self.engine = configure_db(f"sqlite:///{self.db_path}")
+
+    def tearDown(self):
+        configure_db("sqlite://")
+        self.tmpdir.cleanup()
+
+class TestSharedEngine(DatabaseTestCase):
+    def test_engine_is_created_and_bootstrapped_once(self):
+        with mock.patch.object(db.init_db, "bootstrap_db", wraps=db.init_db.bootstrap_db) as bootstrap:
+            engine = configure_db(f"sqlite:///{self.db_path}")
+            for _ in range(5):
+                session = init_db()
+                self.assertIs(session.get_bind(), engine)
+                session.close()
+            set_setting("agent_status", "running")
+            self.assertEqual(get_setting("agent_status"), "running")
+        self.assertIs(get_engine(), engine)
+        self.assertEqual(bootstrap.call_count, 1)
+
+    def test_session_scope_commits_and_rolls_back(self):
+        with session_scope() as session:
+            session.add(Server(name="Kept", ip_address="10.0.0.1"))
+
+        with self.assertRaises(RuntimeError):
+            with session_scope() as session:
+                session.add(Server(name="Dropped", ip_address="10.0.0.2"))
+                session.flush()
+                raise RuntimeError("boom")
+
+        with session_scope() as session:
+            self.assertEqual([s.name for s in session.query(Server).all()], ["Kept"])
+
+    def test_sessions_return_connections_to_the_pool(self):
+        for _ in range(50):
+            with session_scope() as session:
+                session.query(Server).count()
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+
+class TestSqliteProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(db.init_db, "SQLITE_TUNING", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = configure_db(f"sqlite:///{os.path.join(self.tmpdir.name, 'tuned.db')}")
+
+    def tearDown(self):
+        configure_db("sqlite://")
+        self.tmpdir.cleanup()
+
+    def pragma(self, conn, name):
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_new_connections_get_the_profile(self):
+        for engine in (self.engine, get_writer_engine()):
+            with engine.connect() as conn:
+                self.assertEqual(self.pragma(conn, "journal_mode"), "wal")
+                self.assertEqual(self.pragma(conn, "busy_timeout"), db.init_db.SQLITE_BUSY_TIMEOUT_MS)
+                # NORMAL
+                self.assertEqual(self.pragma(conn, "synchronous"), 1)
+                self.assertEqual(self.pragma(conn, "cache_size"), -db.init_db.SQLITE_CACHE_SIZE_KB)
+
+    def test_writer_engine_has_one_connection_and_begins_immediate(self):
+        writer = get_writer_engine()
+        self.assertIsNot(writer, self.engine)
+        self.assertEqual((writer.pool.size(), writer.pool._max_overflow), (1, 0))
+
+        statements = []
+        event.listen(writer, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        with writer.begin() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(statements, ["BEGIN IMMEDIATE", "SELECT 1"])
+        # The write lock is held from BEGIN: a reader's write attempt cannot start meanwhile
+        with writer.begin():
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA busy_timeout=0")
+                with self.assertRaises(OperationalError):
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                conn.exec_driver_sql(f"PRAGMA busy_timeout={db.init_db.SQLITE_BUSY_TIMEOUT_MS}")
+
+class TestSchemaUpgrade(unittest.TestCase):
+    def test_missing_columns_are_added_and_check_type_recorded(self):
+        import sqlite3
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "old.db")
+            # The servers and ping tables as they were before check types existed
+            with sqlite3.connect(path) as conn:
+                conn.executescript("""
+                    CREATE TABLE servers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE,
+                        ip_address VARCHAR NOT NULL, location VARCHAR, ping_interval INTEGER,
+                        last_ping_time DATETIME, is_active BOOLEAN, created_at DATETIME);
+                    CREATE TABLE ping_logs (id INTEGER PRIMARY KEY, server_id INTEGER NOT NULL,
+                        timestamp DATETIME, response_time FLOAT, success BOOLEAN);
+                    INSERT INTO servers (name, ip_address, is_active) VALUES ('old', '10.0.0.1', 1);
+                """)
+            try:
+                configure_db(f"sqlite:///{path}")
+                with session_scope() as session:
+                    server = session.query(Server).one()
+                    self.assertEqual(server.check_type, "icmp")
+                    session.add(Server(name="web", ip_address="10.0.0.2", check_type="http", url="http://web/"))
+                with get_engine().begin() as conn:
+                    write_batch(conn, [ProbeRecord(2, datetime(2024, 1, 1), True, 3.0, "http")])
+                with session_scope() as session:
+                    self.assertEqual(session.query(PingLog.check_type).scalar(), "http")
+                    self.assertEqual(session.query(PingResult.check_type).scalar(), "http")
+            finally:
+                configure_db("sqlite://")
+
+class TestSchemaMigrations(DatabaseTestCase):
+    def index_names(self):
+        with get_engine().connect() as conn:
+            return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL")).scalars())
+
+    def test_legacy_indexes_are_replaced(self):
+        with get_engine().begin() as conn:
+            # The index set of a database created before versioned migrations
+            conn.execute(text("DELETE FROM schema_version"))
+            conn.execute(text("DROP INDEX ix_alert_logs_server_id_alert_type_id"))
+            for name, table, column in (("ix_ping_logs_server_id", "ping_logs", "server_id"),
+                                        ("ix_ping_logs_success", "ping_logs", "success"),
+                                        ("ix_alert_logs_alert_type", "alert_logs", "alert_type"),
+                                        ("ix_servers_id", "servers", "id")):
+                conn.execute(text(f"CREATE INDEX {name} ON {table} ({column})"))
+
+        self.assertEqual(apply_migrations(get_engine()), [version for version, _, _ in MIGRATIONS])
+        indexes = self.index_names()
+        self.assertIn("ix_alert_logs_server_id_alert_type_id", indexes)
+        self.assertFalse(indexes & {"ix_ping_logs_server_id", "ix_ping_logs_success", "ix_alert_logs_alert_type", "ix_servers_id"})
+        self.assertEqual(apply_migrations(get_engine()), [])
+
+    def test_new_database_matches_migrated_one(self):
+        created = self.index_names()
+        self.assertEqual(applied_versions(get_engine()), {version for version, _, _ in MIGRATIONS})
+        with get_engine().begin() as conn:
+            conn.execute(text("DELETE FROM schema_version"))
+        apply_migrations(get_engine())
+        self.assertEqual(self.index_names(), created)
+
+    def test_migrate_tool_stops_at_the_target(self):
+        path = os.path.join(self.tmpdir.name, "fresh.db")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db", "migrate.py")
+
+        def run(*args):
+            return subprocess.run([sys.executable, script, *args], env=env, capture_output=True, text=True, check=True).stdout
+
+        self.assertIn("applied 1", run("migrate", "--target", "1"))
+        engine = create_engine(f"sqlite:///{path}")
+        self.assertEqual(applied_versions(engine), {1})
+        engine.dispose()
+        lines = [line.strip() for line in run("status").splitlines()]
+        self.assertIn("✓ 1: ping history keyset indexes", lines)
+        self.assertIn("2: alert state index", lines)
+        self.assertIn("3: drop redundant indexes", lines)
+
+        self.assertIn("applied 3", run("migrate"))
+        self.assertNotIn("2: alert state index", [line.strip() for line in run("status").splitlines()])
+
+class TestQueryPlans(DatabaseTestCase):
+    """EXPLAIN QUERY PLAN of the statements the hot paths actually send."""
+
+    def capture(self, func):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(("SELECT", "DELETE")):
+                statements.append((statement, parameters))
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            func()
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        plans = []
+        with self.engine.connect() as conn:
+            raw = conn.connection.dbapi_connection
+            for statement, parameters in statements:
+                if "sqlite_master" not in statement and "app_settings" not in statement:
+                    plans.append(" / ".join(row[3] for row in raw.execute("EXPLAIN QUERY PLAN " + statement, parameters)))
+        return plans
+
+    def assertIndexed(self, plans, *indexes):
+        self.assertTrue(plans)
+        for plan in plans:
+            for step in plan.split(" / "):
+                # A full scan is only acceptable in index order, or through a covering index
+                if step.startswith("SCAN"):
+                    self.assertIn("INDEX", step, plan)
+        joined = " / ".join(plans)
+        for index in indexes:
+            self.assertIn(index, joined)
+
+    def test_history_pages(self):
+        now = datetime(2024, 3, 1)
+
+        def pages():
+            with self.engine.connect() as conn:
+                ping_log_page(conn, server_id=1, start=now, after=(now, 5), limit=10)
+                ping_log_page(conn, start=now, end=now + timedelta(hours=1), limit=10)
+
+        self.assertIndexed(self.capture(pages), "ix_ping_logs_server_id_timestamp_id", "ix_ping_logs_timestamp_id")
+
+    def test_alert_state_load(self):
+        def load():
+            with session_scope() as session:
+                AlertTracker().load(session, [1, 2])
+
+        self.assertIndexed(
+            self.capture(load),
+            "COVERING INDEX ix_alert_logs_server_id_alert_type_id", "ix_ping_logs_server_id_timestamp_id"
+        )
+
+    def test_dashboard_and_rollup_reads(self):
+        now = datetime(2024, 3, 1)
+
+        def reads():
+            with session_scope() as session:
+                recent_alerts(session)
+                rollup_series(session, 1, now, now + timedelta(hours=2))
+                uptime_by_server(session, now)
+            with self.engine.connect() as conn:
+                latency_percentiles(conn, now, now + timedelta(hours=3), finest="1m")
+
+        self.assertIndexed(self.capture(reads), "ix_alert_logs_timestamp", "ix_ping_rollups_resolution_bucket_start")
+
+    def test_retention_batches(self):
+        set_setting("retention_ping_logs_days", "30")
+        set_setting("retention_alert_logs_days", "90")
+        self.assertIndexed(
+            self.capture(lambda: enforce_retention(now=datetime(2024, 3, 1), pause=0, engine=self.engine)),
+            "ix_ping_logs_timestamp_id", "ix_alert_logs_timestamp"
+        )
+
+class TestSettingsCache(DatabaseTestCase):
+    def count_queries(self, func):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(self.engine, "before_cursor_execute", listener)
+        try:
+            result = func()
+        finally:
+            event.remove(self.engine, "before_cursor_execute", listener)
+        return len(statements), result
+
+    def test_reads_are_served_from_memory_until_a_write(self):
+        set_setting("agent_status", "running")
+        get_setting("agent_status")
+        queries, value = self.count_queries(lambda: [get_setting("agent_status") for _ in range(100)][-1])
+        self.assertEqual((queries, value), (0, "running"))
+
+        set_setting("agent_status", "paused")
+        self.assertEqual(get_setting("agent_status"), "paused")
+        self.assertEqual(get_setting("missing", "default"), "default")
+
+    def test_writes_from_another_process_invalidate_through_the_marker(self):
+        now = [0.0]
+        cache = SettingsCache(ttl=60, clock=lambda: now[0])
+        set_setting("servers_version", "a")
+        self.assertEqual(cache.get("servers_version"), "a")
+
+        # Another process writes the row and touches the marker file
+        with session_scope() as session:
+            session.get(AppSetting, "servers_version").value = "b"
+        self.assertEqual(cache.get("servers_version"), "a")
+        SettingsCache().invalidate()
+        self.assertEqual(cache.get("servers_version"), "b")
+
+        # Without a marker touch, the TTL still bounds staleness
+        with session_scope() as session:
+            session.get(AppSetting, "servers_version").value = "c"
+        self.assertEqual(cache.get("servers_version"), "b")
+        now[0] = 61
+        self.assertEqual(cache.get("servers_version"), "c")
+
+class TestResultWriter(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in range(1, 4)])
+        self.t0 = datetime(2024, 1, 1, 12, 0, 0)
+
+    def test_write_batch(self):
+        records = [
+            ProbeRecord(1, self.t0, True, 10.0),
+            ProbeRecord(2, self.t0, False, None),
+            ProbeRecord(1, self.t0 + timedelta(seconds=30), False, None),
+        ]
+        with self.engine.begin() as conn:
+            write_batch(conn, records)
+        with self.engine.begin() as conn:
+            write_batch(conn, [ProbeRecord(2, self.t0 + timedelta(seconds=60), True, 5.5)])
+
+        with session_scope() as session:
+            self.assertEqual(session.query(PingLog).count(), 4)
+            results = {r.server_id: r for r in session.query(PingResult).all()}
+            self.assertEqual(len(results), 2)
+            self.assertFalse(results[1].is_successful)
+            self.assertEqual(results[1].timestamp, self.t0 + timedelta(seconds=30))
+            self.assertTrue(results[2].is_successful)
+            self.assertEqual(results[2].latency_ms, 5.5)
+            self.assertEqual(session.get(Server, 2).last_ping_time, self.t0 + timedelta(seconds=60))
+            self.assertIsNone(session.get(Server, 3).last_ping_time)
+
+    def test_flushes_on_size_and_on_stop(self):
+        writer = ResultWriter(batch_size=10, flush_interval=60).start()
+        for i in range(25):
+            writer.submit(ProbeRecord(1 + i % 3, self.t0 + timedelta(seconds=i), True, 1.0))
+        writer.stop()
+        self.assertEqual(writer.written, 25)
+        with session_scope() as session:
+            self.assertEqual(session.query(PingLog).count(), 25)
+
+    def test_flushes_on_interval(self):
+        writer = ResultWriter(batch_size=1000, flush_interval=0.05).start()
+        try:
+            writer.submit(ProbeRecord(1, self.t0, True, 1.0))
+            for _ in range(100):
+                if writer.written:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(writer.written, 1)
+        finally:
+            writer.stop()
+
+class TestSpoolWriter(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in range(1, 4)])
+        self.t0 = datetime(2024, 1, 1, 12, 0, 0)
+        self.spool_dir = os.path.join(self.tmpdir.name, "spool")
+        # A database that cannot be reached at all
+        self.unreachable = create_engine(f"sqlite:///{os.path.join(self.tmpdir.name, 'missing', 'x.db')}")
+
+    def writer(self, engine=None, **kwargs):
+        return SpoolWriter(self.spool_dir, batch_size=10, flush_interval=0.05, fsync_interval=0.01,
+                           engine=engine or self.engine, **kwargs)
+
+    def log_count(self):
+        with session_scope() as session:
+            return session.query(PingLog).count()
+
+    def test_replays_records_and_alerts(self):
+        writer = self.writer().start()
+        try:
+            for i in range(25):
+                writer.submit(ProbeRecord(1 + i % 3, self.t0 + timedelta(seconds=i), i % 2 == 0, 1.5, "tcp"))
+            writer.submit(AlertRecord(2, self.t0, "downtime", "Server srv2 is down"))
+            self.assertTrue(writer.flush(5))
+            self.assertEqual(writer.pending(), 0)
+        finally:
+            writer.stop()
+        self.assertEqual(writer.written, 26)
+        with session_scope() as session:
+            logs = session.query(PingLog).order_by(PingLog.timestamp).all()
+            self.assertEqual(len(logs), 25)
+            self.assertEqual((logs[0].response_time, logs[0].check_type, logs[1].success), (1.5, "tcp", False))
+            self.assertEqual(session.query(AlertLog).one().message, "Server srv2 is down")
+
+    def test_outage_keeps_records_for_the_next_run_without_duplicates(self):
+        writer = self.writer().start()
+        for i in range(5):
+            writer.submit(ProbeRecord(1, self.t0 + timedelta(seconds=i), True, 1.0))
+        self.assertTrue(writer.flush(5))
+        writer.stop()
+
+        # The database goes away: submit() still returns at once and nothing is lost
+        writer = self.writer(self.unreachable).start()
+        for i in range(5, 20):
+            writer.submit(ProbeRecord(1, self.t0 + timedelta(seconds=i), True, 1.0))
+        self.assertFalse(writer.flush(0.2))
+        writer.stop()
+        self.assertEqual((writer.written, writer.pending()), (0, 15))
+
+        writer = self.writer().start()
+        try:
+            self.assertTrue(writer.flush(5))
+        finally:
+            writer.stop()
+        self.assertEqual(writer.written, 15)
+        self.assertEqual(self.log_count(), 20)
+        # Replayed segments are gone; only the (empty) segment of the last run is left
+        self.assertEqual(len([name for name in os.listdir(self.spool_dir) if name.endswith(".spool")]), 1)
+
+    def test_runner_keeps_probing_into_the_spool_while_the_database_fails(self):
+        class ProbeEngine:
+            def submit(self, target):
+                future = Future()
+                future.set_result({"success": True, "response_time": 2.0})
+                return future
+
+        def locked(*args):
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+
+        now = [0.0]
+        runner = AgentRunner(engine=ProbeEngine(), writer=self.writer(), agent_id="agent-a", clock=lambda: now[0])
+        runner.housekeeping(0)
+        self.assertEqual(len(runner.scheduler), 3)
+        runner.writer.start()
+        try:
+            event.listen(Engine, "before_cursor_execute", locked)
+            try:
+                for now[0] in (60.0, 120.0):
+                    runner.step()
+                self.assertEqual((len(runner.scheduler), runner.paused), (3, False))
+                self.assertEqual((runner.writer.pending(), runner.writer.written), (6, 0))
+            finally:
+                event.remove(Engine, "before_cursor_execute", locked)
+            self.assertTrue(runner.writer.flush(5))
+        finally:
+            runner.writer.stop()
+        self.assertEqual(self.log_count(), 6)
+
+    def test_rotation_leaves_the_fsync_to_sync(self):
+        spool = Spool(self.spool_dir, segment_bytes=200)
+        try:
+            with mock.patch("agent.spool.os.fsync") as fsync:
+                for i in range(10):
+                    spool.append(ProbeRecord(1, self.t0 + timedelta(seconds=i), True, 1.0))
+                self.assertGreater(len(spool._sealed), 1)
+                fsync.assert_not_called()
+                # Nothing past the last fsync is handed to replay
+                self.assertEqual(spool.read(spool.first_position(), 100)[0], [])
+
+                spool.sync()
+                self.assertEqual(fsync.call_count, len(os.listdir(self.spool_dir)) - 2)  # Without lock and spool.id
+            self.assertEqual(spool._sealed, [])
+            self.assertEqual(len(spool.read(spool.first_position(), 100)[0]), 10)
+        finally:
+            spool.close()
+
+    def test_torn_tail_and_size_limit(self):
+        spool = Spool(self.spool_dir, segment_bytes=200)
+        with self.assertRaises(RuntimeError):
+            Spool(self.spool_dir)
+        for i in range(10):
+            spool.append(ProbeRecord(1, self.t0 + timedelta(seconds=i), True, 1.0))
+        spool.sync()
+        segments = sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".spool"))
+        self.assertGreater(len(segments), 2)
+        # A crash in the middle of an append leaves a torn frame at the end of a segment
+        with open(os.path.join(self.spool_dir, segments[0]), "ab") as f:
+            f.write(b"\x40\x00\x00\x00torn")
+        records, position = spool.read(spool.first_position(), 100)
+        self.assertEqual([r.timestamp.second for r in records], list(range(10)))
+        self.assertEqual(position, spool.end_position())
+
+        spool.max_bytes = 250
+        position, dropped = spool.enforce_limit(spool.first_position())
+        self.assertGreater(dropped, 0)
+        self.assertLessEqual(spool.size(), 250)
+        records, _ = spool.read(position, 100)
+        self.assertEqual(len(records) + dropped, 10)
+        spool.close()
+
+class TestRollups(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in range(1, 3)])
+        self.t0 = datetime(2024, 1, 1, 12, 0, 0)
+
+    def records(self, server_id, count, start, step=timedelta(seconds=15)):
+        return [
+            ProbeRecord(server_id, start + i * step, i % 4 != 0, None if i % 4 == 0 else float(i))
+            for i in range(count)
+        ]
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        records = self.records(1, 600, self.t0) + self.records(2, 100, self.t0)
+        # Written in several flushes, as the agent does
+        for i in range(0, len(records), 97):
+            with self.engine.begin() as conn:
+                write_batch(conn, records[i:i + 97])
+
+        with session_scope() as session:
+            incremental = {
+                (r.server_id, r.resolution, r.bucket_start): (r.success_count, r.failure_count, r.latency_p95)
+                for r in session.query(PingRollup).all()
+            }
+            hourly = rollup_series(session, 1, self.t0, self.t0 + timedelta(hours=3), "1h")
+            self.assertEqual([r.bucket_start.hour for r in hourly], [12, 13, 14])
+            self.assertEqual(sum(r.success_count + r.failure_count for r in hourly), 600)
+            daily = rollup_series(session, 1, self.t0, self.t0 + timedelta(days=30))
+            self.assertEqual(len(daily), 1)
+            self.assertEqual(daily[0].failure_count, 150)
+            self.assertEqual(daily[0].latency_min, 1.0)
+            self.assertEqual(daily[0].latency_max, 599.0)
+
+        with self.engine.begin() as conn:
+            self.assertEqual(rebuild_rollups(conn, self.t0, self.t0 + timedelta(hours=1)), 700)
+        with session_scope() as session:
+            rebuilt = {
+                (r.server_id, r.resolution, r.bucket_start): (r.success_count, r.failure_count, r.latency_p95)
+                for r in session.query(PingRollup).all()
+            }
+        self.assertEqual(incremental, rebuilt)
+
+    def test_uptime_by_server(self):
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            write_batch(conn, self.records(1, 8, now - timedelta(hours=2)))
+            write_batch(conn, self.records(2, 4, now - timedelta(days=3)))
+        with session_scope() as session:
+            self.assertEqual(uptime_by_server(session, now - timedelta(hours=24)), {1: 75.0})
+
+class TestAlertState(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in range(1, 3)])
+        self.t0 = datetime(2024, 1, 1, 12, 0, 0)
+
+    def test_alerts_are_written_and_state_survives_restart(self):
+        tracker = AlertTracker(down_threshold=2, up_threshold=2)
+        records = []
+        for i, success in enumerate([True, False, False, False, True]):
+            timestamp = self.t0 + timedelta(seconds=i)
+            records.append(ProbeRecord(1, timestamp, success, None))
+            alert = tracker.observe(1, success)
+            if alert:
+                records.append(AlertRecord(1, timestamp, *alert))
+        tracker.observe(2, False)
+        with self.engine.begin() as conn:
+            write_batch(conn, records + [ProbeRecord(2, self.t0, False, None)])
+
+        with session_scope() as session:
+            self.assertEqual([a.alert_type for a in session.query(AlertLog)], ["downtime"])
+            restored = AlertTracker(down_threshold=2, up_threshold=2)
+            restored.load(session, [1, 2])
+
+        # Server 1 is still down with one success towards recovery; server 2
+        # carries its failure streak over
+        self.assertEqual(restored.state(1), DOWN)
+        self.assertEqual(restored.observe(1, True)[0], "recovery")
+        self.assertEqual(restored.state(2), UP)
+        self.assertEqual(restored.observe(2, False)[0], "downtime")
+
+    def test_runner_backs_off_servers_that_were_already_down(self):
+        with self.engine.begin() as conn:
+            write_batch(conn, [ProbeRecord(1, self.t0 + timedelta(seconds=i), False, None) for i in range(3)] +
+                        [AlertRecord(1, self.t0, "downtime", "Server failed 3 consecutive pings.")])
+        intervals = AdaptiveIntervals(backoff_factor=2, backoff_max=300, confirm_probes=2, confirm_delay=1)
+        runner = AgentRunner(engine=object(), agent_id="agent-a", clock=lambda: 0, intervals=intervals)
+        runner.housekeeping(0)
+        # No confirmation burst for the server that was down before the restart
+        self.assertEqual(intervals.next_delay(1, 60, False), 120)
+        self.assertEqual(intervals.next_delay(2, 60, False), 1)
+
+class TestSharding(DatabaseTestCase):
+    def runner(self, agent_id):
+        return AgentRunner(engine=object(), agent_id=agent_id, clock=lambda: 0)
+
+    def test_agents_split_servers_and_rebalance(self):
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in range(1, 41)])
+        first, second = self.runner("agent-a"), self.runner("agent-b")
+        first.housekeeping(0)
+        self.assertEqual(len(first.scheduler), 40)
+
+        second.housekeeping(0)
+        first.housekeeping(1)  # Sees the new member and hands over its share
+        shards = set(first.scheduler.keys()), set(second.scheduler.keys())
+        self.assertFalse(shards[0] & shards[1])
+        self.assertEqual(len(shards[0] | shards[1]), 40)
+        self.assertTrue(shards[0] and shards[1])
+
+        # Each heartbeat reports the load as of the previous round
+        first.housekeeping(2)
+        second.housekeeping(2)
+        with session_scope() as session:
+            loads = {a.agent_id: a.assigned_servers for a in session.query(AgentHeartbeat)}
+        self.assertEqual(loads, {"agent-a": len(shards[0]), "agent-b": len(shards[1])})
+
+        # A stopped agent leaves the ring and its servers move back
+        second.close()
+        first.housekeeping(3)
+        self.assertEqual(len(first.scheduler), 40)
+
+    def test_agent_writes_go_through_the_writer_engine(self):
+        writes = {"reader": [], "writer": []}
+
+        def recorder(kind):
+            def record(conn, cursor, statement, parameters, context, executemany):
+                if statement.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE")):
+                    writes[kind].append(statement.split()[0].upper())
+            return record
+
+        listeners = [(get_engine(), recorder("reader")), (get_writer_engine(), recorder("writer"))]
+        for engine, record in listeners:
+            event.listen(engine, "before_cursor_execute", record)
+        try:
+            runner = self.runner("agent-a")
+            runner.housekeeping(0)
+            runner.housekeeping(1)
+            runner.close()
+        finally:
+            for engine, record in listeners:
+                event.remove(engine, "before_cursor_execute", record)
+        self.assertEqual(writes["reader"], [])
+        self.assertEqual(set(writes["writer"]), {"INSERT", "UPDATE", "DELETE"})
+
+class TestRetention(DatabaseTestCase):
+    def test_expired_rows_are_deleted_and_downsampled(self):
+        now = datetime(2024, 3, 1, 12, 0, 0)
+        with session_scope() as session:
+            session.add(Server(name="srv", ip_address="10.0.0.1"))
+            session.flush()
+            # Raw logs from before rollups existed: 10 days old and 1 day old
+            session.add_all(
+                [PingLog(server_id=1, success=True, response_time=5.0, timestamp=now - timedelta(days=10, minutes=i))
+                 for i in range(25)] +
+                [PingLog(server_id=1, success=False, timestamp=now - timedelta(days=1, minutes=i))
+                 for i in range(5)]
+            )
+            session.add_all([
+                AlertLog(server_id=1, alert_type="downtime", timestamp=now - timedelta(days=100)),
+                AlertLog(server_id=1, alert_type="recovery", timestamp=now - timedelta(days=2)),
+            ])
+        # Nothing is deleted until a retention window is set
+        self.assertEqual(set(enforce_retention(now=now, pause=0)), {"bytes_reclaimed", "seconds"})
+        set_setting("retention_ping_logs_days", "7")
+        set_setting("retention_alert_logs_days", "90")
+        set_setting("retention_rollups_1m_days", "7")
+
+        report = enforce_retention(now=now, batch_size=10, pause=0)
+
+        self.assertEqual(report["ping_logs"], 25)
+        self.assertEqual(report["alert_logs"], 1)
+        self.assertIsNotNone(report["bytes_reclaimed"])
+        with session_scope() as session:
+            self.assertEqual(session.query(PingLog).count(), 5)
+            self.assertEqual(session.query(AlertLog).count(), 1)
+            # The deleted day survives as hourly and daily aggregates; its
+            # minute buckets are already past their own retention
+            old_day = session.query(PingRollup).filter(
+                PingRollup.resolution == "1d",
+                PingRollup.bucket_start == datetime(2024, 2, 20)
+            ).one()
+            self.assertEqual(old_day.success_count, 25)
+            self.assertEqual(
+                session.query(PingRollup).filter(
+                    PingRollup.resolution == "1m", PingRollup.bucket_start < now - timedelta(days=7)
+                ).count(),
+                0
+            )
+
+        # Nothing left to do on the next run
+        self.assertEqual(enforce_retention(now=now, pause=0)["ping_logs"], 0)
+
+    def test_rollup_rebuild_keeps_days_without_raw_logs(self):
+        now = datetime(2024, 3, 1, 12, 0, 0)
+        with session_scope() as session:
+            session.add(Server(name="srv", ip_address="10.0.0.1"))
+            session.flush()
+            session.add_all([PingLog(server_id=1, success=True, response_time=5.0, timestamp=now - timedelta(days=d))
+                             for d in (1, 40, 60)])
+        set_setting("retention_ping_logs_days", "30")
+        enforce_retention(now=now, pause=0)
+
+        # A 90 day rebuild only starts at the oldest raw log left
+        with get_writer_engine().begin() as conn:
+            self.assertEqual(rebuild_rollups(conn, now - timedelta(days=90), now), 1)
+        with session_scope() as session:
+            days = session.query(PingRollup.bucket_start).filter(PingRollup.resolution == "1d").order_by(PingRollup.bucket_start)
+            self.assertEqual([row.bucket_start.date() for row in days],
+                             [(now - timedelta(days=d)).date() for d in (60, 40, 1)])
+
+class TestArchive(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = datetime(2024, 3, 20, 12, 0, 0)
+        with session_scope() as session:
+            session.add_all([Server(name="a", ip_address="10.0.0.1"), Server(name="b", ip_address="10.0.0.2")])
+            session.flush()
+            for day in (12, 13, 19):
+                for minute in range(0, 60, 10):
+                    for server_id in (1, 2):
+                        session.add(PingLog(
+                            server_id=server_id,
+                            timestamp=datetime(2024, 3, day, 8, minute, server_id, 123456),
+                            success=minute != 30,
+                            response_time=None if minute == 30 else 10.25 + minute
+                        ))
+
+    def history(self, **kwargs):
+        return [tuple(row) for row in iter_ping_logs(get_engine(), page_size=5, **kwargs)]
+
+    def test_closed_days_move_to_files_and_read_back(self):
+        before = self.history()
+        report = archive_ping_logs(datetime(2024, 3, 14, 6), engine=get_engine())
+
+        self.assertEqual(report, {"rows": 24, "files": 4, "days": 2})
+        with session_scope() as session:
+            self.assertEqual(session.query(PingLog).count(), 12)
+        path = os.path.join(archive_dir(), "2024-03-12", "1.plog")
+        with ArchiveFile(path) as archive:
+            self.assertEqual(len(archive), 6)
+            self.assertIsInstance(archive.offsets, memoryview)
+            self.assertEqual(archive.row(3).success, False)
+            self.assertIsNone(archive.row(3).response_time)
+            self.assertEqual(archive.row(4).response_time, 50.25)
+
+        # Archived timestamps keep millisecond precision; otherwise the history is unchanged
+        after = self.history()
+        self.assertEqual(len(after), len(before))
+        for old, new in zip(before, after):
+            self.assertEqual(old[:2] + old[3:], new[:2] + new[3:])
+            archived = old[2] < datetime(2024, 3, 14)
+            self.assertEqual(old[2].replace(microsecond=old[2].microsecond // 1000 * 1000) if archived else old[2], new[2])
+
+        server_rows = self.history(server_id=2, start=datetime(2024, 3, 13, 8, 20), end=datetime(2024, 3, 19, 8, 20))
+        self.assertEqual([row[2].day for row in server_rows], [13] * 4 + [19] * 2)
+
+        # A page ending in the archive continues into the live rows
+        with get_engine().connect() as conn:
+            page = ping_log_page(conn, after=(after[22][2], after[22][0]), limit=3)
+        self.assertEqual([tuple(row) for row in page], after[23:26])
+
+    def test_rerun_and_reports(self):
+        archive_ping_logs(datetime(2024, 3, 14, 6), engine=get_engine())
+        # A late row for an archived day is merged into the existing file
+        with session_scope() as session:
+            session.add(PingLog(server_id=1, timestamp=datetime(2024, 3, 12, 23, 0), success=True, response_time=1.0))
+        self.assertEqual(archive_ping_logs(datetime(2024, 3, 14, 6), engine=get_engine())["rows"], 1)
+        self.assertEqual(len(list(iter_archived(server_id=1))), 13)
+
+        # Rollups rebuilt for archived days still see every probe
+        with get_engine().begin() as conn:
+            self.assertEqual(rebuild_rollups(conn, datetime(2024, 3, 12), datetime(2024, 3, 14)), 25)
+        with session_scope() as session:
+            self.assertEqual(uptime_by_server(session, datetime(2024, 3, 12)), {1: 84.62, 2: 83.33})
+
+        # Retention drops archived days along with the raw logs
+        set_setting("retention_ping_logs_days", "7")
+        report = enforce_retention(now=datetime(2024, 3, 19, 12), pause=0)
+        self.assertEqual(report["archived_days"], 0)
+        report = enforce_retention(now=datetime(2024, 3, 20, 12), pause=0)
+        self.assertEqual(report["archived_days"], 1)
+        self.assertEqual({row.timestamp.day for row in iter_archived()}, {13})
+
+class TestPartitions(DatabaseTestCase):
+    def setUp(self):
+        patcher = mock.patch("db.partitions.PING_LOG_PARTITIONS", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        self.directory = partition_dir(get_engine())
+        with session_scope() as session:
+            session.add(Server(name="srv", ip_address="10.0.0.1"))
+
+    def write(self, timestamps, months=()):
+        engine = db.init_db.get_writer_engine()
+        with engine.connect() as conn:
+            # Old months only exist once something created them; the current one is created on begin
+            for month in months:
+                db.partitions.attach_months(conn.connection.dbapi_connection, self.directory, [month], create=True)
+            with conn.begin():
+                write_batch(conn, [ProbeRecord(1, timestamp, True, 5.0) for timestamp in timestamps])
+
+    def test_rows_land_in_their_month(self):
+        now = datetime.utcnow()
+        old = [datetime(2024, 1, 10, 12), datetime(2024, 2, 10, 12)]
+        legacy = datetime(2023, 12, 31, 12)
+        self.write(old + [legacy, now], months=["2024-01", "2024-02"])
+
+        self.assertEqual(list_partitions(self.directory), ["2024-01", "2024-02", month_of(now)])
+        with session_scope() as session:
+            # Only the month without a partition went to the main table
+            self.assertEqual([log.timestamp for log in session.query(PingLog).all()], [legacy])
+
+        with get_engine().connect() as conn:
+            rows = ping_log_page(conn, limit=10)
+            self.assertEqual([row.timestamp for row in rows], [legacy] + old + [now])
+            self.assertEqual(rows[1].id >> ID_SHIFT, 2024 * 12)
+            self.assertEqual(len({row.id for row in rows}), 4)
+            # A range only attaches the months it overlaps
+            self.assertEqual(attach_partitions(conn, datetime(2024, 2, 1), datetime(2024, 2, 15)), ["2024-02"])
+            page = ping_log_page(conn, start=datetime(2024, 2, 1), end=datetime(2024, 3, 1))
+            self.assertEqual([row.timestamp for row in page], old[1:])
+
+        tracker = AlertTracker(down_threshold=2)
+        with session_scope() as session:
+            tracker.load(session, [1])
+        self.assertEqual(tracker._states[1].successes, 2)
+
+    def test_expired_months_are_unlinked(self):
+        self.write([datetime(2024, 1, 10, 12), datetime(2024, 2, 28, 12), datetime(2024, 3, 5, 12)],
+                   months=["2024-01", "2024-02", "2024-03"])
+        set_setting("retention_ping_logs_days", "7")
+
+        report = enforce_retention(now=datetime(2024, 3, 10, 12), pause=0)
+
+        self.assertEqual(report["ping_log_partitions"], 2)
+        self.assertNotIn("2024-01", list_partitions(self.directory))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "2024-02.db")))
+        with get_engine().connect() as conn:
+            self.assertEqual([row.timestamp for row in ping_log_page(conn)], [datetime(2024, 3, 5, 12)])
+        with session_scope() as session:
+            self.assertEqual(uptime_by_server(session, datetime(2024, 1, 1)), {1: 100.0})
+
+    def test_only_the_writer_creates_months_with_the_main_journal(self):
+        with mock.patch.object(db.init_db, "SQLITE_TUNING", True):
+            configure_db(f"sqlite:///{os.path.join(self.tmpdir.name, 'tuned.db')}")
+            self.directory = partition_dir(get_engine())
+            with get_engine().begin() as conn:
+                conn.exec_driver_sql("SELECT 1")
+            self.assertEqual(list_partitions(self.directory), [])
+
+            now = datetime.utcnow()
+            with db.init_db.get_writer_engine().begin() as conn:
+                alias = db.partitions.alias_of(month_of(now))
+                self.assertEqual(conn.exec_driver_sql(f"PRAGMA {alias}.journal_mode").scalar(), "wal")
+                self.assertEqual(conn.exec_driver_sql(f"PRAGMA {alias}.synchronous").scalar(), 1)
+            self.assertEqual(list_partitions(self.directory), [month_of(now)])
+
+    def test_dropped_months_are_detached_from_pooled_connections(self):
+        self.write([datetime(2024, 1, 10, 12)], months=["2024-01"])
+        with get_engine().connect() as conn:
+            self.assertEqual(attach_partitions(conn), ["2024-01", month_of(datetime.utcnow())])
+
+        self.assertEqual(db.partitions.drop_expired_partitions(db.init_db.get_writer_engine(), datetime(2024, 2, 1)), ["2024-01"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "2024-01.db")))
+        for engine in (get_engine(), db.init_db.get_writer_engine()):
+            with engine.connect() as conn:
+                aliases = [row[1] for row in conn.exec_driver_sql("PRAGMA database_list")]
+                self.assertNotIn("ping_logs_2024_01", aliases)
+
+class TestBulkServers(DatabaseTestCase):
+    CSV = (
+        "name,ip_address,ping_interval,is_active,check_type,port\n"
+        "web-1,10.0.0.1,30,yes,,\n"
+        "web-2,10.0.0.2,,,tcp,\n"
+        "web-3,not-an-ip,,,,\n"
+        "web-1,10.0.0.9,,,,\n"
+        "db-1,10.0.1.1,,no,tcp,5432\n"
+    )
+
+    def servers(self):
+        with session_scope() as session:
+            return {s.name: (s.ip_address, s.ping_interval, s.is_active, s.port) for s in session.query(Server)}
+
+    def test_import_reports_row_errors_and_upserts_by_name(self):
+        report = import_servers(iter_rows(io.StringIO(self.CSV), "csv"), chunk_size=2).to_dict()
+        self.assertEqual((report["inserted"], report["error_count"]), (2, 3))
+        self.assertEqual([(e["row"], e["name"]) for e in report["errors"]], [(2, "web-2"), (3, "web-3"), (4, "web-1")])
+        self.assertEqual(self.servers(), {"web-1": ("10.0.0.1", 30, True, None), "db-1": ("10.0.1.1", 60, False, 5432)})
+
+        # Only the fields a row gives are changed; JSON is parsed across small reads
+        changes = '[{"name": "web-1", "ping_interval": 90},\n{"name": "db-1", "port": 5432}, {"name": "new", "ip_address": "::1"}]'
+        report = import_servers(iter_json_rows(io.StringIO(changes), chunk_size=7)).to_dict()
+        self.assertEqual((report["inserted"], report["updated"], report["unchanged"]), (1, 1, 1))
+        self.assertEqual(self.servers()["web-1"], ("10.0.0.1", 90, True, None))
+
+        report = import_servers(iter_rows(io.StringIO('{"name": "new", "ip_address": "::2"}\n'), "json"), mode="insert")
+        self.assertEqual(report.errors[0]["error"], "A server with this name already exists")
+
+    def test_update_and_deactivate(self):
+        import_servers(iter_rows(io.StringIO(self.CSV), "csv"))
+        report = update_servers(enumerate([
+            {"name": "web-1", "ip_address": "10.0.0.10"},
+            {"name": "db-1", "check_type": "icmp"},
+            {"name": "db-1", "ping_interval": 0},
+            {"name": "missing", "is_active": False},
+        ], start=1))
+        self.assertEqual((report.counts["updated"], report.error_count), (2, 2))
+        self.assertEqual(self.servers()["web-1"][0], "10.0.0.10")
+
+        report = deactivate_servers(["web-1", "missing"])
+        self.assertEqual((report.counts["deactivated"], report.errors[0]["name"]), (1, "missing"))
+        self.assertFalse(self.servers()["web-1"][2])
+
+    def test_rows_are_validated_before_the_write_transaction(self):
+        writer = get_writer_engine()
+        def rows(rows):
+            for row in rows:
+                # The writer connection (and its BEGIN IMMEDIATE lock) is not held while parsing
+                self.assertEqual(writer.pool.checkedout(), 0)
+                yield row
+        # Valid rows wait in a temporary file, not in memory
+        with mock.patch("db.bulk.tempfile.TemporaryFile", wraps=tempfile.TemporaryFile) as staged:
+            self.assertEqual(import_servers(rows(iter_rows(io.StringIO(self.CSV), "csv"))).counts["inserted"], 2)
+            self.assertEqual(update_servers(rows(iter_json_rows(io.StringIO('[{"name": "db-1", "ip_address": "::1"}]')))).counts["updated"], 1)
+        self.assertEqual(staged.call_count, 2)
+        self.assertEqual(self.servers()["db-1"], ("::1", 60, False, 5432))
+
+    def test_malformed_input_writes_nothing(self):
+        with self.assertRaises(BulkError):
+            import_servers(iter_json_rows(io.StringIO('[{"name": "a", "ip_address": "10.0.0.1"}, {"name": ')))
+        self.assertEqual(self.servers(), {})
+
+class TestLatencySketch(unittest.TestCase):
+    def test_quantiles_are_within_relative_accuracy(self):
+        sketch = LatencySketch(0.02)
+        values = [0.5 + i * 0.37 for i in range(5000)]
+        for value in values:
+            sketch.add(value)
+        for q in (0.5, 0.95, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - expected) / expected, 0.02)
+
+    def test_merge_and_round_trip(self):
+        left, right, both = LatencySketch(), LatencySketch(), LatencySketch()
+        for i in range(1, 200):
+            (left if i % 2 else right).add(float(i))
+            both.add(float(i))
+        left.merge(LatencySketch.from_string(right.to_string()))
+        self.assertEqual(left.count, both.count)
+        self.assertEqual(left.quantile(0.95), both.quantile(0.95))
+        self.assertIsNone(LatencySketch().quantile(0.5))
+
+    def test_compact_encoding(self):
+        sketch = LatencySketch()
+        for i in range(1, 2000):
+            sketch.add(i * 0.25)
+        sketch.add(0)
+        encoded = sketch.to_string()
+        decoded = LatencySketch.from_string(encoded)
+        self.assertEqual((decoded.bins, decoded.zero_count, decoded.count), (sketch.bins, 1, 2000))
+        self.assertLess(len(encoded), 3 * len(sketch.bins))
+
+    def test_rescaled_keeps_counts_and_accuracy_bound(self):
+        sketch = LatencySketch(0.02)
+        for i in range(1, 1000):
+            sketch.add(i * 0.5)
+        sketch.add(0)
+        rescaled = sketch.rescaled(0.01)
+        self.assertEqual((rescaled.relative_accuracy, rescaled.count, rescaled.zero_count), (0.01, 1000, 1))
+        expected = sketch.quantile(0.95)
+        self.assertLessEqual(abs(rescaled.quantile(0.95) - expected) / expected, 0.01)
+
+class TestLatencyPercentiles(DatabaseTestCase):
+    def test_cover_range_uses_coarse_buckets_inside(self):
+        segments = cover_range(datetime(2024, 1, 1, 10, 17, 30), datetime(2024, 1, 4, 5, 3))
+        self.assertEqual(segments, [
+            ("1m", datetime(2024, 1, 1, 10, 17), datetime(2024, 1, 1, 11)),
+            ("1h", datetime(2024, 1, 1, 11), datetime(2024, 1, 2)),
+            ("1d", datetime(2024, 1, 2), datetime(2024, 1, 4)),
+            ("1h", datetime(2024, 1, 4), datetime(2024, 1, 4, 5)),
+            ("1m", datetime(2024, 1, 4, 5), datetime(2024, 1, 4, 5, 3)),
+        ])
+
+    def test_percentiles_merge_across_time_and_servers(self):
+        with session_scope() as session:
+            session.add_all([Server(name=f"srv{i}", ip_address=f"10.0.0.{i}") for i in (1, 2)])
+        t0 = datetime(2024, 1, 1, 22, 30)
+        records = [
+            ProbeRecord(1 + i % 2, t0 + timedelta(minutes=7 * i), True, 1.0 + (i * 37) % 400 + (i % 2) * 100)
+            for i in range(1500)
+        ]
+        with get_engine().begin() as conn:
+            write_batch(conn, records)
+
+        start, end = t0 + timedelta(minutes=45), t0 + timedelta(days=6, hours=3)
+        inside = [r for r in records if start <= r.timestamp < end]
+        with get_engine().connect() as conn:
+            result = latency_percentiles(conn, start, end, per_server=True, finest="1m")
+            server_two = latency_percentiles(conn, start, end, server_ids=[2], finest="1m")
+
+        self.assertEqual(result["count"], len(inside))
+        for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            values = sorted(r.response_time for r in inside)
+            expected = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(result[label] - expected) / expected, 0.02)
+        self.assertEqual(result["servers"][2], server_two)
+        self.assertEqual(server_two["count"], sum(1 for r in inside if r.server_id == 2))
+
+    def test_changed_accuracy_does_not_break_rollups_or_percentiles(self):
+        with session_scope() as session:
+            session.add(Server(name="srv1", ip_address="10.0.0.1"))
+        t0 = datetime(2024, 1, 1, 10, 0)
+        with get_engine().begin() as conn:
+            write_batch(conn, [ProbeRecord(1, t0 + timedelta(minutes=i), True, 10.0 + i) for i in range(120)])
+        # SKETCH_RELATIVE_ACCURACY changed between two runs of the agent
+        with mock.patch.object(LatencySketch.__init__, "__defaults__", (0.01,)):
+            with get_engine().begin() as conn:
+                # Into the same hour and day buckets as before, and new minute buckets
+                write_batch(conn, [ProbeRecord(1, t0 + timedelta(minutes=120 + i), True, 50.0) for i in range(30)])
+            with get_engine().connect() as conn:
+                hourly = latency_percentiles(conn, t0, t0 + timedelta(hours=3), finest="1h")
+                with self.assertLogs(level="WARNING"):
+                    minutes = latency_percentiles(conn, t0, t0 + timedelta(minutes=150), finest="1m")
+        # 10:00 and 11:00 are at the old accuracy, 12:00 at the new one: whichever is read first is kept
+        self.assertIn(hourly["count"], (120, 30))
+        self.assertIn(minutes["count"], (120, 30))
+        with session_scope() as session:
+            day = session.query(PingRollup).filter_by(resolution="1d").one()
+            self.assertEqual(LatencySketch.from_string(day.latency_sketch).count, 150)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+from telemetry.metrics import Counter, Gauge, Histogram, MultiProcessRegistry, Registry, start_metrics_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_sums_across_threads(self):
+        counter = Counter("probes_total", "Probes.", ["result"], registry=self.registry)
+        child = counter.labels("success")
+
+        def work():
+            for _ in range(10000):
+                child.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(child.value(), 80000)
+        self.assertIn('probes_total{result="success"} 80000', self.registry.render())
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        text = self.registry.render()
+        self.assertIn("# TYPE latency_seconds histogram", text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("latency_seconds_count 4", text)
+        self.assertIn("latency_seconds_sum 3.65", text)
+
+    def test_gauge_callback_and_label_escaping(self):
+        gauge = Gauge("queue_depth", "Depth.", registry=self.registry)
+        gauge.set_function(lambda: 7)
+        Counter("hits_total", "Hits.", ["route"], registry=self.registry).labels('/a"b').inc()
+
+        text = self.registry.render()
+        self.assertIn("queue_depth 7", text)
+        self.assertIn('hits_total{route="/a\\"b"} 1', text)
+
+    def test_duplicate_and_unlabelled_use_are_rejected(self):
+        counter = Counter("dup_total", "Dup.", ["kind"], registry=self.registry)
+        with self.assertRaises(ValueError):
+            Counter("dup_total", "Dup.", registry=self.registry)
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_metrics_server(self):
+        Counter("served_total", "Served.", registry=self.registry).inc(3)
+        server = start_metrics_server(0, "127.0.0.1", registry=self.registry)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode()
+                self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+            self.assertIn("served_total 3", body)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_metrics_server_port_in_use(self):
+        first = start_metrics_server(0, "127.0.0.1", registry=self.registry)
+        try:
+            with self.assertLogs(level="ERROR"):
+                self.assertIsNone(start_metrics_server(first.server_address[1], "127.0.0.1", registry=self.registry))
+        finally:
+            first.shutdown()
+            first.server_close()
+
+class TestMultiProcessRegistry(unittest.TestCase):
+    def worker(self, code, directory):
+        """Run `code` in another process that writes its snapshot to `directory`, and stays alive."""
+        script = (
+            "import sys, time\n"
+            "from telemetry.metrics import Counter, Histogram, MultiProcessRegistry, REGISTRY\n"
+            "hits = Counter('hits_total', 'Hits.', ['route'])\n"
+            "latency = Histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))\n"
+            f"{code}\n"
+            f"MultiProcessRegistry({directory!r}).write()\n"
+            "print('ready', flush=True)\n"
+            "sys.stdin.read()\n"
+        )
+        process = subprocess.Popen([sys.executable, "-c", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   cwd=ROOT, text=True)
+        self.assertEqual(process.stdout.readline().strip(), "ready")
+        return process
+
+    def test_scrape_adds_up_every_live_process(self):
+        registry = Registry()
+        hits = Counter("hits_total", "Hits.", ["route"], registry=registry)
+        latency = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+        hits.labels("/").inc(2)
+        latency.observe(0.05)
+        with tempfile.TemporaryDirectory() as directory:
+            other = self.worker("hits.labels('/').inc(3); hits.labels('/x').inc(); latency.observe(0.5)", directory)
+            try:
+                text = MultiProcessRegistry(directory, registry).render()
+                self.assertIn('hits_total{route="/"} 5', text)
+                self.assertIn('hits_total{route="/x"} 1', text)
+                self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+                self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+                self.assertIn("latency_seconds_count 2", text)
+            finally:
+                other.communicate("")
+            # The snapshot of a process that exited is dropped
+            text = MultiProcessRegistry(directory, registry).render()
+            self.assertIn('hits_total{route="/"} 2', text)
+            self.assertNotIn("/x", text)
+            self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+if __name__ == "__main__":
+    unittest.main()